@@ -0,0 +1,398 @@
+"""JSON API для заметок (/api/v1) с пакетными операциями"""
+import json
+import os
+import zlib
+from csv import Error as CSVError
+from datetime import datetime
+
+from flask import Blueprint, Response, current_app, jsonify, request, session, stream_with_context
+from sqlalchemy import insert, update, delete, select
+from sqlalchemy.exc import SQLAlchemyError
+
+import http_cache
+import ratelimit
+import transfer
+from cache import mark_notes_changed, note_cache
+from models import db, Note, load_owned_note, forget_owned_note
+from revisions import delete_revisions, list_revisions, load_revision, record_revisions
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# Максимальное число элементов в одном пакетном запросе
+BATCH_LIMIT = int(os.getenv('API_BATCH_LIMIT', '10000'))
+
+TITLE_MAX_LENGTH = 100
+
+# Заметок в одной транзакции импорта и в одной выборке экспорта
+IMPORT_BATCH_SIZE = int(os.getenv('API_IMPORT_BATCH_SIZE', '1000'))
+EXPORT_BATCH_SIZE = 500
+# Сколько ошибок импорта перечисляется в ответе (считаются все)
+IMPORT_ERROR_LIMIT = 100
+
+
+def note_to_dict(note, with_content=True):
+    data = {
+        'id': note.id,
+        'title': note.title,
+        'date': note.date.isoformat() if note.date else None,
+    }
+    if with_content:
+        data['content'] = note.content
+    return data
+
+
+def error(message, status):
+    return jsonify({'error': message}), status
+
+
+def validate_fields(item, partial=False):
+    """Проверка полей заметки по тем же правилам, что и NoteForm.
+
+    Возвращает (поля, None) или (None, текст ошибки).
+    """
+    if not isinstance(item, dict):
+        return None, 'Ожидается JSON объект'
+    fields = {}
+    if 'title' in item or not partial:
+        title = item.get('title')
+        if not isinstance(title, str) or not title.strip():
+            return None, 'Заголовок обязателен'
+        if len(title) > TITLE_MAX_LENGTH:
+            return None, 'Заголовок должен быть от 1 до 100 символов'
+        fields['title'] = title
+    if 'content' in item or not partial:
+        content = item.get('content')
+        if not isinstance(content, str) or not content:
+            return None, 'Содержание обязательно'
+        fields['content'] = content
+    if partial and not fields:
+        return None, 'Нет полей для обновления'
+    return fields, None
+
+
+def get_owned_note(note_id):
+    return load_owned_note(note_id, session['user_id'])
+
+
+@api.before_request
+def require_json_session():
+    if session.get('user_id') is None:
+        return error('Требуется авторизация', 401)
+    # Изменяющие запросы принимаются только с Content-Type: application/json
+    # (или типом импорта) либо заголовком X-Requested-With, даже без тела:
+    # кросс-доменная форма не может отправить ни то, ни другое без CORS
+    # preflight, поэтому CSRF токен не нужен. Тело не читается: импорт
+    # разбирает его потоком
+    if request.method in ('POST', 'PUT', 'PATCH', 'DELETE') and not (
+        request.is_json
+        or 'X-Requested-With' in request.headers
+        or (request.endpoint == 'api.import_notes' and request.mimetype in transfer.IMPORT_FORMATS)
+    ):
+        return error('Ожидается Content-Type: application/json', 415)
+
+
+@api.route('/notes', methods=['GET'])
+def list_notes():
+    user_id = session['user_id']
+    cursor = request.args.get('cursor')
+    etag = http_cache.page_etag('api', user_id, note_cache.version(user_id), cursor,
+                                current_app.config['NOTES_PAGE_SIZE'], current_app.config['NOTE_EXCERPT_LENGTH'])
+    response = http_cache.not_modified(etag)
+    if response is not None:
+        return response
+    notes, next_cursor = note_cache.get_page(user_id, cursor)
+    return http_cache.revalidate(jsonify({
+        'notes': [
+            {'id': note.id, 'title': note.title, 'date': note.date.isoformat(), 'excerpt': note.excerpt}
+            for note in notes
+        ],
+        'next_cursor': next_cursor,
+    }), etag)
+
+
+@api.route('/notes', methods=['POST'])
+def create_note():
+    fields, message = validate_fields(request.get_json(silent=True))
+    if message:
+        return error(message, 400)
+    note = Note(user_id=session['user_id'], **fields)
+    db.session.add(note)
+    db.session.commit()
+    return jsonify(note_to_dict(note)), 201
+
+
+@api.route('/notes/<int:note_id>', methods=['GET'])
+def get_note(note_id):
+    note = get_owned_note(note_id)
+    if note is None:
+        return error('Заметка не найдена', 404)
+    return jsonify(note_to_dict(note))
+
+
+@api.route('/notes/<int:note_id>', methods=['PUT', 'PATCH'])
+def update_note(note_id):
+    fields, message = validate_fields(request.get_json(silent=True), partial=request.method == 'PATCH')
+    if message:
+        return error(message, 400)
+    note = get_owned_note(note_id)
+    if note is None:
+        return error('Заметка не найдена', 404)
+    for name, value in fields.items():
+        setattr(note, name, value)
+    db.session.commit()
+    return jsonify(note_to_dict(note))
+
+
+@api.route('/notes/<int:note_id>', methods=['DELETE'])
+def delete_note(note_id):
+    note = get_owned_note(note_id)
+    if note is None:
+        return error('Заметка не найдена', 404)
+    db.session.delete(note)
+    db.session.commit()
+    forget_owned_note(note_id, session['user_id'])
+    return '', 204
+
+
+@api.route('/notes/export', methods=['GET'])
+def export_notes():
+    """Все заметки пользователя в NDJSON или CSV (?format=), с ?compress=gzip - сжатые.
+
+    Строки читаются курсором порциями по EXPORT_BATCH_SIZE (на PostgreSQL -
+    серверным) и отдаются по мере кодирования.
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in transfer.EXPORT_TYPES:
+        return error('Формат экспорта: ndjson или csv', 400)
+    compressed = request.args.get('compress') == 'gzip'
+    query = select(Note.id, Note.title, Note.date, Note.content).where(
+        Note.user_id == session['user_id']
+    ).order_by(Note.date, Note.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+    def generate():
+        yield from transfer.export_chunks(db.session.execute(query), fmt, compressed)
+
+    filename = f"notes.{fmt}.gz" if compressed else f"notes.{fmt}"
+    response = Response(stream_with_context(generate()),
+                        mimetype='application/gzip' if compressed else transfer.EXPORT_TYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def validate_import_item(item):
+    fields, message = validate_fields(item)
+    if message:
+        return None, message
+    date = item.get('date')
+    if date is not None:
+        try:
+            fields['date'] = datetime.fromisoformat(date)
+        except (TypeError, ValueError):
+            return None, 'Некорректная дата'
+    return fields, None
+
+
+@api.route('/notes/import', methods=['POST'])
+@ratelimit.limit('import_notes', user=os.getenv('RATELIMIT_IMPORT_USER', '10/hour'))
+def import_notes():
+    """Импорт заметок из NDJSON или CSV (Content-Type), с Content-Encoding: gzip - сжатых.
+
+    Тело разбирается по мере чтения, заметки добавляются транзакциями по
+    IMPORT_BATCH_SIZE. Ответ - NDJSON: после каждой транзакции строка
+    {"imported", "failed"}, в конце {"done": true, ..., "errors"}; при
+    ошибке в середине уже зафиксированные заметки остаются, а в последней
+    строке есть поле "error".
+    """
+    fmt = transfer.IMPORT_FORMATS.get(request.mimetype)
+    if fmt is None:
+        return error('Ожидается Content-Type: application/x-ndjson или text/csv', 415)
+    encoding = request.headers.get('Content-Encoding', 'identity').lower()
+    if encoding not in ('identity', 'gzip'):
+        return error('Поддерживается только Content-Encoding: gzip', 415)
+    items = transfer.parse(fmt, request.stream, compressed=encoding == 'gzip')
+    user_id = session['user_id']
+
+    def write(rows):
+        db.session.execute(insert(Note), rows)
+        mark_notes_changed(db.session, user_id)
+        db.session.commit()
+
+    def generate():
+        result = {'done': True, 'imported': 0, 'failed': 0, 'errors': []}
+        rows = []
+        try:
+            try:
+                for line, item, message in items:
+                    if message is None:
+                        fields, message = validate_import_item(item)
+                    if message:
+                        result['failed'] += 1
+                        if len(result['errors']) < IMPORT_ERROR_LIMIT:
+                            result['errors'].append({'line': line, 'error': message})
+                        continue
+                    rows.append(dict(fields, user_id=user_id))
+                    if len(rows) >= IMPORT_BATCH_SIZE:
+                        write(rows)
+                        result['imported'] += len(rows)
+                        rows = []
+                        yield json.dumps({'imported': result['imported'], 'failed': result['failed']}) + '\n'
+            except (ValueError, CSVError, zlib.error) as e:
+                # Поврежденный поток: корректные заметки до места ошибки сохраняются
+                result['error'] = f'Ошибка разбора: {e}'
+            if rows:
+                write(rows)
+                result['imported'] += len(rows)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            result['error'] = f'Ошибка при сохранении заметок: {e}'
+        yield json.dumps(result, ensure_ascii=False) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@api.route('/notes/<int:note_id>/revisions', methods=['GET'])
+def get_revisions(note_id):
+    note = get_owned_note(note_id)
+    if note is None:
+        return error('Заметка не найдена', 404)
+    return jsonify({
+        'revisions': [
+            {'number': row.number, 'title': row.title, 'created': row.created.isoformat(),
+             'snapshot': row.snapshot}
+            for row in list_revisions(note_id)
+        ],
+    })
+
+
+@api.route('/notes/<int:note_id>/revisions/<int:number>', methods=['GET'])
+def get_revision(note_id, number):
+    note = get_owned_note(note_id)
+    if note is None:
+        return error('Заметка не найдена', 404)
+    revision = load_revision(note, number)
+    if revision is None:
+        return error('Версия не найдена', 404)
+    title, content = revision
+    return jsonify({'number': number, 'title': title, 'content': content})
+
+
+@api.route('/notes/<int:note_id>/revisions/<int:number>/restore', methods=['POST'])
+def restore_revision(note_id, number):
+    """Восстановление версии; текущая версия при этом сама сохраняется в истории"""
+    note = get_owned_note(note_id)
+    if note is None:
+        return error('Заметка не найдена', 404)
+    revision = load_revision(note, number)
+    if revision is None:
+        return error('Версия не найдена', 404)
+    note.title, note.content = revision
+    db.session.commit()
+    return jsonify(note_to_dict(note))
+
+
+@api.route('/notes/batch', methods=['POST'])
+def batch_notes():
+    """Пакетное создание, обновление и удаление заметок в одной транзакции.
+
+    Тело запроса: {"create": [{title, content}], "update": [{id, title?, content?}],
+    "delete": [id, ...]}. Некорректные элементы пропускаются и попадают в "errors"
+    с указанием операции и индекса, корректные применяются.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return error('Ожидается JSON объект', 400)
+    to_create = payload.get('create') or []
+    to_update = payload.get('update') or []
+    to_delete = payload.get('delete') or []
+    if not all(isinstance(items, list) for items in (to_create, to_update, to_delete)):
+        return error('Поля create, update и delete должны быть списками', 400)
+    if len(to_create) + len(to_update) + len(to_delete) > BATCH_LIMIT:
+        return error(f'Не более {BATCH_LIMIT} элементов в одном запросе', 413)
+
+    user_id = session['user_id']
+    errors = []
+
+    create_rows = []
+    for index, item in enumerate(to_create):
+        fields, message = validate_fields(item)
+        if message:
+            errors.append({'op': 'create', 'index': index, 'error': message})
+            continue
+        create_rows.append(dict(fields, user_id=user_id))
+
+    update_rows = []
+    for index, item in enumerate(to_update):
+        fields, message = validate_fields(item, partial=True)
+        # bool - подкласс int: True не должен означать заметку 1
+        if not message and type(item.get('id')) is not int:
+            message = 'Не указан id заметки'
+        if message:
+            errors.append({'op': 'update', 'index': index, 'error': message})
+            continue
+        update_rows.append((index, dict(fields, id=item['id'])))
+
+    delete_ids = []
+    for index, note_id in enumerate(to_delete):
+        if type(note_id) is not int:
+            errors.append({'op': 'delete', 'index': index, 'error': 'Не указан id заметки'})
+            continue
+        delete_ids.append((index, note_id))
+
+    # Принадлежность всех затронутых заметок проверяется одним запросом
+    requested_ids = {row['id'] for _, row in update_rows} | {note_id for _, note_id in delete_ids}
+    owned_ids = set()
+    if requested_ids:
+        owned_ids = set(db.session.scalars(
+            select(Note.id).where(Note.user_id == user_id, Note.id.in_(requested_ids))
+        ))
+
+    for op, items in (('update', update_rows), ('delete', delete_ids)):
+        for index, item in items:
+            note_id = item['id'] if op == 'update' else item
+            if note_id not in owned_ids:
+                errors.append({'op': op, 'index': index, 'error': 'Заметка не найдена'})
+    update_rows = [row for _, row in update_rows if row['id'] in owned_ids]
+    delete_ids = [note_id for _, note_id in delete_ids if note_id in owned_ids]
+
+    created_ids = []
+    try:
+        if create_rows:
+            created_ids = list(db.session.scalars(
+                insert(Note).returning(Note.id, sort_by_parameter_order=True), create_rows
+            ))
+        if update_rows:
+            # Массовый UPDATE не вызывает события маппера: прежние версии сохраняются явно
+            previous = {
+                row.id: row for row in db.session.execute(
+                    select(Note.id, Note.title, Note.content).where(Note.id.in_([row['id'] for row in update_rows]))
+                )
+            }
+            changes = []
+            for row in update_rows:
+                old = previous[row['id']]
+                new_content = row.get('content', old.content)
+                if new_content != old.content or row.get('title', old.title) != old.title:
+                    changes.append((old.id, old.title, old.content,
+                                    new_content if new_content != old.content else None))
+            record_revisions(db.session.connection(), changes)
+            db.session.execute(update(Note), update_rows)
+        if delete_ids:
+            delete_revisions(db.session.connection(), delete_ids)
+            db.session.execute(
+                delete(Note).where(Note.user_id == user_id, Note.id.in_(delete_ids)),
+                execution_options={'synchronize_session': False},
+            )
+        # Кэш списка сбрасывается после фиксации (события маппера здесь не вызываются)
+        mark_notes_changed(db.session, user_id)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return error(f'Ошибка при выполнении пакетной операции: {str(e)}', 500)
+
+    return jsonify({
+        'created': created_ids,
+        'updated': [row['id'] for row in update_rows],
+        'deleted': delete_ids,
+        'errors': errors,
+    })
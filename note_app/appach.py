@@ -1,9 +1,13 @@
 import logging
 from logging.handlers import RotatingFileHandler
 from flask import Flask, request, jsonify, render_template
-import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 from datetime import datetime
+import json
 import os
+import threading
+
+from log_pipeline import BufferedFileHandler, LogPipeline
 
 app = Flask(__name__)
 
@@ -12,7 +16,40 @@ handler = RotatingFileHandler('flask_app.log', maxBytes=10000, backupCount=3)
 handler.setLevel(logging.INFO)
 formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [IP: %(client_ip)s] - %(message)s')
 handler.setFormatter(formatter)
-app.logger.addHandler(handler)
+handler.addFilter(logging.Filter(app.logger.name))
+
+# text - строки 'timestamp - level - [IP: x] - message', json - JSON строки для SIEMMonitor
+LOG_FORMAT = os.getenv('APP_LOG_FORMAT', 'text')
+# direct - запись в потоке запроса: application.log открыт постоянно, событие - один
+# os.write. queue - очередь и пакетная запись в фоновом потоке; на малом числе
+# ядер поток записи конкурирует с запросами за GIL и увеличивает p99, поэтому
+# включается явно (см. benchmarks/bench_logging.py)
+LOG_MODE = os.getenv('APP_LOG_MODE', 'direct')
+LOG_BUFFER_SIZE = int(os.getenv('APP_LOG_BUFFER_SIZE', str(64 * 1024)))
+LOG_FLUSH_INTERVAL = float(os.getenv('APP_LOG_FLUSH_INTERVAL', '0.5'))
+
+# Общий лог событий (его читает SIEMMonitor): строка уже отформатирована в log_event.
+# Без фонового потока буфер некому сбрасывать по таймеру, поэтому он не используется
+application_handler = BufferedFileHandler(
+    'application.log',
+    buffer_size=LOG_BUFFER_SIZE if LOG_MODE == 'queue' else 0,
+    flush_interval=LOG_FLUSH_INTERVAL,
+)
+application_handler.setFormatter(logging.Formatter('%(message)s'))
+application_handler.addFilter(logging.Filter('application'))
+
+event_logger = logging.getLogger('application')
+event_logger.setLevel(logging.INFO)
+event_logger.propagate = False
+
+if LOG_MODE == 'queue':
+    log_pipeline = LogPipeline([application_handler, handler], flush_interval=LOG_FLUSH_INTERVAL)
+    app.logger.addHandler(log_pipeline.handler)
+    event_logger.addHandler(log_pipeline.handler)
+else:
+    log_pipeline = None
+    app.logger.addHandler(handler)
+    event_logger.addHandler(application_handler)
 
 # Конфигурация БД
 DB_CONFIG = {
@@ -22,6 +59,12 @@ DB_CONFIG = {
     'password': 'password123'
 }
 
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '4'))
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
 
 class CustomLogger:
     @staticmethod
@@ -29,31 +72,57 @@ class CustomLogger:
         if ip is None:
             ip = request.remote_addr if request else 'unknown'
 
-        log_message = f"{datetime.now().isoformat()} - {level} - [IP: {ip}] - {message}"
+        timestamp = datetime.now().isoformat()
+        if LOG_FORMAT == 'json':
+            log_message = json.dumps(
+                {'ts': timestamp, 'level': level, 'ip': ip, 'message': message}, ensure_ascii=False
+            )
+        else:
+            log_message = f"{timestamp} - {level} - [IP: {ip}] - {message}"
 
         # Запись в общий лог
-        with open('application.log', 'a') as f:
-            f.write(log_message + '\n')
+        event_logger.info(log_message)
 
         # Также логируем через стандартный логгер Flask
+        extra = {'client_ip': ip}
         if level == 'ERROR':
-            app.logger.error(f"{message} - IP: {ip}")
+            app.logger.error(f"{message} - IP: {ip}", extra=extra)
         elif level == 'WARNING':
-            app.logger.warning(f"{message} - IP: {ip}")
+            app.logger.warning(f"{message} - IP: {ip}", extra=extra)
         else:
-            app.logger.info(f"{message} - IP: {ip}")
+            app.logger.info(f"{message} - IP: {ip}", extra=extra)
+
+
+def get_db_pool():
+    """Пул соединений процесса, создается при первом обращении"""
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, **DB_CONFIG)
+                CustomLogger.log_event('INFO', 'Database connection pool established')
+    return _db_pool
+
+
+def reset_db_pool():
+    """Сброс пула после fork: соединения родителя не закрываем, а просто забываем"""
+    global _db_pool
+    _db_pool = None
 
 
 def get_db_connection():
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        CustomLogger.log_event('INFO', 'Database connection established')
-        return conn
+        return get_db_pool().getconn()
     except Exception as e:
         CustomLogger.log_event('ERROR', f'Database connection failed: {str(e)}')
         return None
 
 
+def release_db_connection(conn):
+    # Пул сам откатывает незавершенную транзакцию и закрывает сломанные соединения
+    get_db_pool().putconn(conn, close=conn.closed)
+
+
 @app.route('/')
 def index():
     CustomLogger.log_event('INFO', 'Accessed home page')
@@ -81,14 +150,14 @@ def login():
                 CustomLogger.log_event('INFO', 'Successful login')
                 return jsonify({'status': 'success'})
             else:
-                CustomLogger.log_event('WARNING', 'Failed login attempt')
+                CustomLogger.log_event('WARNING', f'Failed login attempt - username: {username}')
                 return jsonify({'status': 'failure'})
 
         except Exception as e:
             CustomLogger.log_event('ERROR', f'Login error: {str(e)}')
             return jsonify({'status': 'error'})
         finally:
-            conn.close()
+            release_db_connection(conn)
 
     return jsonify({'status': 'error'})
 
@@ -0,0 +1,88 @@
+"""Скорость записи событий SIEM в PostgreSQL (event_store.py).
+
+Генерируется поток разобранных строк лога (часть - с символами, требующими
+экранирования в COPY) и измеряются:
+- add(): стоимость постановки события в очередь в потоке обработки лога;
+- encode_events(): форматирование пакета для COPY;
+- с --dsn: устойчивая запись в базу, от первого add() до подтвержденной
+  фиксации последнего пакета, и время отчета за день SQL агрегатами.
+
+Запуск: python benchmarks/bench_event_store.py --events 1000000 [--dsn "dbname=siem user=siem"]
+        [--batch-size 20000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_store import EventStore, encode_events
+from siem_parser import LogRecord
+
+MESSAGES = [
+    'Request: GET / - 200',
+    'Request: POST /add - 302',
+    'Failed login attempt - username: admin',
+    "Suspicious input: id=1' OR 1=1--",
+    'Request: GET /search?q=a\tb - 200',
+    'Traceback:\n  File "app.py", line 1',
+]
+
+
+def generate_records(count, seed=1):
+    rng = random.Random(seed)
+    start = datetime.now().replace(microsecond=0) - timedelta(seconds=count // 1000)
+    records = []
+    for index in range(count):
+        timestamp = start + timedelta(milliseconds=index)
+        ip = f"192.168.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+        message = rng.choice(MESSAGES)
+        records.append(LogRecord(timestamp, 'INFO', ip, message, ''))
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Скорость записи событий SIEM в PostgreSQL')
+    parser.add_argument('--events', type=int, default=1000000)
+    parser.add_argument('--batch-size', type=int, default=20000)
+    parser.add_argument('--dsn', help='строка подключения к PostgreSQL; без нее - только форматирование')
+    args = parser.parse_args()
+
+    records = generate_records(args.events)
+    rows = [(record.timestamp, record.ip, record.level, record.message) for record in records]
+    print(f"Событий: {args.events}, размер пакета: {args.batch_size}, ядер: {os.cpu_count()}")
+
+    start = time.perf_counter()
+    for offset in range(0, len(rows), args.batch_size):
+        encode_events(rows[offset:offset + args.batch_size])
+    elapsed = time.perf_counter() - start
+    print(f"{'encode_events':<22}{args.events / elapsed:>14,.0f} событий/с")
+
+    if not args.dsn:
+        return
+
+    store = EventStore(args.dsn, batch_size=args.batch_size, max_buffer=args.events)
+    start = time.perf_counter()
+    add = store.add
+    for record in records:
+        add(record)
+    added = time.perf_counter() - start
+    store.flush(timeout=600)
+    elapsed = time.perf_counter() - start
+    stats = store.stats()
+    print(f"{'add()':<22}{args.events / added:>14,.0f} событий/с")
+    print(f"{'запись в PostgreSQL':<22}{stats['written'] / elapsed:>14,.0f} событий/с   "
+          f"записано: {stats['written']}, отброшено: {stats['dropped']}, ошибок: {stats['errors']}")
+
+    start = time.perf_counter()
+    report = store.report(records[0].timestamp, records[-1].timestamp + timedelta(seconds=1))
+    print(f"{'отчет за период':<22}{(time.perf_counter() - start) * 1000:>14,.1f} мс   "
+          f"запросов: {report['requests']}")
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Сравнение профилей воркеров gunicorn (GUNICORN_PROFILE) на текущей машине.
+
+Для каждого профиля запускается gunicorn с gunicorn_config.py, заданное число
+клиентов в замкнутом цикле (следующий запрос после ответа на предыдущий)
+выполняет сценарии из loadtest.py, после чего измеряется память всех процессов
+gunicorn: PSS (общие страницы copy-on-write делятся между процессами) и RSS.
+
+Запуск: python benchmarks/bench_gunicorn_profiles.py --profiles sync,gthread,gevent --clients 32 --duration 20
+        [--preload] [--database-url postgresql://... --reset-db]
+
+Перед каждым профилем все таблицы базы удаляются и заполняются заново,
+поэтому --database-url требует флага --reset-db.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import (ConnectionPool, LoadTest, Session, free_port, percentile,
+                      seed_database, start_server)
+
+
+def child_pids(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def process_memory_kb(pid):
+    """(PSS, RSS) процесса в килобайтах"""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                name, _, rest = line.partition(':')
+                if name in ('Pss', 'Rss'):
+                    values[name] = int(rest.split()[0])
+    except OSError:
+        pass
+    return values.get('Pss', 0), values.get('Rss', 0)
+
+
+def gunicorn_memory(master_pid):
+    pids = [master_pid] + child_pids(master_pid)
+    pss = rss = 0
+    for pid in pids:
+        process_pss, process_rss = process_memory_kb(pid)
+        pss += process_pss
+        rss += process_rss
+    return len(pids), pss, rss
+
+
+async def closed_loop(port, owned, clients, duration, sessions, seed):
+    pool = ConnectionPool('127.0.0.1', port, clients)
+    users = [
+        Session(username, f"password{username[len('user'):]}", note_ids)
+        for username, note_ids in list(owned.items())[:sessions]
+    ]
+    load = LoadTest(pool, users, seed=seed)
+    await load.prepare()
+
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        while time.perf_counter() < deadline:
+            name = load.rng.choices(load.scenarios, load.weights)[0]
+            await load.scenario(name, None)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(value for values in load.latencies.values() for value in values)
+    return {
+        'requests': len(latencies),
+        'errors': sum(load.errors.values()),
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение профилей воркеров gunicorn')
+    parser.add_argument('--profiles', default='sync,gthread,gevent')
+    parser.add_argument('--clients', type=int, default=32, help='одновременных клиентов')
+    parser.add_argument('--duration', type=float, default=20, help='длительность замера, секунд')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--notes', type=int, default=200)
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--preload', action='store_true', help='GUNICORN_PRELOAD=true')
+    parser.add_argument('--database-url', help='по умолчанию временный файл SQLite')
+    parser.add_argument('--reset-db', action='store_true',
+                        help='удалять все таблицы базы из --database-url перед каждым профилем')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    if args.database_url and not args.reset_db:
+        parser.error('все таблицы базы из --database-url будут удалены, подтвердите флагом --reset-db')
+
+    workdir = tempfile.mkdtemp(prefix='bench_profiles_')
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'notes.db')}"
+    os.environ.setdefault('METRICS_DIR', os.path.join(workdir, 'metrics'))
+    print(f"Ядер: {os.cpu_count()}, клиентов: {args.clients}, база: {database_url.split('@')[-1]}, "
+          f"preload: {args.preload}")
+    print(f"{'профиль':<10}{'процессов':>10}{'запр/с':>9}{'p50 мс':>9}{'p99 мс':>9}{'ошибок':>8}"
+          f"{'PSS МБ':>9}{'RSS МБ':>9}")
+
+    for profile in args.profiles.split(','):
+        # Каждый профиль стартует с одинаковыми данными
+        owned = seed_database(database_url, args.users, args.notes, seed=args.seed, reset=True)
+        os.environ['GUNICORN_PROFILE'] = profile
+        os.environ['GUNICORN_PRELOAD'] = 'true' if args.preload else 'false'
+        port = free_port()
+        try:
+            process, _ = start_server(port, database_url, 'gunicorn')
+        except RuntimeError as e:
+            print(f"{profile:<10}не запустился: {e}")
+            continue
+        try:
+            time.sleep(1)
+            result = asyncio.run(closed_loop(port, owned, args.clients, args.duration, args.sessions, args.seed))
+            processes, pss, rss = gunicorn_memory(process.pid)
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        print(f"{profile:<10}{processes:>10}{result['throughput']:>9.1f}{result['p50_ms']:>9.1f}"
+              f"{result['p99_ms']:>9.1f}{result['errors']:>8}{pss / 1024:>9.1f}{rss / 1024:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Сравнение задержки запроса с разными логгерами appach.py.
+
+Старый логгер открывает application.log на каждое событие. direct держит файл
+открытым и пишет событие одним os.write в потоке запроса (APP_LOG_MODE=direct),
+queue ставит событие в очередь фонового потока (APP_LOG_MODE=queue).
+
+Запуск: python benchmarks/bench_logging.py [число запросов]
+"""
+import logging
+import logging.handlers
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def legacy_log_event(appach, level, message, ip=None):
+    """Реализация CustomLogger.log_event до перехода на очередь"""
+    from flask import request
+    if ip is None:
+        ip = request.remote_addr if request else 'unknown'
+
+    log_message = f"{datetime.now().isoformat()} - {level} - [IP: {ip}] - {message}"
+
+    with open('application.log', 'a') as f:
+        f.write(log_message + '\n')
+
+    if level == 'ERROR':
+        appach.app.logger.error(f"{message} - IP: {ip}", extra={'client_ip': ip})
+    elif level == 'WARNING':
+        appach.app.logger.warning(f"{message} - IP: {ip}", extra={'client_ip': ip})
+    else:
+        appach.app.logger.info(f"{message} - IP: {ip}", extra={'client_ip': ip})
+
+
+def measure(client, requests_count):
+    latencies = []
+    for _ in range(requests_count):
+        start = time.perf_counter()
+        client.get('/admin')
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {
+        'p50_us': statistics.median(latencies) * 1e6,
+        'p99_us': latencies[int(len(latencies) * 0.99) - 1] * 1e6,
+        'rps': requests_count / sum(latencies),
+    }
+
+
+def main():
+    requests_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    workdir = tempfile.mkdtemp(prefix='bench_logging_')
+    os.chdir(workdir)
+
+    os.environ['APP_LOG_MODE'] = 'direct'
+    import appach
+    from flask.logging import default_handler
+    from log_pipeline import BufferedFileHandler, LogPipeline
+    client = appach.app.test_client()
+    # Вывод в stderr одинаков для всех вариантов и только зашумляет замер
+    appach.app.logger.removeHandler(default_handler)
+
+    # Старый путь: открытие файла на каждое событие
+    log_event = appach.CustomLogger.log_event
+    appach.CustomLogger.log_event = staticmethod(
+        lambda level, message, ip=None: legacy_log_event(appach, level, message, ip)
+    )
+    appach.event_logger.removeHandler(appach.application_handler)
+    legacy = measure(client, requests_count)
+    appach.CustomLogger.log_event = log_event
+
+    # direct: файл открыт постоянно, запись в потоке запроса
+    appach.event_logger.addHandler(appach.application_handler)
+    direct = measure(client, requests_count)
+    appach.event_logger.removeHandler(appach.application_handler)
+    appach.app.logger.removeHandler(appach.handler)
+
+    # queue: очередь и пакетная запись в фоне
+    buffered_handler = BufferedFileHandler('application.log', flush_interval=appach.LOG_FLUSH_INTERVAL)
+    buffered_handler.setFormatter(appach.application_handler.formatter)
+    buffered_handler.addFilter(logging.Filter('application'))
+    pipeline = LogPipeline([buffered_handler, appach.handler], flush_interval=appach.LOG_FLUSH_INTERVAL)
+    appach.app.logger.addHandler(pipeline.handler)
+    appach.event_logger.addHandler(pipeline.handler)
+    queued = measure(client, requests_count)
+    pipeline.stop()
+    appach.application_handler.close()
+
+    with open('application.log') as f:
+        written = sum(1 for _ in f)
+
+    print(f"Запросов на вариант: {requests_count}, каталог: {workdir}")
+    print(f"{'логгер':<12}{'p50, мкс':>12}{'p99, мкс':>12}{'запросов/с':>14}")
+    for name, result in (('старый', legacy), ('direct', direct), ('queue', queued)):
+        print(f"{name:<12}{result['p50_us']:>12.1f}{result['p99_us']:>12.1f}{result['rps']:>14.0f}")
+    print(f"Строк в application.log: {written} (ожидается {requests_count * 3}), "
+          f"отброшено очередью: {pipeline.stats()['dropped']}")
+
+
+if __name__ == '__main__':
+    main()
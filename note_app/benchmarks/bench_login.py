@@ -0,0 +1,89 @@
+"""Пропускная способность проверки паролей при разной стоимости scrypt.
+
+Для каждого значения n заданное число клиентов в замкнутом цикле проверяет
+пароль через credentials.Verifier (тот же пул, что и при входе в
+приложение). Выводится число успешных проверок в секунду, задержка
+p50/p99 и доля отказов CredentialsBusy (ответ 503 в приложении).
+
+Запуск: python benchmarks/bench_login.py --costs 4096,16384,65536 --clients 16 --duration 10
+        [--workers 2] [--queue 8]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from credentials import CredentialsBusy, Params, Verifier, hash_password
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import percentile
+
+
+def run(params, clients, duration, workers, queue_limit):
+    verifier = Verifier(workers=workers, queue_limit=queue_limit, params=params)
+    stored = hash_password('password', params)
+    latencies = []
+    rejected = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                ok, _ = verifier.verify(stored, 'password')
+                assert ok
+            except CredentialsBusy:
+                with lock:
+                    rejected[0] += 1
+                # Клиент повторяет попытку после паузы, как по Retry-After
+                time.sleep(0.01)
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'logins': len(latencies),
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'rejected': rejected[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Пропускная способность проверки паролей')
+    parser.add_argument('--costs', default='4096,16384,65536', help='значения n scrypt через запятую')
+    parser.add_argument('-r', type=int, default=8)
+    parser.add_argument('-p', type=int, default=1)
+    parser.add_argument('--clients', type=int, default=16, help='одновременных попыток входа')
+    parser.add_argument('--duration', type=float, default=10, help='длительность замера, секунд')
+    parser.add_argument('--workers', type=int, default=2, help='PASSWORD_HASH_WORKERS')
+    parser.add_argument('--queue', type=int, default=8, help='PASSWORD_HASH_QUEUE')
+    args = parser.parse_args()
+
+    print(f"Ядер: {os.cpu_count()}, клиентов: {args.clients}, потоков пула: {args.workers}, "
+          f"очередь: {args.queue}")
+    print(f"{'n':>8}{'память МБ':>11}{'входов/с':>10}{'p50 мс':>9}{'p99 мс':>9}{'отказов':>9}")
+    for cost in args.costs.split(','):
+        params = Params(int(cost), args.r, args.p)
+        result = run(params, args.clients, args.duration, args.workers, args.queue)
+        memory = 128 * params.n * params.r * params.p / 1024 / 1024
+        print(f"{params.n:>8}{memory:>11.0f}{result['throughput']:>10.1f}{result['p50_ms']:>9.1f}"
+              f"{result['p99_ms']:>9.1f}{result['rejected']:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Задержка обнаружения атак SIEM: от записи строки в лог до доставки алерта.
+
+Отдельный процесс пишет в application.log синтетический поток обычных
+запросов и атак (SQL инъекции и серии неудачных входов) с заданной
+интенсивностью. Монитор читает файл так же, как в рабочем режиме (LogTailer,
+inotify), а тестовый приемник алертов фиксирует момент доставки. Задержка -
+разница между доставкой и временем события в строке лога.
+
+Запуск: python benchmarks/bench_siem_latency.py --rate 5000 --duration 10 --attack-ratio 0.01 [--workers 2]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loadtest import percentile
+from siem_alerts import AlertSink
+from siem_monitor import SIEMMonitor
+
+BRUTE_FORCE_BURST = 5
+
+
+class LatencySink(AlertSink):
+    """Приемник, запоминающий задержку доставки каждого алерта"""
+
+    name = 'latency'
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.latencies = []
+        self.types = Counter()
+
+    def write_batch(self, alerts):
+        now = time.time()
+        for alert in alerts:
+            self.latencies.append(now - alert.event_time.timestamp())
+            self.types[alert.alert_type] += 1
+
+
+def write_log(path, rate, duration, attack_ratio, seed, expected):
+    """Запись строк с постоянной интенсивностью; expected - счетчик ожидаемых алертов"""
+    rng = random.Random(seed)
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+    written = 0
+    attack = 0
+    start = time.monotonic()
+    while True:
+        elapsed = time.monotonic() - start
+        if elapsed >= duration:
+            break
+        due = int(rate * elapsed) - written
+        if due <= 0:
+            time.sleep(0.005)
+            continue
+        lines = []
+        timestamp = datetime.now().isoformat()
+        while len(lines) < due:
+            if rng.random() >= attack_ratio:
+                ip = f"192.168.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+                lines.append(f"{timestamp} - INFO - [IP: {ip}] - Request: GET / - 200")
+                continue
+            attack += 1
+            ip = f"10.{attack // 65536 % 256}.{attack // 256 % 256}.{attack % 256}"
+            if attack % 2:
+                lines.append(f"{timestamp} - WARNING - [IP: {ip}] - Suspicious input: id=1' OR 1=1--")
+                expected['SQL_INJECTION'] += 1
+            else:
+                lines.extend(
+                    f"{timestamp} - WARNING - [IP: {ip}] - Failed login attempt - username: victim{attack}"
+                    for _ in range(BRUTE_FORCE_BURST)
+                )
+                expected['BRUTE_FORCE'] += 1
+        os.write(fd, ('\n'.join(lines) + '\n').encode())
+        written += len(lines)
+    os.close(fd)
+    expected['lines'] = written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Задержка обнаружения атак SIEM')
+    parser.add_argument('--rate', type=float, default=5000, help='строк лога в секунду')
+    parser.add_argument('--duration', type=float, default=10, help='длительность записи, секунд')
+    parser.add_argument('--attack-ratio', type=float, default=0.01, help='доля строк, начинающих атаку')
+    parser.add_argument('--workers', type=int, default=1, help='процессов обработки в мониторе')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_siem_latency_')
+    path = os.path.join(workdir, 'application.log')
+    open(path, 'w').close()
+
+    sink = LatencySink(max_queue=1000000)
+    monitor = SIEMMonitor(checkpoint_file=None, alert_sinks=[sink], stats_db=None,
+                          alert_dedup_window=timedelta(0))
+    monitor.log_file = path
+    threading.Thread(target=monitor.monitor, kwargs={'workers': args.workers}, daemon=True).start()
+    time.sleep(0.5)
+
+    manager = multiprocessing.Manager()
+    expected = manager.dict({'SQL_INJECTION': 0, 'BRUTE_FORCE': 0, 'lines': 0})
+    writer = multiprocessing.Process(
+        target=write_log, args=(path, args.rate, args.duration, args.attack_ratio, args.seed, expected)
+    )
+    writer.start()
+    writer.join()
+
+    expected_alerts = expected['SQL_INJECTION'] + expected['BRUTE_FORCE']
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline and sum(sink.types.values()) < expected_alerts:
+        time.sleep(0.05)
+    monitor.close()
+
+    latencies = sorted(sink.latencies)
+    print(f"\nСтрок записано: {expected['lines']} ({expected['lines'] / args.duration:,.0f} строк/с), "
+          f"обработано монитором: {monitor.stats['total_requests']}, воркеров: {args.workers}, "
+          f"ядер: {os.cpu_count()}")
+    print(f"Алертов ожидалось: {expected_alerts} "
+          f"(SQL_INJECTION {expected['SQL_INJECTION']}, BRUTE_FORCE {expected['BRUTE_FORCE']}), "
+          f"доставлено: {dict(sink.types)}")
+    if latencies:
+        print(f"Задержка обнаружения, мс: p50 {percentile(latencies, 0.5) * 1000:.1f}, "
+              f"p95 {percentile(latencies, 0.95) * 1000:.1f}, p99 {percentile(latencies, 0.99) * 1000:.1f}, "
+              f"max {latencies[-1] * 1000:.1f}")
+
+
+if __name__ == '__main__':
+    main()
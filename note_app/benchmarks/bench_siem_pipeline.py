@@ -0,0 +1,76 @@
+"""Масштабирование SIEM обработки по числу процессов.
+
+Синтетический лог (обычные запросы, неудачные входы, SQL инъекции, доступ к
+защищенным эндпоинтам) обрабатывается последовательно и через SIEMPipeline
+с разным числом воркеров. Алерты только подсчитываются, без вывода.
+
+Запуск: python benchmarks/bench_siem_pipeline.py [число строк] [воркеры через запятую]
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from siem_monitor import SIEMMonitor
+from siem_pipeline import SIEMPipeline
+
+MESSAGES = [
+    (0.70, 'Accessed home page'),
+    (0.10, "Login attempt - SQL: SELECT * FROM users WHERE username = 'alice' AND password = 'secret'"),
+    (0.10, 'Failed login attempt - username: admin'),
+    (0.05, 'Attempt to access admin panel /admin - Access denied'),
+    (0.05, "Login attempt - SQL: SELECT * FROM users WHERE username = 'x' OR 1=1--' AND password = ''"),
+]
+
+
+def generate_lines(count, seed=1):
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    weights = [weight for weight, _ in MESSAGES]
+    texts = [text for _, text in MESSAGES]
+    lines = []
+    for index in range(count):
+        timestamp = (start + timedelta(milliseconds=index)).isoformat()
+        ip = f"10.0.{rng.randrange(256)}.{rng.randrange(256)}"
+        message = rng.choices(texts, weights)[0]
+        level = 'WARNING' if 'Failed' in message else 'INFO'
+        lines.append(f"{timestamp} - {level} - [IP: {ip}] - {message}")
+    return lines
+
+
+class CountingMonitor(SIEMMonitor):
+    def __init__(self):
+        super().__init__(checkpoint_file=None, stats_db=None)
+        self.alerts = 0
+
+    def trigger_alert(self, alert_type, description, log_entry):
+        self.alerts += 1
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 400000
+    worker_counts = [int(n) for n in sys.argv[2].split(',')] if len(sys.argv) > 2 else [2, 4, os.cpu_count()]
+    lines = generate_lines(count)
+    print(f"Строк: {count}, ядер: {os.cpu_count()}")
+
+    monitor = CountingMonitor()
+    start = time.perf_counter()
+    for line in lines:
+        monitor.process_line(line)
+    serial_rate = count / (time.perf_counter() - start)
+    print(f"{'последовательно':<20}{serial_rate:>14,.0f} строк/с   алертов: {monitor.alerts}")
+
+    for workers in sorted(set(worker_counts)):
+        monitor = CountingMonitor()
+        start = time.perf_counter()
+        SIEMPipeline(monitor, workers).run(iter(lines))
+        rate = count / (time.perf_counter() - start)
+        print(f"{f'воркеров: {workers}':<20}{rate:>14,.0f} строк/с   алертов: {monitor.alerts}"
+              f"   ускорение: {rate / serial_rate:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Скорость повторного анализа логов на одном ядре.
+
+Синтетический лог (с ротированной копией в gzip) измеряется в трех режимах:
+только чтение и разбиение на строки, чтение с разбором строк и полный анализ
+всеми детекторами.
+
+Запуск: python benchmarks/bench_siem_replay.py [число строк]
+"""
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_siem_pipeline import CountingMonitor, generate_lines
+from siem_replay import read_log_lines
+
+
+def timed(name, count, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<32}{count / elapsed:>14,.0f} строк/с")
+    return result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    workdir = tempfile.mkdtemp(prefix='bench_replay_')
+    path = os.path.join(workdir, 'application.log')
+
+    lines = generate_lines(count)
+    half = count // 2
+    with gzip.open(f"{path}.1.gz", 'wt') as f:
+        f.write('\n'.join(lines[:half]) + '\n')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines[half:]) + '\n')
+    del lines
+
+    print(f"Строк: {count} (половина в {os.path.basename(path)}.1.gz)")
+    read = timed('чтение и разбиение на строки', count, lambda: sum(1 for _ in read_log_lines([path])))
+    assert read == count, read
+
+    monitor = CountingMonitor()
+    timed('чтение и разбор строк', count,
+          lambda: sum(1 for line in read_log_lines([path]) if monitor.parse_log_line(line)))
+
+    monitor = CountingMonitor()
+    timed('полный анализ', count, lambda: [monitor.process_line(line) for line in read_log_lines([path])])
+    print(f"Алертов: {monitor.alerts}")
+    shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,444 @@
+"""Нагрузочное тестирование приложения заметок.
+
+Скрипт создает базу (DATABASE_URL или временный файл SQLite), заполняет ее
+N пользователями по M заметок, запускает приложение (gunicorn, если он
+установлен, иначе многопоточный сервер werkzeug) и подает запросы с
+фиксированной интенсивностью (открытая модель: запросы отправляются по
+расписанию, не дожидаясь ответов на предыдущие). Задержка считается от
+запланированного момента отправки, поэтому очередь на стороне клиента тоже
+попадает в p95/p99. Для каждого маршрута выводятся p50/p95/p99 и пропускная
+способность.
+
+Сценарии: вход, список заметок, поиск, добавление, редактирование, удаление.
+
+Запуск: python benchmarks/loadtest.py --users 50 --notes 200 --rates 20,50,100 --duration 30
+
+Все таблицы базы, указанной в --database-url, удаляются перед заполнением,
+поэтому такой запуск требует флага --reset-db.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from urllib.parse import quote, urlencode
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+CSRF_RE = re.compile(rb'name="csrf_token" type="hidden" value="([^"]+)"')
+
+WORDS = [
+    'проект', 'встреча', 'отчет', 'бюджет', 'релиз', 'тест', 'сервер', 'база', 'поиск', 'заметка',
+    'идея', 'план', 'задача', 'ошибка', 'клиент', 'договор', 'deploy', 'backup', 'metrics', 'review',
+]
+
+# Доли сценариев в общем потоке запросов
+SCENARIO_WEIGHTS = {
+    'list': 40,
+    'search': 15,
+    'add': 15,
+    'edit': 15,
+    'delete': 5,
+    'login': 10,
+}
+
+
+def percentile(sorted_values, fraction):
+    """Перцентиль по методу ближайшего ранга"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def random_text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def seed_database(database_url, users, notes_per_user, seed=1, reset=False):
+    """Создание схемы и тестовых данных. Возвращает {username: [id заметок]}.
+
+    reset=True удаляет все таблицы приложения; без него непустая база не
+    заполняется.
+    """
+    from sqlalchemy import create_engine, insert, inspect
+    if not reset:
+        # Проверка до импорта app: он сразу создает таблицы
+        engine = create_engine(database_url)
+        tables = inspect(engine).get_table_names()
+        engine.dispose()
+        if tables:
+            raise RuntimeError(f"База {database_url.split('@')[-1]} не пуста, для очистки укажите --reset-db")
+    os.environ['DATABASE_URL'] = database_url
+    from app import app
+    from credentials import hash_password
+    from models import db, Note, User
+
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    owned = {}
+    with app.app_context():
+        if reset:
+            db.drop_all()
+        db.create_all()
+        db.session.execute(insert(User), [
+            {'username': f"user{index}", 'password': hash_password(f"password{index}")} for index in range(users)
+        ])
+        user_ids = dict(db.session.query(User.username, User.id))
+        for index in range(users):
+            username = f"user{index}"
+            rows = [
+                {
+                    'title': random_text(rng, 3),
+                    'content': random_text(rng, 60),
+                    'date': now - timedelta(minutes=rng.randint(0, 60 * 24 * 365)),
+                    'user_id': user_ids[username],
+                }
+                for _ in range(notes_per_user)
+            ]
+            ids = db.session.execute(insert(Note).returning(Note.id, sort_by_parameter_order=True), rows)
+            owned[username] = [row.id for row in ids]
+        db.session.commit()
+    return owned
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, database_url, server):
+    env = dict(os.environ, DATABASE_URL=database_url, PYTHONPATH=APP_DIR)
+    # Все клиенты нагрузочного теста приходят с одного адреса
+    env.setdefault('RATELIMIT_ENABLED', 'false')
+    if server == 'auto':
+        server = 'gunicorn' if shutil.which('gunicorn') else 'werkzeug'
+    if server == 'gunicorn':
+        command = ['gunicorn', '-c', 'gunicorn_config.py', '--bind', f"127.0.0.1:{port}",
+                   '--access-logfile', '/dev/null', 'app:app']
+    else:
+        command = [sys.executable, os.path.abspath(__file__), '--serve', str(port)]
+    process = subprocess.Popen(command, cwd=APP_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return process, server
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f"Сервер {server} завершился с кодом {process.returncode}")
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('Сервер не запустился за 30 секунд')
+
+
+def serve(port):
+    """Многопоточный сервер werkzeug с keep-alive (когда gunicorn не установлен)"""
+    from werkzeug.serving import WSGIRequestHandler, run_simple
+    from app import app
+
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+    run_simple('127.0.0.1', port, app, threaded=True, use_reloader=False)
+
+
+class HTTPConnection:
+    """Минимальный HTTP/1.1 клиент на asyncio с keep-alive"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, headers, body=b''):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        head = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}"]
+        head += [f"{name}: {value}" for name, value in headers.items()]
+        if body:
+            head.append(f"Content-Length: {len(body)}")
+        self.writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+        try:
+            return await self._read_response()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self.close()
+            raise
+
+    async def _read_response(self):
+        raw_head = await self.reader.readuntil(b'\r\n\r\n')
+        lines = raw_head.decode('latin-1').split('\r\n')
+        version, status = lines[0].split(' ', 2)[:2]
+        headers = defaultdict(list)
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()].append(value.strip())
+
+        if 'content-length' in headers:
+            body = await self.reader.readexactly(int(headers['content-length'][0]))
+        elif 'chunked' in ','.join(headers.get('transfer-encoding', [])):
+            parts = []
+            while True:
+                size = int((await self.reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                if size == 0:
+                    await self.reader.readuntil(b'\r\n')
+                    break
+                parts.append(await self.reader.readexactly(size))
+                await self.reader.readexactly(2)
+            body = b''.join(parts)
+        else:
+            body = await self.reader.read()
+            self.close()
+
+        connection = ','.join(headers.get('connection', [])).lower()
+        if 'close' in connection or (version == 'HTTP/1.0' and 'keep-alive' not in connection):
+            self.close()
+        return int(status), headers, body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.reader = None
+
+
+class ConnectionPool:
+    def __init__(self, host, port, size):
+        self.host = host
+        self.port = port
+        self.idle = asyncio.Queue()
+        for _ in range(size):
+            self.idle.put_nowait(HTTPConnection(host, port))
+
+    async def request(self, method, path, headers, body=b''):
+        connection = await self.idle.get()
+        try:
+            return await connection.request(method, path, headers, body)
+        finally:
+            self.idle.put_nowait(connection)
+
+
+class Session:
+    """Cookie и CSRF токен одного пользователя"""
+
+    def __init__(self, username, password, note_ids):
+        self.username = username
+        self.password = password
+        self.note_ids = list(note_ids)
+        self.cookies = {}
+        self.csrf_token = None
+
+    def headers(self, extra=None):
+        headers = {'Connection': 'keep-alive'}
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f"{name}={value}" for name, value in self.cookies.items())
+        if extra:
+            headers.update(extra)
+        return headers
+
+    def update(self, headers, body):
+        for cookie in headers.get('set-cookie', []):
+            name, _, rest = cookie.partition('=')
+            value = rest.split(';', 1)[0]
+            if value:
+                self.cookies[name] = value
+            else:
+                self.cookies.pop(name, None)
+        match = CSRF_RE.search(body)
+        if match:
+            self.csrf_token = match.group(1).decode()
+
+
+class LoadTest:
+    def __init__(self, pool, sessions, seed=1):
+        self.pool = pool
+        self.sessions = sessions
+        self.rng = random.Random(seed)
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.scenarios = list(SCENARIO_WEIGHTS)
+        self.weights = list(SCENARIO_WEIGHTS.values())
+
+    async def send(self, session, route, method, path, form=None, expected=(200,), scheduled=None):
+        body = urlencode(form).encode() if form is not None else b''
+        extra = {'Content-Type': 'application/x-www-form-urlencoded'} if form is not None else None
+        start = scheduled if scheduled is not None else time.perf_counter()
+        try:
+            status, headers, response_body = await self.pool.request(method, path, session.headers(extra), body)
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            self.errors[route] += 1
+            return None
+        self.latencies[route].append(time.perf_counter() - start)
+        if status not in expected:
+            self.errors[route] += 1
+        session.update(headers, response_body)
+        return status
+
+    async def login(self, session, scheduled=None):
+        session.cookies.clear()
+        await self.send(session, 'GET /login', 'GET', '/login', scheduled=scheduled)
+        await self.send(session, 'POST /login', 'POST', '/login', {
+            'csrf_token': session.csrf_token or '',
+            'username': session.username,
+            'password': session.password,
+        }, expected=(302,))
+
+    async def prepare(self):
+        """Вход всех пользователей до начала измерений"""
+        await asyncio.gather(*(self.login(session) for session in self.sessions))
+        self.latencies.clear()
+        self.errors.clear()
+
+    async def scenario(self, name, scheduled):
+        session = self.rng.choice(self.sessions)
+        rng = self.rng
+        if name == 'delete' and not session.note_ids:
+            name = 'list'
+        if name == 'list':
+            await self.send(session, 'GET /', 'GET', '/', scheduled=scheduled)
+        elif name == 'search':
+            await self.send(session, 'GET /search', 'GET', f"/search?q={quote(rng.choice(WORDS))}",
+                            scheduled=scheduled)
+        elif name == 'add':
+            await self.send(session, 'POST /add', 'POST', '/add', {
+                'csrf_token': session.csrf_token, 'title': random_text(rng, 3), 'content': random_text(rng, 60),
+            }, expected=(302,), scheduled=scheduled)
+        elif name == 'edit':
+            note_id = rng.choice(session.note_ids) if session.note_ids else 0
+            await self.send(session, 'POST /edit/<id>', 'POST', f"/edit/{note_id}", {
+                'csrf_token': session.csrf_token, 'title': random_text(rng, 3), 'content': random_text(rng, 60),
+            }, expected=(302,), scheduled=scheduled)
+        elif name == 'delete':
+            note_id = session.note_ids.pop(rng.randrange(len(session.note_ids)))
+            await self.send(session, 'GET /delete/<id>', 'GET', f"/delete/{note_id}",
+                            expected=(302,), scheduled=scheduled)
+        elif name == 'login':
+            # Отдельная cookie, чтобы не разлогинить параллельные запросы этого пользователя
+            await self.login(Session(session.username, session.password, []), scheduled=scheduled)
+
+    async def run(self, rate, duration):
+        """Запросы с постоянной интенсивностью rate в секунду в течение duration секунд"""
+        self.latencies.clear()
+        self.errors.clear()
+        tasks = []
+        start = time.perf_counter()
+        for index in range(int(rate * duration)):
+            scheduled = start + index / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            name = self.rng.choices(self.scenarios, self.weights)[0]
+            tasks.append(asyncio.create_task(self.scenario(name, scheduled)))
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - start
+
+    def summary(self, elapsed):
+        result = {}
+        for route in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies[route])
+            result[route] = {
+                'count': len(values),
+                'errors': self.errors[route],
+                'throughput': len(values) / elapsed,
+                'p50_ms': percentile(values, 0.50) * 1000,
+                'p95_ms': percentile(values, 0.95) * 1000,
+                'p99_ms': percentile(values, 0.99) * 1000,
+            }
+        return result
+
+
+def print_summary(rate, elapsed, summary):
+    print(f"\nИнтенсивность: {rate} запр/с, длительность: {elapsed:.1f} с")
+    print(f"{'маршрут':<18}{'запросов':>10}{'ошибок':>8}{'запр/с':>9}{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}")
+    for route, stats in summary.items():
+        print(f"{route:<18}{stats['count']:>10}{stats['errors']:>8}{stats['throughput']:>9.1f}"
+              f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}")
+
+
+async def run_load(args, port, owned):
+    pool = ConnectionPool('127.0.0.1', port, args.connections)
+    sessions = [
+        Session(username, f"password{username[len('user'):]}", note_ids)
+        for username, note_ids in list(owned.items())[:args.sessions]
+    ]
+    load = LoadTest(pool, sessions, seed=args.seed)
+    await load.prepare()
+    results = {}
+    for rate in args.rates:
+        elapsed = await load.run(rate, args.duration)
+        summary = load.summary(elapsed)
+        print_summary(rate, elapsed, summary)
+        results[str(rate)] = summary
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест приложения заметок')
+    parser.add_argument('--users', type=int, default=50, help='число пользователей в базе')
+    parser.add_argument('--notes', type=int, default=200, help='заметок на пользователя')
+    parser.add_argument('--sessions', type=int, default=20, help='пользователей, от имени которых идут запросы')
+    parser.add_argument('--rates', default='20,50,100', help='интенсивности, запросов в секунду')
+    parser.add_argument('--duration', type=float, default=30, help='длительность каждой ступени, секунд')
+    parser.add_argument('--connections', type=int, default=32, help='размер пула соединений клиента')
+    parser.add_argument('--server', choices=['auto', 'gunicorn', 'werkzeug'], default='auto')
+    parser.add_argument('--database-url', help='база для теста (по умолчанию временный файл SQLite)')
+    parser.add_argument('--reset-db', action='store_true',
+                        help='удалить все таблицы базы из --database-url перед заполнением')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', metavar='FILE', help='сохранить результаты в JSON')
+    parser.add_argument('--serve', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+
+    if args.database_url and not args.reset_db:
+        parser.error('все таблицы базы из --database-url будут удалены, подтвердите флагом --reset-db')
+
+    args.rates = [float(rate) for rate in args.rates.split(',')]
+    workdir = tempfile.mkdtemp(prefix='loadtest_')
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'notes.db')}"
+    os.environ.setdefault('METRICS_DIR', os.path.join(workdir, 'metrics'))
+
+    started = time.perf_counter()
+    owned = seed_database(database_url, args.users, args.notes, seed=args.seed, reset=True)
+    print(f"База: {database_url.split('@')[-1]}, {args.users} пользователей x {args.notes} заметок "
+          f"({time.perf_counter() - started:.1f} с)")
+
+    port = free_port()
+    process, server = start_server(port, database_url, args.server)
+    print(f"Сервер: {server}, порт {port}, ядер: {os.cpu_count()}")
+    try:
+        results = asyncio.run(run_load(args, port, owned))
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'server': server,
+                'users': args.users,
+                'notes_per_user': args.notes,
+                'duration': args.duration,
+                'cpu_count': os.cpu_count(),
+                'results': results,
+            }, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
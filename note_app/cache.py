@@ -0,0 +1,207 @@
+"""Кэш страниц списка заметок.
+
+Ключ страницы - (user_id, версия списка пользователя, курсор, размер страницы,
+длина фрагмента). Версия увеличивается после фиксации каждой транзакции,
+изменившей заметки пользователя, поэтому старые страницы больше не
+запрашиваются и вытесняются по LRU/TTL. Кэшируются данные страницы, а не
+HTML: шаблон рендерится на каждый запрос со свежим CSP nonce.
+
+Версии хранятся в разделяемом файле, отображенном в память (mmap): все
+воркеры gunicorn на хосте видят одно значение без запросов к БД (файл по
+умолчанию - <instance_path>/shared/cache_versions, см. shared_file.py). При
+NOTES_CACHE_REDIS_URL версии и страницы хранятся в Redis (или совместимом
+сервере) и общие для нескольких хостов.
+"""
+import json
+import struct
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from metrics import registry
+from models import Note, NoteListItem, get_notes_page
+from shared_file import SharedFile, private_path
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+VERSION = struct.Struct('<Q')
+MISSING = object()
+
+registry.describe('notes_cache_requests_total', 'counter', 'Обращения к кэшу списка заметок')
+
+
+class TTLCache:
+    """LRU кэш процесса с ограничением времени жизни записей"""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return MISSING
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SharedVersions:
+    """Счетчики версий в файле, отображенном в память всех процессов хоста.
+
+    Пользователь попадает в ячейку user_id % slots; совпадение ячеек приводит
+    лишь к лишней инвалидации.
+    """
+
+    def __init__(self, path, slots=65536):
+        self.slots = slots
+        self.file = SharedFile(path, slots * VERSION.size)
+
+    def get(self, user_id):
+        return VERSION.unpack_from(self.file.map, (user_id % self.slots) * VERSION.size)[0]
+
+    def bump(self, user_id):
+        offset = (user_id % self.slots) * VERSION.size
+        with self.file.locked() as shared:
+            VERSION.pack_into(shared, offset, VERSION.unpack_from(shared, offset)[0] + 1)
+
+
+class RedisStore:
+    """Версии и страницы в Redis: общий кэш для всех процессов и хостов"""
+
+    def __init__(self, url, ttl=300, prefix='notes:'):
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, user_id):
+        return int(self.client.get(f"{self.prefix}version:{user_id}") or 0)
+
+    def bump(self, user_id):
+        self.client.incr(f"{self.prefix}version:{user_id}")
+
+    def get_page(self, key):
+        raw = self.client.get(f"{self.prefix}page:{':'.join(map(str, key))}")
+        if raw is None:
+            return MISSING
+        data = json.loads(raw)
+        notes = [NoteListItem(id, title, datetime.fromisoformat(date), excerpt)
+                 for id, title, date, excerpt in data['notes']]
+        return notes, data['next_cursor']
+
+    def set_page(self, key, value):
+        notes, next_cursor = value
+        data = {
+            'notes': [[note.id, note.title, note.date.isoformat(), note.excerpt] for note in notes],
+            'next_cursor': next_cursor,
+        }
+        self.client.setex(f"{self.prefix}page:{':'.join(map(str, key))}", self.ttl, json.dumps(data))
+
+
+class NoteListCache:
+    def __init__(self):
+        self.enabled = False
+        self.versions = None
+        self.pages = None
+        self.redis = None
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config.get('NOTES_CACHE_ENABLED', True)
+        ttl = config.get('NOTES_CACHE_TTL', 300)
+        redis_url = config.get('NOTES_CACHE_REDIS_URL')
+        if redis_url and redis is None:
+            app.logger.warning('Пакет redis не установлен, используется локальный кэш')
+            redis_url = None
+        if redis_url:
+            self.redis = self.versions = RedisStore(redis_url, ttl)
+        else:
+            self.versions = SharedVersions(
+                config.get('NOTES_CACHE_VERSION_FILE') or private_path(app, 'cache_versions')
+            )
+            self.pages = TTLCache(config.get('NOTES_CACHE_SIZE', 1024), ttl)
+
+    def bump(self, user_id):
+        if self.versions is not None:
+            self.versions.bump(user_id)
+
+    def version(self, user_id):
+        """Текущая версия списка пользователя (меняется при каждом изменении заметок)"""
+        return self.versions.get(user_id) if self.versions is not None else 0
+
+    def get_page(self, user_id, cursor=None):
+        """Страница списка заметок из кэша или из БД (см. models.get_notes_page)"""
+        if not self.enabled:
+            return get_notes_page(user_id, cursor)
+        config = current_app.config
+        key = (user_id, self.versions.get(user_id), cursor or '',
+               config['NOTES_PAGE_SIZE'], config['NOTE_EXCERPT_LENGTH'])
+        value = self.redis.get_page(key) if self.redis else self.pages.get(key)
+        if value is not MISSING:
+            registry.inc('notes_cache_requests_total', result='hit')
+            return value
+        registry.inc('notes_cache_requests_total', result='miss')
+        value = get_notes_page(user_id, cursor)
+        if self.redis:
+            self.redis.set_page(key, value)
+        else:
+            self.pages.set(key, value)
+        return value
+
+
+note_cache = NoteListCache()
+
+
+def mark_notes_changed(session, user_id):
+    """Инвалидация списка пользователя после фиксации транзакции.
+
+    Нужна для массовых UPDATE/DELETE, которые не вызывают события маппера.
+    """
+    session.info.setdefault('notes_changed', set()).add(user_id)
+
+
+@event.listens_for(Note, 'after_insert')
+@event.listens_for(Note, 'after_update')
+@event.listens_for(Note, 'after_delete')
+def _remember_changed_notes(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        mark_notes_changed(session, target.user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_note_list_versions(session):
+    # Версия меняется только после фиксации: страница, прочитанная до нее,
+    # сохранится под старой версией и больше не будет выдана
+    for user_id in session.info.pop('notes_changed', ()):
+        note_cache.bump(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed_notes(session):
+    session.info.pop('notes_changed', None)
@@ -0,0 +1,98 @@
+"""Прозрачное сжатие больших текстовых значений в БД.
+
+Значение длиннее min_size сжимается zlib или lzma и хранится в текстовом
+столбце как маркер + base64: '\\x01z...' (zlib), '\\x01x...' (lzma). Текст,
+который сам начинается с '\\x01', хранится с маркером '\\x01p'. Значения без
+маркера читаются как есть, поэтому старые строки не требуют миграции.
+
+Сжатое значение сохраняется, только если оно короче исходного (в байтах
+UTF-8) не менее чем на 10%.
+"""
+import base64
+import lzma
+import os
+import zlib
+
+from sqlalchemy.types import Text, TypeDecorator
+
+MARKER = '\x01'
+PLAIN = 'p'
+CODECS = {
+    'z': (lambda data: zlib.compress(data, 6), zlib.decompress, zlib.decompressobj),
+    'x': (lambda data: lzma.compress(data, preset=6), lzma.decompress, lzma.LZMADecompressor),
+}
+CODEC_NAMES = {'zlib': 'z', 'lzma': 'x'}
+
+DEFAULT_CODEC = CODEC_NAMES[os.getenv('NOTE_COMPRESSION', 'zlib')]
+
+
+def compress_text(value, min_size, codec=DEFAULT_CODEC):
+    if value is None:
+        return None
+    if len(value) >= min_size:
+        raw = value.encode('utf-8')
+        packed = base64.b64encode(CODECS[codec][0](raw)).decode('ascii')
+        if len(packed) + 2 <= len(raw) * 0.9:
+            return f"{MARKER}{codec}{packed}"
+    if value.startswith(MARKER):
+        return f"{MARKER}{PLAIN}{value}"
+    return value
+
+
+def decompress_text(value):
+    if not value or not value.startswith(MARKER):
+        return value
+    codec, payload = value[1], value[2:]
+    if codec == PLAIN:
+        return payload
+    return CODECS[codec][1](base64.b64decode(payload)).decode('utf-8')
+
+
+def is_compressed(value):
+    return bool(value) and value.startswith(MARKER) and value[1:2] != PLAIN
+
+
+def text_prefix(stored_prefix, length):
+    """Первые length символов по началу хранимого значения.
+
+    Для сжатого значения распаковывается только доступное начало потока,
+    так что полное значение из БД читать не нужно.
+    """
+    if not stored_prefix or not stored_prefix.startswith(MARKER):
+        return (stored_prefix or '')[:length]
+    codec, payload = stored_prefix[1], stored_prefix[2:]
+    if codec == PLAIN:
+        return payload[:length]
+    payload = payload[:len(payload) - len(payload) % 4]
+    decompressor = CODECS[codec][2]()
+    try:
+        # UTF-8 - не больше 4 байт на символ; оборванный символ в конце отбрасывается
+        raw = decompressor.decompress(base64.b64decode(payload), length * 4)
+    except (zlib.error, lzma.LZMAError):
+        return ''
+    return raw.decode('utf-8', errors='ignore')[:length]
+
+
+class CompressedText(TypeDecorator):
+    """Text со сжатием значений длиннее min_size.
+
+    postgresql=False - не сжимать на PostgreSQL: там текст нужен как есть
+    (полнотекстовый индекс, ts_headline), а большие значения и так сжимает
+    TOAST.
+    """
+
+    impl = Text
+    cache_ok = True
+
+    def __init__(self, min_size=2048, postgresql=True, **kwargs):
+        super().__init__(**kwargs)
+        self.min_size = min_size
+        self.postgresql = postgresql
+
+    def process_bind_param(self, value, dialect):
+        if not self.postgresql and dialect.name == 'postgresql':
+            return value
+        return compress_text(value, self.min_size)
+
+    def process_result_value(self, value, dialect):
+        return decompress_text(value)
@@ -0,0 +1,163 @@
+"""Хранение и проверка паролей.
+
+Пароли хешируются scrypt (hashlib) и хранятся вместе с параметрами:
+scrypt$<n>$<r>$<p>$<соль>$<хеш> (соль и хеш в base64 без '='). Стоимость
+задается переменными окружения PASSWORD_SCRYPT_N/R/P; при входе пароль,
+захешированный с другими параметрами (или сохраненный открытым текстом
+старыми версиями), перехешируется.
+
+Хеширование выполняется в ограниченном пуле потоков процесса (hashlib.scrypt
+отпускает GIL). Если заняты все потоки и очередь PASSWORD_HASH_QUEUE, новая
+проверка сразу завершается CredentialsBusy, и приложение отвечает 503:
+поток запросов на вход не может занять весь процессор воркеров.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+SCHEME = 'scrypt'
+SALT_LENGTH = 16
+HASH_LENGTH = 32
+
+
+class CredentialsBusy(Exception):
+    """Пул проверки паролей перегружен"""
+
+
+class Params(namedtuple('Params', 'n r p')):
+    @property
+    def maxmem(self):
+        # scrypt использует 128 * n * r * p байт; запас для служебных структур OpenSSL
+        return 128 * self.n * self.r * self.p + 1024 * 1024
+
+
+def env_params():
+    return Params(
+        int(os.getenv('PASSWORD_SCRYPT_N', str(2 ** 14))),
+        int(os.getenv('PASSWORD_SCRYPT_R', '8')),
+        int(os.getenv('PASSWORD_SCRYPT_P', '1')),
+    )
+
+
+def b64encode(data):
+    return base64.b64encode(data).decode().rstrip('=')
+
+
+def b64decode(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def scrypt(password, salt, params):
+    return hashlib.scrypt(password.encode(), salt=salt, n=params.n, r=params.r, p=params.p,
+                          maxmem=params.maxmem, dklen=HASH_LENGTH)
+
+
+def hash_password(password, params=None):
+    params = params or env_params()
+    salt = secrets.token_bytes(SALT_LENGTH)
+    digest = scrypt(password, salt, params)
+    return f"{SCHEME}${params.n}${params.r}${params.p}${b64encode(salt)}${b64encode(digest)}"
+
+
+def parse_hash(stored):
+    """(параметры, соль, хеш) или None, если значение не хеш scrypt"""
+    parts = stored.split('$')
+    if len(parts) != 6 or parts[0] != SCHEME:
+        return None
+    try:
+        return Params(int(parts[1]), int(parts[2]), int(parts[3])), b64decode(parts[4]), b64decode(parts[5])
+    except ValueError:
+        return None
+
+
+def verify_password(stored, password, params=None):
+    """Проверка пароля: (верен ли пароль, новый хеш или None).
+
+    Новый хеш возвращается, если сохраненное значение нужно заменить:
+    параметры отличаются от текущих или пароль хранился открытым текстом.
+    stored=None (пользователь не найден) проверяется с той же стоимостью,
+    чтобы время ответа не выдавало существование имени.
+    """
+    params = params or env_params()
+    if stored is None:
+        scrypt(password, bytes(SALT_LENGTH), params)
+        return False, None
+    parsed = parse_hash(stored)
+    if parsed is None:
+        ok = hmac.compare_digest(stored.encode(), password.encode())
+    else:
+        stored_params, salt, digest = parsed
+        ok = hmac.compare_digest(scrypt(password, salt, stored_params), digest)
+        if ok and stored_params == params:
+            return True, None
+    return ok, hash_password(password, params) if ok else None
+
+
+class Verifier:
+    """Ограниченный пул проверки и хеширования паролей.
+
+    Одновременно выполняется не больше workers операций и ждет не больше
+    queue_limit; остальные сразу получают CredentialsBusy.
+    """
+
+    def __init__(self, workers=2, queue_limit=8, timeout=10.0, params=None):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self.params = params or env_params()
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._slots = None
+
+    def _pool(self):
+        # После fork потоки пула родителя не существуют: пул создается заново
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='credentials')
+                    self._slots = threading.BoundedSemaphore(self.workers + self.queue_limit)
+                    self._pid = os.getpid()
+        return self._executor, self._slots
+
+    def run(self, func, *args):
+        executor, slots = self._pool()
+        if not slots.acquire(blocking=False):
+            self.rejected += 1
+            raise CredentialsBusy()
+        try:
+            future = executor.submit(func, *args)
+        except BaseException:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            raise CredentialsBusy() from None
+
+    def verify(self, stored, password):
+        return self.run(verify_password, stored, password, self.params)
+
+    def hash(self, password):
+        return self.run(hash_password, password, self.params)
+
+    def stats(self):
+        in_use = 0
+        if self._slots is not None and self._pid == os.getpid():
+            in_use = self.workers + self.queue_limit - self._slots._value
+        return {'workers': self.workers, 'queue_limit': self.queue_limit,
+                'in_use': in_use, 'rejected': self.rejected}
+
+
+verifier = Verifier(
+    workers=int(os.getenv('PASSWORD_HASH_WORKERS', '2')),
+    queue_limit=int(os.getenv('PASSWORD_HASH_QUEUE', '8')),
+    timeout=float(os.getenv('PASSWORD_HASH_TIMEOUT', '10')),
+)
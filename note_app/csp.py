@@ -0,0 +1,124 @@
+"""Content-Security-Policy с nonce, создаваемым не более одного раза на запрос.
+
+Неизменяемая часть заголовка собирается заранее (для приложения при
+init_app, для маршрута с собственной политикой - при первом запросе к нему),
+на каждый ответ подставляется только nonce. Nonce создается лениво: ответы,
+в которых он не использовался (JSON, редиректы), обходятся без
+secrets.token_urlsafe и без 'nonce-...' в заголовке.
+"""
+import secrets
+
+from flask import current_app, g, request
+
+DEFAULT_DIRECTIVES = {
+    'default-src': "'self'",
+    'script-src': "'self'",
+    'style-src': "'self' 'unsafe-inline'",
+    'img-src': "'self' data:",
+    'font-src': "'self'",
+    'connect-src': "'self'",
+    'frame-ancestors': "'self'",
+    'form-action': "'self'",
+    'object-src': "'none'",
+    'base-uri': "'self'",
+}
+NONCE_DIRECTIVE = 'script-src'
+
+_route_policies = {}
+
+
+class Policy:
+    """Собранный заголовок CSP; при наличии nonce он добавляется в script-src"""
+
+    def __init__(self, directives):
+        parts = [f"{name} {value}" if value else name for name, value in directives.items()]
+        self.without_nonce = '; '.join(parts)
+        self.prefix = self.suffix = None
+        if NONCE_DIRECTIVE in directives:
+            index = list(directives).index(NONCE_DIRECTIVE)
+            self.prefix = '; '.join(parts[:index + 1])
+            self.suffix = ''.join(f"; {part}" for part in parts[index + 1:])
+
+    def header(self, nonce=None):
+        if nonce is None or self.prefix is None:
+            return self.without_nonce
+        return f"{self.prefix} 'nonce-{nonce}'{self.suffix}"
+
+
+class SecurityContext:
+    """Состояние безопасности запроса, хранится в flask.g"""
+
+    __slots__ = ('_nonce',)
+
+    def __init__(self):
+        self._nonce = None
+
+    @property
+    def nonce(self):
+        if self._nonce is None:
+            self._nonce = secrets.token_urlsafe(16)
+        return self._nonce
+
+    @property
+    def nonce_used(self):
+        return self._nonce is not None
+
+
+class LazyNonce:
+    """Значение csp_nonce в шаблонах: nonce создается при первой подстановке"""
+
+    __slots__ = ()
+
+    def __str__(self):
+        return security_context().nonce
+
+    __html__ = __str__
+
+
+def security_context():
+    context = g.get('security')
+    if context is None:
+        context = g.security = SecurityContext()
+    return context
+
+
+def route_policy(inherit=True, **directives):
+    """Политика маршрута.
+
+    Имена директив задаются с подчеркиваниями (default_src="'none'"). При
+    inherit=True они заменяют одноименные директивы приложения (None удаляет
+    директиву), при inherit=False политика состоит только из них.
+    """
+    def decorator(view):
+        view.csp_directives = {name.replace('_', '-'): value for name, value in directives.items()}
+        view.csp_inherit = inherit
+        return view
+    return decorator
+
+
+def policy_for_request():
+    view = current_app.view_functions.get(request.endpoint)
+    directives = getattr(view, 'csp_directives', None)
+    if directives is None:
+        return current_app.extensions['csp']
+    policy = _route_policies.get(view)
+    if policy is None:
+        merged = dict(current_app.config['CSP_DIRECTIVES']) if view.csp_inherit else {}
+        merged.update(directives)
+        policy = _route_policies[view] = Policy({
+            name: value for name, value in merged.items() if value is not None
+        })
+    return policy
+
+
+def header():
+    """Значение Content-Security-Policy для текущего ответа"""
+    context = g.get('security')
+    nonce = context.nonce if context is not None and context.nonce_used else None
+    return policy_for_request().header(nonce)
+
+
+def init_app(app):
+    app.config.setdefault('CSP_DIRECTIVES', dict(DEFAULT_DIRECTIVES))
+    app.extensions['csp'] = Policy(app.config['CSP_DIRECTIVES'])
+    app.context_processor(lambda: {'csp_nonce': LazyNonce()})
@@ -0,0 +1,73 @@
+"""Настройки пула соединений SQLAlchemy и его метрики.
+
+Каждый воркер gunicorn держит собственный пул, поэтому суммарное число
+соединений равно workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) и должно
+оставаться ниже max_connections в PostgreSQL.
+"""
+import os
+import threading
+import time
+
+from sqlalchemy.pool import QueuePool
+
+
+def env_flag(name, default):
+    return os.getenv(name, default).lower() in ('1', 'true', 'yes', 'on')
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool, учитывающий время ожидания свободного соединения"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._wait_lock = threading.Lock()
+        self.wait_count = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - start
+            with self._wait_lock:
+                self.wait_count += 1
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+
+def engine_options(database_uri):
+    """Параметры create_engine для SQLALCHEMY_ENGINE_OPTIONS из переменных окружения"""
+    if database_uri.startswith('sqlite'):
+        # Для SQLite пул настраивает Flask-SQLAlchemy
+        return {}
+    return {
+        'poolclass': TimedQueuePool,
+        # Sync воркер обрабатывает один запрос за раз, большой пул ему не нужен
+        'pool_size': int(os.getenv('DB_POOL_SIZE', '2')),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '2')),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+        'pool_pre_ping': env_flag('DB_POOL_PRE_PING', 'true'),
+    }
+
+
+def pool_stats(engine):
+    """Текущее состояние пула соединений движка"""
+    pool = engine.pool
+    stats = {'pid': os.getpid(), 'pool_class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+        })
+    if isinstance(pool, TimedQueuePool):
+        stats.update({
+            'wait_count': pool.wait_count,
+            'wait_seconds_total': round(pool.wait_seconds_total, 6),
+            'wait_seconds_max': round(pool.wait_seconds_max, 6),
+        })
+    return stats
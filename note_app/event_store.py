@@ -0,0 +1,326 @@
+"""Хранилище событий безопасности в PostgreSQL.
+
+Разобранные строки лога (security_events) и алерты (security_alerts)
+накапливаются в памяти и фоновым потоком записываются пакетами командой
+COPY FROM STDIN через одно постоянное соединение. Таблицы секционированы по
+дням (секция создается при первой записи за день), индекс (ts, ip, type)
+наследуется секциями. Отчеты и выборки инцидентов считаются SQL агрегатами.
+
+Запись не блокирует обработку лога: add() только добавляет кортеж в очередь.
+Пакет, не записанный из-за потери соединения, повторяется после
+переподключения; если база недоступна дольше, чем нужно для заполнения
+max_buffer событий, новые события отбрасываются и учитываются в
+stats()['dropped']. Если COPY отклоняет пакет из-за данных, пакет делится
+пополам, пока не останутся отдельные плохие строки: отбрасываются только
+они (stats()['rejected']).
+"""
+import io
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+import psycopg2
+import psycopg2.errors
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS security_events (
+    ts timestamp NOT NULL,
+    ip text NOT NULL,
+    type text NOT NULL,
+    message text NOT NULL
+) PARTITION BY RANGE (ts);
+CREATE INDEX IF NOT EXISTS security_events_ts_ip_type_idx ON security_events (ts, ip, type);
+CREATE TABLE IF NOT EXISTS security_alerts (
+    ts timestamp NOT NULL,
+    ip text NOT NULL,
+    type text NOT NULL,
+    description text NOT NULL,
+    alert_time timestamp NOT NULL
+) PARTITION BY RANGE (ts);
+CREATE INDEX IF NOT EXISTS security_alerts_ts_ip_type_idx ON security_alerts (ts, ip, type);
+"""
+
+# Ключ pg_advisory_xact_lock для создания секций: воркеры конвейера создают
+# одну и ту же секцию одновременно, а CREATE TABLE IF NOT EXISTS от гонки
+# не защищает (UniqueViolation в pg_type)
+PARTITION_LOCK_ID = 0x5349454d
+
+TABLE_COLUMNS = {
+    'security_events': '(ts, ip, type, message)',
+    'security_alerts': '(ts, ip, type, description, alert_time)',
+}
+
+def escape(value):
+    """Экранирование значения для текстового формата COPY.
+
+    Цепочка replace на порядок быстрее str.translate с таблицей замен. NUL
+    в тексте PostgreSQL недопустим и заменяется на U+FFFD.
+    """
+    return (value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+            .replace('\x00', '\ufffd'))
+
+
+def encode_rows(rows):
+    """Строки в текстовом формате COPY; первое поле - timestamp, остальные - текст или timestamp"""
+    return ''.join([
+        f"{row[0].isoformat()}\t" + '\t'.join(
+            value.isoformat() if isinstance(value, datetime) else escape(value)
+            for value in row[1:]
+        ) + '\n'
+        for row in rows
+    ])
+
+
+def encode_events(rows):
+    """Быстрый вариант encode_rows для security_events (ts, ip, type, message)"""
+    return ''.join([
+        f"{ts.isoformat()}\t{escape(ip)}\t{escape(kind)}\t{escape(message)}\n"
+        for ts, ip, kind, message in rows
+    ])
+
+
+class EventStore:
+    def __init__(self, dsn, batch_size=20000, flush_interval=1.0, max_buffer=2000000):
+        self.dsn = dsn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.conn = None
+        # Соединение используется фоновым потоком и отчетами; транзакции не должны смешиваться
+        self._conn_lock = threading.Lock()
+        self._partitions = set()
+        self._events = deque()
+        self._alerts = deque()
+        self._wake = threading.Event()
+        self._flushed = threading.Condition()
+        self._closing = False
+        self._busy = False
+        # Пакеты (таблица, строки), не записанные из-за потери соединения
+        self._retry = []
+        self.written = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.errors = 0
+        self._connect()
+        self._thread = threading.Thread(target=self._run, name='event-store', daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        self.conn = psycopg2.connect(self.dsn)
+        self.conn.autocommit = False
+        with self.conn.cursor() as cursor:
+            cursor.execute(SCHEMA)
+        self.conn.commit()
+
+    def add(self, record):
+        """Разобранная строка лога (siem_parser.LogRecord)"""
+        if len(self._events) >= self.max_buffer:
+            self.dropped += 1
+            return
+        self._events.append((record.timestamp, record.ip, record.level, record.message))
+        if len(self._events) >= self.batch_size:
+            self._wake.set()
+
+    def add_alert(self, alert):
+        """Алерт (siem_alerts.Alert); время секции - время события"""
+        self._alerts.append((alert.event_time, alert.ip, alert.alert_type, alert.description, alert.time))
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            closing = self._closing
+            self._busy = True
+            try:
+                self._write_pending()
+            except psycopg2.Error as e:
+                self.errors += 1
+                print(f"❌ Ошибка записи событий в PostgreSQL: {e}")
+                self._reconnect()
+            finally:
+                self._busy = False
+            with self._flushed:
+                self._flushed.notify_all()
+            if closing:
+                return
+
+    def _take(self, queue):
+        count = min(len(queue), self.batch_size)
+        popleft = queue.popleft
+        return [popleft() for _ in range(count)]
+
+    def _write_pending(self):
+        while self._retry or self._events or self._alerts:
+            if not self._retry:
+                self._retry = [
+                    (table, rows) for table, rows in (
+                        ('security_events', self._take(self._events)),
+                        ('security_alerts', self._take(self._alerts)),
+                    ) if rows
+                ]
+            batches = self._retry
+            try:
+                self.written += self._copy(batches)
+            except psycopg2.Error:
+                if self.conn.closed:
+                    raise
+                self._write_split(batches)
+            self._retry = []
+
+    def _copy(self, batches):
+        """Пакеты одной транзакцией; при ошибке данных транзакция откатывается"""
+        # Форматирование выполняется до захвата соединения
+        encoded = [
+            (table, rows, encode_events(rows) if table == 'security_events' else encode_rows(rows))
+            for table, rows in batches
+        ]
+        with self._conn_lock:
+            try:
+                for table, rows, _ in encoded:
+                    self._ensure_partitions(table, {row[0].date() for row in rows})
+                with self.conn.cursor() as cursor:
+                    for table, _, data in encoded:
+                        cursor.copy_expert(f"COPY {table} {TABLE_COLUMNS[table]} FROM STDIN", io.StringIO(data))
+                self.conn.commit()
+            except psycopg2.Error:
+                if not self.conn.closed:
+                    self.conn.rollback()
+                raise
+        return sum(len(rows) for _, rows, _ in encoded)
+
+    def _write_split(self, batches):
+        """Запись пакетов, отклоненных COPY: половины пишутся отдельно, плохие строки отбрасываются"""
+        pieces = list(reversed(batches))
+        while pieces:
+            table, rows = pieces.pop()
+            try:
+                self.written += self._copy([(table, rows)])
+            except psycopg2.Error as e:
+                if self.conn.closed:
+                    # Уже записанные части не повторяются
+                    self._retry = pieces[::-1] + [(table, rows)]
+                    raise
+                if len(rows) == 1:
+                    self.rejected += 1
+                    print(f"❌ Строка отклонена PostgreSQL ({table}): {e}")
+                    continue
+                middle = len(rows) // 2
+                pieces += [(table, rows[middle:]), (table, rows[:middle])]
+
+    def _ensure_partitions(self, table, days):
+        for day in days:
+            if (table, day) in self._partitions:
+                continue
+            try:
+                with self.conn.cursor() as cursor:
+                    cursor.execute('SELECT pg_advisory_xact_lock(%s)', (PARTITION_LOCK_ID,))
+                    cursor.execute(
+                        f"CREATE TABLE IF NOT EXISTS {table}_{day:%Y%m%d} PARTITION OF {table} "
+                        f"FOR VALUES FROM (%s) TO (%s)",
+                        (day, day + timedelta(days=1))
+                    )
+                self.conn.commit()
+            except (psycopg2.errors.DuplicateTable, psycopg2.errors.UniqueViolation):
+                # Секцию одновременно создал процесс без блокировки (старая версия)
+                self.conn.rollback()
+            self._partitions.add((table, day))
+
+    def _reconnect(self):
+        # Незаписанный пакет остается в self._retry и повторяется после подключения
+        with self._conn_lock:
+            self._partitions.clear()
+            try:
+                self.conn.close()
+            except psycopg2.Error:
+                pass
+        while not self._closing:
+            try:
+                with self._conn_lock:
+                    self._connect()
+                # Отложенный пакет повторяется сразу, не дожидаясь flush_interval
+                self._wake.set()
+                return
+            except psycopg2.Error:
+                time.sleep(1)
+
+    def flush(self, timeout=30):
+        """Дождаться записи всех накопленных событий"""
+        deadline = time.monotonic() + timeout
+        with self._flushed:
+            while (self._events or self._alerts or self._retry or self._busy) and time.monotonic() < deadline:
+                self._wake.set()
+                self._flushed.wait(min(1.0, max(deadline - time.monotonic(), 0)))
+
+    def close(self, timeout=30):
+        self._closing = True
+        self._wake.set()
+        self._thread.join(timeout)
+        # Что не удалось записать до остановки, учитывается как потерянное
+        self.dropped += sum(len(rows) for _, rows in self._retry) + len(self._events) + len(self._alerts)
+        self.conn.close()
+
+    def stats(self):
+        return {
+            'written': self.written,
+            'queued': len(self._events) + len(self._alerts) + sum(len(rows) for _, rows in self._retry),
+            'dropped': self.dropped,
+            'rejected': self.rejected,
+            'errors': self.errors,
+        }
+
+    def report(self, start, end, top_n=20):
+        """Агрегаты за интервал времени событий [start, end), формат как у StatsStore.report"""
+        self.flush()
+        result = {'requests': 0, 'incidents': 0, 'incident_types': {}, 'top_ips': [], 'hourly': []}
+        with self._conn_lock, self.conn.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM security_events WHERE ts >= %s AND ts < %s', (start, end))
+            result['requests'] = cursor.fetchone()[0]
+
+            cursor.execute(
+                'SELECT type, count(*) FROM security_alerts WHERE ts >= %s AND ts < %s '
+                'GROUP BY type ORDER BY count(*) DESC',
+                (start, end)
+            )
+            result['incident_types'] = dict(cursor.fetchall())
+            result['incidents'] = sum(result['incident_types'].values())
+
+            cursor.execute(
+                'SELECT ip, count(*), 0 FROM security_alerts WHERE ts >= %s AND ts < %s '
+                'GROUP BY ip ORDER BY count(*) DESC LIMIT %s',
+                (start, end, top_n)
+            )
+            result['top_ips'] = cursor.fetchall()
+
+            cursor.execute(
+                "SELECT to_char(hour, 'YYYY-MM-DD HH24'), sum(requests), sum(incidents) FROM ("
+                "  SELECT date_trunc('hour', ts) AS hour, count(*) AS requests, 0 AS incidents "
+                "  FROM security_events WHERE ts >= %s AND ts < %s GROUP BY 1"
+                "  UNION ALL"
+                "  SELECT date_trunc('hour', ts), 0, count(*) "
+                "  FROM security_alerts WHERE ts >= %s AND ts < %s GROUP BY 1"
+                ") AS hours GROUP BY hour ORDER BY hour",
+                (start, end, start, end)
+            )
+            result['hourly'] = [(hour, int(requests), int(incidents)) for hour, requests, incidents in cursor]
+            self.conn.rollback()
+        return result
+
+    def incidents(self, start, end, ip=None, alert_type=None, limit=1000):
+        """Алерты за интервал с фильтром по IP и типу (по индексу (ts, ip, type))"""
+        self.flush()
+        query = 'SELECT ts, ip, type, description FROM security_alerts WHERE ts >= %s AND ts < %s'
+        params = [start, end]
+        if ip:
+            query += ' AND ip = %s'
+            params.append(ip)
+        if alert_type:
+            query += ' AND type = %s'
+            params.append(alert_type)
+        query += ' ORDER BY ts LIMIT %s'
+        params.append(limit)
+        with self._conn_lock, self.conn.cursor() as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            self.conn.rollback()
+        return rows
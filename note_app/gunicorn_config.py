@@ -1,10 +1,66 @@
 # gunicorn_config.py
 import multiprocessing
+import os
+
+# Профиль воркеров выбирается переменной GUNICORN_PROFILE:
+#   sync     - процесс на запрос, память растет с числом воркеров
+#   gthread  - меньше процессов, в каждом пул потоков (ожидание PostgreSQL отпускает GIL)
+#   gevent   - кооперативные greenlet'ы, нужен пакет gevent и psycogreen для psycopg2
+#   eventlet - то же на eventlet
+# Любой параметр профиля можно переопределить: GUNICORN_WORKERS, GUNICORN_THREADS,
+# GUNICORN_WORKER_CONNECTIONS, GUNICORN_KEEPALIVE, GUNICORN_PRELOAD.
+# Сравнение профилей на конкретной машине: benchmarks/bench_gunicorn_profiles.py
+CPU_COUNT = multiprocessing.cpu_count()
+PROFILES = {
+    'sync': {'worker_class': 'sync', 'workers': CPU_COUNT * 2 + 1, 'threads': 1, 'keepalive': 2},
+    'gthread': {'worker_class': 'gthread', 'workers': CPU_COUNT + 1, 'threads': 8, 'keepalive': 5},
+    'gevent': {'worker_class': 'gevent', 'workers': CPU_COUNT, 'threads': 1, 'keepalive': 5,
+               'worker_connections': 200},
+    'eventlet': {'worker_class': 'eventlet', 'workers': CPU_COUNT, 'threads': 1, 'keepalive': 5,
+                 'worker_connections': 200},
+}
+GREEN_PROFILES = ('gevent', 'eventlet')
+
+profile_name = os.getenv('GUNICORN_PROFILE', 'sync')
+if profile_name not in PROFILES:
+    raise ValueError(f"Неизвестный GUNICORN_PROFILE={profile_name}, допустимо: {', '.join(PROFILES)}")
+profile = PROFILES[profile_name]
+
+
+def env_int(name, default):
+    return int(os.getenv(name, str(default)))
+
 
 # Базовые настройки
 bind = "127.0.0.1:5000"
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "sync"
+# Приложение доступно только через обратный прокси на этом хосте: адрес
+# клиента берется из X-Forwarded-For, который прокси добавляет последним
+os.environ.setdefault('TRUSTED_PROXIES', '1')
+worker_class = profile['worker_class']
+workers = env_int('GUNICORN_WORKERS', profile['workers'])
+threads = env_int('GUNICORN_THREADS', profile['threads'])
+worker_connections = env_int('GUNICORN_WORKER_CONNECTIONS', profile.get('worker_connections', 1000))
+
+# Загрузка приложения в мастере: меньше памяти за счет copy-on-write и быстрый
+# перезапуск воркеров. Соединения с БД пересоздаются в post_fork
+preload_app = os.getenv('GUNICORN_PRELOAD', 'false').lower() in ('1', 'true', 'yes', 'on')
+
+# Пул соединений каждого воркера рассчитан на число одновременных запросов в нем
+# (см. db_pool.py и appach.py); явно заданные DB_POOL_* не меняются
+concurrency = threads if profile_name == 'gthread' else (10 if profile_name in GREEN_PROFILES else 1)
+os.environ.setdefault('DB_POOL_SIZE', str(max(2, concurrency)))
+os.environ.setdefault('DB_MAX_OVERFLOW', str(max(2, concurrency // 2)))
+os.environ.setdefault('DB_POOL_MAX', str(max(4, concurrency)))
+
+if profile_name in GREEN_PROFILES and preload_app:
+    # Приложение импортируется в мастере, поэтому патчить нужно до импорта,
+    # иначе блокировки пула соединений останутся обычными потоковыми
+    if profile_name == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+    else:
+        import eventlet
+        eventlet.monkey_patch()
 
 # Скрытие информации о сервере
 server_header = False
@@ -24,10 +80,49 @@ loglevel = "info"
 max_requests = 1000
 max_requests_jitter = 100
 timeout = 60
-keepalive = 2
+keepalive = env_int('GUNICORN_KEEPALIVE', profile['keepalive'])
+
+
+INSTANCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+
+
+def patch_green_psycopg(server):
+    """Неблокирующий psycopg2 для gevent/eventlet (пакет psycogreen)"""
+    try:
+        if profile_name == 'gevent':
+            from psycogreen.gevent import patch_psycopg
+        else:
+            from psycogreen.eventlet import patch_psycopg
+    except ImportError:
+        server.log.warning("psycogreen не установлен: запросы к PostgreSQL блокируют весь воркер")
+        return
+    patch_psycopg()
+
+
+def on_starting(server):
+    # Снимки метрик прошлого запуска не должны попадать в /metrics нового.
+    # Каталог тот же, что у app.py: instance_path приложения Flask из app.py -
+    # каталог instance рядом с ним
+    from metrics import SnapshotStore, default_metrics_dir
+    SnapshotStore(default_metrics_dir(INSTANCE_PATH)).clear()
+    server.log.info(f"Профиль воркеров: {profile_name} ({worker_class}, workers={workers}, "
+                    f"threads={threads}, preload={preload_app})")
 
 # Дополнительные заголовки безопасности
 def post_fork(server, worker):
     # Убираем информацию о версиях
-    import os
-    os.environ.pop('SERVER_SOFTWARE', None)
\ No newline at end of file
+    import sys
+    os.environ.pop('SERVER_SOFTWARE', None)
+
+    if profile_name in GREEN_PROFILES:
+        patch_green_psycopg(server)
+
+    # Если приложение загружено в мастере, воркер не должен использовать
+    # унаследованные соединения: забываем их, не закрывая сокеты родителя
+    app_module = sys.modules.get('app')
+    if app_module is not None:
+        with app_module.app.app_context():
+            app_module.db.engine.dispose(close=False)
+    appach_module = sys.modules.get('appach')
+    if appach_module is not None:
+        appach_module.reset_db_pool()
@@ -0,0 +1,179 @@
+"""Условные запросы (ETag/304), сжатие ответов и кэширование статики.
+
+Страницы со списком заметок получают слабый ETag из версии списка
+пользователя (cache.NoteListCache.version): версия меняется после каждой
+транзакции, изменившей заметки, поэтому If-None-Match проверяется без
+запросов к БД, до загрузки заметок.
+
+Ссылки на статические файлы содержат хеш содержимого (?v=...), такие ответы
+кэшируются браузером на год: новая версия файла получает новый URL.
+"""
+import gzip
+import hashlib
+import os
+import time
+
+from flask import current_app, request, session
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+    'application/javascript', 'application/json', 'application/x-ndjson', 'image/svg+xml',
+}
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+_static_hashes = {}
+_static_compressed = {}
+
+
+def page_etag(*parts):
+    """Слабый ETag страницы, зависящий от parts.
+
+    В ключ входят также версия шаблонов и номер интервала времени в половину
+    срока жизни CSRF токена: страница, отданная из кэша браузера, содержит
+    токен, который еще действителен.
+    """
+    config = current_app.config
+    time_limit = config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    bucket = int(time.time() // max(time_limit // 2, 1)) if time_limit else 0
+    key = repr((config['TEMPLATES_VERSION'], bucket) + parts).encode()
+    return hashlib.blake2b(key, digest_size=12).hexdigest()
+
+
+def not_modified(etag):
+    """Ответ 304, если у клиента актуальная версия страницы, иначе None.
+
+    Пока в сессии есть неотображенные flash-сообщения, страница рендерится
+    заново: сообщения должны попасть в ответ.
+    """
+    if session.get('_flashes') or not request.if_none_match.contains_weak(etag):
+        return None
+    response = current_app.response_class(status=304)
+    return revalidate(response, etag)
+
+
+def revalidate(response, etag):
+    """ETag и заголовки, требующие проверки кэша браузера при каждом открытии"""
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+
+def templates_version(app):
+    digest = hashlib.blake2b(digest_size=8)
+    for root, _, files in os.walk(os.path.join(app.root_path, app.template_folder)):
+        for name in sorted(files):
+            stat = os.stat(os.path.join(root, name))
+            digest.update(f"{name}:{stat.st_mtime_ns}:{stat.st_size};".encode())
+    return digest.hexdigest()
+
+
+def static_hash(filename):
+    """Хеш содержимого статического файла (пересчитывается при изменении файла)"""
+    path = os.path.join(current_app.static_folder, filename)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _static_hashes.get(filename)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as f:
+            cached = (mtime, hashlib.blake2b(f.read(), digest_size=8).hexdigest())
+        _static_hashes[filename] = cached
+    return cached[1]
+
+
+def add_static_version(endpoint, values):
+    if endpoint == 'static' and 'v' not in values:
+        version = static_hash(values.get('filename', ''))
+        if version:
+            values['v'] = version
+
+
+def choose_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(level, 11))
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_response(response):
+    config = current_app.config
+    if (not config['COMPRESS_ENABLED'] or response.status_code != 200
+            or response.mimetype not in COMPRESSIBLE_TYPES
+            or 'Content-Encoding' in response.headers
+            or 'no-transform' in response.headers.get('Cache-Control', '')
+            or (response.is_streamed and not response.direct_passthrough)):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+
+    # Файлы статики отдаются через send_file (direct_passthrough); сжатая
+    # версия запоминается по ETag файла, чтобы не сжимать ее на каждый запрос
+    if response.direct_passthrough:
+        if request.endpoint != 'static' or not response.get_etag()[0]:
+            return response
+        static_key = (response.get_etag()[0], encoding)
+        data = _static_compressed.get(static_key)
+        if data is None:
+            response.direct_passthrough = False
+            data = response.get_data()
+            if len(data) < config['COMPRESS_MIN_SIZE']:
+                return response
+            data = compress(data, encoding, config['COMPRESS_LEVEL'])
+            _static_compressed[static_key] = data
+        else:
+            response.close()
+    else:
+        data = response.get_data()
+        if len(data) < config['COMPRESS_MIN_SIZE']:
+            return response
+        data = compress(data, encoding, config['COMPRESS_LEVEL'])
+
+    response.direct_passthrough = False
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    # Сжатое представление отличается побайтово, поэтому сильный ETag
+    # становится слабым (If-None-Match сравнивается слабо)
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def cache_static(response):
+    if request.endpoint == 'static' and response.status_code in (200, 304):
+        version = request.args.get('v')
+        if version and version == static_hash(request.view_args.get('filename', '')):
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = STATIC_MAX_AGE
+            response.cache_control.immutable = True
+    return response
+
+
+def init_app(app):
+    app.config.setdefault('COMPRESS_ENABLED', True)
+    app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+    app.config.setdefault('COMPRESS_LEVEL', 6)
+    app.config['TEMPLATES_VERSION'] = templates_version(app)
+    app.url_defaults(add_static_version)
+    # after_request вызываются в обратном порядке: сжатие выполняется после
+    # обработчиков, зарегистрированных позже (заголовки безопасности и т.п.)
+    app.after_request(compress_response)
+    app.after_request(cache_static)
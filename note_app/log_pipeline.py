@@ -0,0 +1,209 @@
+"""Асинхронная пакетная запись логов.
+
+Поток запроса только кладет запись в очередь (QueueHandler). Отдельный поток
+(QueueListener) забирает записи и передает их обработчикам. BufferedFileHandler
+держит файл открытым и пишет накопленные строки одним os.write по размеру
+буфера или по таймеру. Записи, не поместившиеся в очередь, отбрасываются;
+их число пишется предупреждением в логгер log_pipeline, когда очередь
+освобождается.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedFileHandler(logging.Handler):
+    """Обработчик с долгоживущим файлом и буфером строк.
+
+    Файл открыт с O_APPEND и каждый сброс буфера - один вызов write с целыми
+    строками, поэтому записи нескольких воркеров gunicorn в один файл не
+    перемешиваются внутри строки. Если файл был ротирован или удален (сменился
+    inode), он переоткрывается перед следующей записью.
+    """
+
+    def __init__(self, filename, buffer_size=64 * 1024, flush_interval=0.5):
+        super().__init__()
+        self.filename = os.path.abspath(filename)
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+        self._fd = None
+        self._file_id = None
+        self._open()
+
+    def _open(self):
+        self._fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        stat = os.fstat(self._fd)
+        self._file_id = (stat.st_dev, stat.st_ino)
+
+    def _reopen_if_rotated(self):
+        try:
+            stat = os.stat(self.filename)
+            file_id = (stat.st_dev, stat.st_ino)
+        except FileNotFoundError:
+            file_id = None
+        if file_id != self._file_id:
+            os.close(self._fd)
+            self._open()
+
+    def emit(self, record):
+        try:
+            data = (self.format(record) + '\n').encode('utf-8')
+        except Exception:
+            self.handleError(record)
+            return
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if (self._buffered >= self.buffer_size
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self._write_buffer()
+
+    def _write_buffer(self):
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        data = b''.join(self._buffer)
+        self._buffer.clear()
+        self._buffered = 0
+        try:
+            self._reopen_if_rotated()
+            while data:
+                written = os.write(self._fd, data)
+                data = data[written:]
+        except OSError:
+            self.handleError(None)
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self._fd is not None:
+                self._write_buffer()
+        finally:
+            self.release()
+
+    def close(self):
+        self.acquire()
+        try:
+            if self._fd is not None:
+                self._write_buffer()
+                os.close(self._fd)
+                self._fd = None
+        finally:
+            self.release()
+        super().close()
+
+
+class BatchingQueueListener(QueueListener):
+    """QueueListener, сбрасывающий буферы обработчиков, когда очередь простаивает"""
+
+    def __init__(self, log_queue, *handlers, flush_interval=0.5, on_flush=None):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush
+
+    def flush(self):
+        for handler in self.handlers:
+            handler.flush()
+        if self.on_flush is not None:
+            self.on_flush()
+
+    def enqueue_sentinel(self):
+        # Очередь может быть заполнена; поток ее разбирает, поэтому место появится
+        self.queue.put(self._sentinel)
+
+    def _monitor(self):
+        log_queue = self.queue
+        has_task_done = hasattr(log_queue, 'task_done')
+        while True:
+            try:
+                record = log_queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self.flush()
+                continue
+            if record is self._sentinel:
+                if has_task_done:
+                    log_queue.task_done()
+                break
+            self.handle(record)
+            if has_task_done:
+                log_queue.task_done()
+        self.flush()
+
+
+class PipelineQueueHandler(QueueHandler):
+    """QueueHandler с ограниченной очередью: при переполнении запись
+    отбрасывается и учитывается в счетчике, а не блокирует запрос"""
+
+    def __init__(self, pipeline):
+        super().__init__(pipeline.queue)
+        self.pipeline = pipeline
+        self.dropped = 0
+
+    def enqueue(self, record):
+        self.pipeline.ensure_started()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """Очередь, поток записи и обработчики одного процесса.
+
+    Поток запускается лениво при первой записи в текущем процессе, поэтому
+    конвейер корректно работает в воркерах после fork (preload_app).
+    """
+
+    def __init__(self, handlers, flush_interval=0.5, max_queue_size=100000):
+        self.handlers = handlers
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(max_queue_size)
+        self.handler = PipelineQueueHandler(self)
+        self._reported_dropped = 0
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Очередь, унаследованная от родителя, могла содержать его записи
+            self.queue = queue.Queue(self.queue.maxsize)
+            self.handler.queue = self.queue
+            self._listener = BatchingQueueListener(
+                self.queue, *self.handlers, flush_interval=self.flush_interval,
+                on_flush=self.report_dropped,
+            )
+            self._listener.start()
+            self._pid = os.getpid()
+            atexit.register(self.stop)
+
+    def report_dropped(self):
+        """Предупреждение о записях, отброшенных с прошлого вызова"""
+        dropped = self.handler.dropped
+        if dropped > self._reported_dropped:
+            logger.warning('Очередь логов переполнена: отброшено записей %d (всего %d)',
+                           dropped - self._reported_dropped, dropped)
+            self._reported_dropped = dropped
+
+    def stats(self):
+        return {'queued': self.queue.qsize(), 'dropped': self.handler.dropped}
+
+    def stop(self):
+        """Остановка потока с записью всех накопленных событий"""
+        with self._lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+                self._listener = None
+                self._pid = None
@@ -0,0 +1,423 @@
+"""Метрики в текстовом формате Prometheus.
+
+Каждый процесс (воркер gunicorn) копит счетчики и гистограммы в памяти и не
+чаще раза в METRICS_FLUSH_INTERVAL секунд сохраняет снимок в
+METRICS_DIR/<pid>.json. /metrics суммирует снимки всех процессов, поэтому
+ответ не зависит от того, какой воркер принял запрос. Снимки завершившихся
+воркеров (max_requests) переносятся в archived.json, чтобы счетчики не
+уменьшались; gauge метрики берутся только у живых процессов. Каталог
+снимков по умолчанию - <instance_path>/shared/metrics; он, как и указанный
+в METRICS_DIR, должен принадлежать пользователю приложения и иметь права
+0700, файлы в нем открываются без перехода по символическим ссылкам.
+
+Служебные эндпоинты (internal_only) отвечают запросам с токеном
+METRICS_TOKEN в заголовке Authorization: Bearer, а если токен не задан -
+только запросам напрямую с этого хоста, не через обратный прокси.
+"""
+import atexit
+import fcntl
+import glob
+import hmac
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from flask import Response, abort, current_app, g, has_request_context, request
+from flask.sessions import SecureCookieSessionInterface
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from shared_file import open_private, private_directory, shared_directory
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LOOPBACK_ADDRESSES = ('127.0.0.1', '::1')
+
+
+class Registry:
+    """Счетчики, гистограммы и функции сбора gauge метрик одного процесса"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.buckets = {}
+        self.help = {}
+        self.collectors = []
+
+    def describe(self, name, kind, text, buckets=DEFAULT_BUCKETS):
+        self.help[name] = (kind, text)
+        if kind == 'histogram':
+            self.buckets[name] = tuple(buckets)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self.buckets.get(name, DEFAULT_BUCKETS)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # Счетчики по корзинам (не накопительные), +Inf и сумма
+                histogram = self.histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            histogram[bisect_left(buckets, value)] += 1
+            histogram[-1] += value
+
+    def collector(self, func):
+        """Декоратор: func() возвращает список (name, labels, value) gauge метрик"""
+        self.collectors.append(func)
+        return func
+
+    def snapshot(self):
+        with self.lock:
+            counters = [[name, list(labels), value] for (name, labels), value in self.counters.items()]
+            histograms = [[name, list(labels), list(values)] for (name, labels), values in self.histograms.items()]
+        gauges = []
+        for func in self.collectors:
+            try:
+                gauges.extend([name, sorted(labels.items()), value] for name, labels, value in func())
+            except Exception:
+                continue
+        return {
+            'pid': os.getpid(),
+            'help': self.help,
+            'buckets': self.buckets,
+            'counters': counters,
+            'histograms': histograms,
+            'gauges': gauges,
+        }
+
+
+def merge_snapshots(snapshots, live_pids=None):
+    """Сумма счетчиков и гистограмм, gauge метрики живых процессов с меткой pid"""
+    merged = {'help': {}, 'buckets': {}, 'counters': defaultdict(float), 'histograms': {}, 'gauges': []}
+    for snapshot in snapshots:
+        merged['help'].update(snapshot.get('help', {}))
+        merged['buckets'].update(snapshot.get('buckets', {}))
+        for name, labels, value in snapshot.get('counters', []):
+            merged['counters'][(name, tuple(map(tuple, labels)))] += value
+        for name, labels, values in snapshot.get('histograms', []):
+            key = (name, tuple(map(tuple, labels)))
+            current = merged['histograms'].get(key)
+            if current is None or len(current) != len(values):
+                merged['histograms'][key] = list(values)
+            else:
+                merged['histograms'][key] = [a + b for a, b in zip(current, values)]
+        pid = snapshot.get('pid')
+        if live_pids is None or pid in live_pids:
+            for name, labels, value in snapshot.get('gauges', []):
+                merged['gauges'].append((name, tuple(map(tuple, labels)) + (('pid', str(pid)),), value))
+    return merged
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in pairs) + '}'
+
+
+def render(merged):
+    """Текстовый формат Prometheus"""
+    families = defaultdict(list)
+    for (name, labels), value in sorted(merged['counters'].items()):
+        families[name].append(f"{name}{format_labels(labels)} {value:g}")
+    for (name, labels), values in sorted(merged['histograms'].items()):
+        buckets = merged['buckets'].get(name, DEFAULT_BUCKETS)
+        cumulative = 0
+        for bound, count in zip(list(buckets) + ['+Inf'], values[:-1]):
+            cumulative += count
+            bound = bound if bound == '+Inf' else f"{bound:g}"
+            families[name].append(f"{name}_bucket{format_labels(labels, [('le', bound)])} {cumulative}")
+        families[name].append(f"{name}_sum{format_labels(labels)} {values[-1]:.6f}")
+        families[name].append(f"{name}_count{format_labels(labels)} {cumulative}")
+    for name, labels, value in sorted(merged['gauges']):
+        families[name].append(f"{name}{format_labels(labels)} {value:g}")
+
+    lines = []
+    for name in sorted(families):
+        kind, text = merged['help'].get(name, ('gauge' if name not in merged['buckets'] else 'histogram', ''))
+        if text:
+            lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(families[name])
+    return '\n'.join(lines) + '\n'
+
+
+class SnapshotStore:
+    """Снимки метрик процессов в общем каталоге"""
+
+    def __init__(self, directory, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._last_write = 0.0
+        private_directory(directory)
+
+    def path_for(self, pid):
+        return os.path.join(self.directory, f"{pid}.json")
+
+    def write(self, registry, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_write < self.flush_interval:
+            return
+        self._last_write = now
+        path = self.path_for(os.getpid())
+        temp_path = f"{path}.tmp"
+        try:
+            self._dump(temp_path, registry.snapshot())
+            os.replace(temp_path, path)
+        except (OSError, RuntimeError):
+            # Недоступный каталог метрик не должен ломать обработку запросов
+            pass
+
+    @staticmethod
+    def _dump(path, data):
+        fd = open_private(path)
+        os.ftruncate(fd, 0)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+
+    @staticmethod
+    def _read(path):
+        """Снимок из файла или None, если файл не читается или поврежден"""
+        try:
+            fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+            with os.fdopen(fd) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(snapshot, dict):
+            return None
+        pid = snapshot.get('pid')
+        # pid None - архив завершившихся процессов
+        if pid is not None and (type(pid) is not int or pid <= 0):
+            return None
+        return snapshot
+
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def collect(self):
+        """Объединенные метрики всех процессов"""
+        archive_path = os.path.join(self.directory, 'archived.json')
+        with os.fdopen(open_private(os.path.join(self.directory, '.lock')), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            snapshots = []
+            dead = []
+            live_pids = set()
+            for path in glob.glob(os.path.join(self.directory, '[0-9]*.json')):
+                snapshot = self._read(path)
+                if snapshot is None or snapshot.get('pid') is None:
+                    continue
+                if self._alive(snapshot['pid']):
+                    live_pids.add(snapshot['pid'])
+                    snapshots.append(snapshot)
+                else:
+                    dead.append((path, snapshot))
+
+            archived = self._read(archive_path)
+            if dead:
+                # Счетчики завершившихся процессов переносятся в общий архив
+                merged = merge_snapshots(([archived] if archived else []) + [s for _, s in dead], live_pids=set())
+                archived = {
+                    'pid': None,
+                    'help': merged['help'],
+                    'buckets': merged['buckets'],
+                    'counters': [[name, list(labels), value] for (name, labels), value in merged['counters'].items()],
+                    'histograms': [[name, list(labels), values] for (name, labels), values in merged['histograms'].items()],
+                    'gauges': [],
+                }
+                temp_path = f"{archive_path}.tmp"
+                self._dump(temp_path, archived)
+                os.replace(temp_path, archive_path)
+                for path, _ in dead:
+                    os.remove(path)
+            if archived:
+                snapshots.append(archived)
+        return merge_snapshots(snapshots, live_pids=live_pids)
+
+    def clear(self):
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            os.remove(path)
+
+
+def default_metrics_dir(instance_path):
+    """Каталог снимков: METRICS_DIR или <instance_path>/shared/metrics"""
+    return os.getenv('METRICS_DIR') or os.path.join(shared_directory(instance_path), 'metrics')
+
+
+registry = Registry()
+registry.describe('http_requests_total', 'counter', 'Число HTTP запросов')
+registry.describe('http_request_duration_seconds', 'histogram', 'Время обработки запроса')
+registry.describe('http_request_db_queries', 'histogram', 'SQL запросов на HTTP запрос',
+                  buckets=QUERY_COUNT_BUCKETS)
+registry.describe('http_request_db_seconds', 'histogram', 'Время SQL запросов на HTTP запрос')
+registry.describe('db_queries_total', 'counter', 'Число SQL запросов')
+registry.describe('db_query_duration_seconds', 'histogram', 'Время одного SQL запроса')
+registry.describe('template_render_seconds', 'histogram', 'Время рендеринга шаблона')
+registry.describe('session_seconds', 'histogram', 'Загрузка и сохранение cookie сессии')
+registry.describe('csrf_check_seconds', 'histogram', 'Проверка CSRF токена')
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    registry.inc('db_queries_total')
+    registry.observe('db_query_duration_seconds', elapsed)
+    if has_request_context():
+        g.metrics_db_queries = g.get('metrics_db_queries', 0) + 1
+        g.metrics_db_seconds = g.get('metrics_db_seconds', 0.0) + elapsed
+
+
+class TimedSessionInterface(SecureCookieSessionInterface):
+    """Cookie сессия с учетом времени загрузки и сохранения"""
+
+    def open_session(self, app, request):
+        start = time.perf_counter()
+        try:
+            return super().open_session(app, request)
+        finally:
+            registry.observe('session_seconds', time.perf_counter() - start, phase='open')
+
+    def save_session(self, app, session, response):
+        start = time.perf_counter()
+        try:
+            return super().save_session(app, session, response)
+        finally:
+            registry.observe('session_seconds', time.perf_counter() - start, phase='save')
+
+
+def instrument_csrf(csrf):
+    """Учет времени проверки CSRF токена в before_request CSRFProtect"""
+    protect = csrf.protect
+
+    def timed_protect():
+        start = time.perf_counter()
+        try:
+            return protect()
+        finally:
+            registry.observe('csrf_check_seconds', time.perf_counter() - start)
+
+    csrf.protect = timed_protect
+
+
+def internal_only(view):
+    """Ограничение доступа к служебному эндпоинту (см. описание модуля)"""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = current_app.config.get('METRICS_TOKEN')
+        if token:
+            scheme, _, value = request.headers.get('Authorization', '').partition(' ')
+            allowed = scheme.lower() == 'bearer' and hmac.compare_digest(value.encode(), token.encode())
+        else:
+            # Адрес соединения до ProxyFix: запрос через прокси на этом же хосте
+            # приходит с loopback, но несет X-Forwarded-For
+            peer = request.environ.get('werkzeug.proxy_fix.orig', {}).get('REMOTE_ADDR', request.remote_addr)
+            allowed = peer in LOOPBACK_ADDRESSES and 'X-Forwarded-For' not in request.headers
+        if not allowed:
+            abort(403)
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def init_app(app):
+    """Подключение сбора метрик к приложению и эндпоинт /metrics"""
+    store = SnapshotStore(
+        app.config.get('METRICS_DIR') or default_metrics_dir(app.instance_path),
+        float(app.config.get('METRICS_FLUSH_INTERVAL', 1.0)),
+    )
+    app.extensions['metrics'] = store
+    app.session_interface = TimedSessionInterface()
+    atexit.register(store.write, registry, True)
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        start = g.get('metrics_start')
+        if start is None:
+            return response
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        registry.inc('http_requests_total', route=route, method=request.method, status=response.status_code)
+        registry.observe('http_request_duration_seconds', time.perf_counter() - start,
+                         route=route, method=request.method)
+        registry.observe('http_request_db_queries', g.get('metrics_db_queries', 0), route=route)
+        registry.observe('http_request_db_seconds', g.get('metrics_db_seconds', 0.0), route=route)
+        store.write(registry)
+        return response
+
+    def before_render(sender, template, context, **extra):
+        g.setdefault('metrics_render_start', []).append(time.perf_counter())
+
+    def after_render(sender, template, context, **extra):
+        starts = g.get('metrics_render_start')
+        if starts:
+            registry.observe('template_render_seconds', time.perf_counter() - starts.pop(),
+                             template=template.name or 'string')
+
+    before_render_template.connect(before_render, app, weak=False)
+    template_rendered.connect(after_render, app, weak=False)
+
+    def metrics_endpoint():
+        store.write(registry, force=True)
+        return Response(render(store.collect()), content_type=CONTENT_TYPE)
+
+    app.add_url_rule('/metrics', 'metrics', internal_only(metrics_endpoint))
+
+
+def start_metrics_server(render_func, host='127.0.0.1', port=9108):
+    """HTTP сервер /metrics в фоновом потоке (для процессов без Flask, например SIEM)"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render_func().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
@@ -0,0 +1,174 @@
+import os
+from collections import namedtuple
+from datetime import datetime
+
+from flask import current_app, g
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import case, func, inspect, text, tuple_
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import undefer
+
+from compression import MARKER, CompressedText, text_prefix
+
+db = SQLAlchemy()
+
+# Содержимое короче порога хранится как есть
+NOTE_COMPRESS_MIN_SIZE = int(os.getenv('NOTE_COMPRESS_MIN_SIZE', '2048'))
+REVISION_COMPRESS_MIN_SIZE = 256
+
+
+class User(db.Model):
+    __tablename__ = 'users'
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(80), unique=True, nullable=False)
+    password = db.Column(db.String(120), nullable=False)
+    notes = db.relationship('Note', backref='user', lazy=True)
+
+
+class Note(db.Model):
+    __tablename__ = 'notes'
+    __table_args__ = (
+        # Покрывает выборку списка заметок пользователя в порядке (date, id)
+        db.Index('ix_notes_user_date_id', 'user_id', 'date', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(100), nullable=False)
+    # Содержимое загружается только при явном обращении. Большие значения
+    # хранятся сжатыми; на PostgreSQL текст нужен полнотекстовому индексу,
+    # там их сжимает TOAST (см. init_storage)
+    content = db.deferred(db.Column(CompressedText(NOTE_COMPRESS_MIN_SIZE, postgresql=False), nullable=False))
+    # Ключ keyset-пагинации списка, поэтому NULL недопустим (см. init_storage)
+    date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+
+    def __repr__(self):
+        return '<Note %r>' % self.id
+
+
+class NoteRevision(db.Model):
+    """Предыдущая версия заметки (см. revisions.py).
+
+    data - обратная дельта к следующей версии или, если snapshot, полный текст.
+    """
+    __tablename__ = 'note_revisions'
+    __table_args__ = (
+        db.UniqueConstraint('note_id', 'number', name='uq_note_revisions_note_number'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    note_id = db.Column(db.Integer, db.ForeignKey('notes.id', ondelete='CASCADE'), nullable=False)
+    number = db.Column(db.Integer, nullable=False)
+    title = db.Column(db.String(100), nullable=False)
+    snapshot = db.Column(db.Boolean, nullable=False, default=False)
+    data = db.deferred(db.Column(CompressedText(REVISION_COMPRESS_MIN_SIZE), nullable=False))
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# Дата для заметок, сохраненных без нее до появления NOT NULL: они считаются самыми старыми
+UNKNOWN_NOTE_DATE = datetime(1970, 1, 1)
+
+
+def init_storage():
+    """Подготовка существующей базы (идемпотентно).
+
+    Заметкам без даты проставляется UNKNOWN_NOTE_DATE: create_all не меняет
+    существующие таблицы, а курсор страницы требует дату у каждой заметки.
+    На PostgreSQL столбец становится NOT NULL, а content сжимается алгоритмом
+    lz4 в TOAST (PostgreSQL 14+).
+    """
+    bind = db.session.get_bind()
+    date_column = next(column for column in inspect(bind).get_columns('notes') if column['name'] == 'date')
+    if date_column['nullable']:
+        db.session.execute(Note.__table__.update().where(Note.date.is_(None)).values(date=UNKNOWN_NOTE_DATE))
+        if bind.dialect.name == 'postgresql':
+            db.session.execute(text('ALTER TABLE notes ALTER COLUMN date SET NOT NULL'))
+        db.session.commit()
+    if bind.dialect.name != 'postgresql':
+        return
+    try:
+        db.session.execute(text('ALTER TABLE notes ALTER COLUMN content SET COMPRESSION lz4'))
+        db.session.commit()
+    except SQLAlchemyError:
+        # PostgreSQL до 14 или сборка без lz4: остается pglz по умолчанию
+        db.session.rollback()
+
+
+def load_owned_note(note_id, user_id):
+    """Заметка пользователя одним запросом (WHERE id = :id AND user_id = :uid).
+
+    Результат запоминается в flask.g, поэтому в пределах запроса заметка
+    загружается из БД не более одного раза. None если заметки нет или она чужая.
+    """
+    owned_notes = g.setdefault('owned_notes', {})
+    key = (note_id, user_id)
+    if key not in owned_notes:
+        owned_notes[key] = Note.query.options(undefer(Note.content)).filter_by(
+            id=note_id, user_id=user_id
+        ).first()
+    return owned_notes[key]
+
+
+def forget_owned_note(note_id, user_id):
+    """Удаление заметки из кэша запроса (после удаления самой заметки)"""
+    g.setdefault('owned_notes', {}).pop((note_id, user_id), None)
+
+
+# Заголовок сжатого потока и запас на неполный последний блок (символов base64)
+COMPRESSED_EXCERPT_PREFIX = 512
+
+# Облегченная запись для списка заметок: без полного содержимого
+NoteListItem = namedtuple('NoteListItem', ['id', 'title', 'date', 'excerpt'])
+
+
+def encode_cursor(date, note_id):
+    return f"{date.isoformat()}_{note_id}"
+
+
+def decode_cursor(cursor):
+    """Разбор курсора вида '<date isoformat>_<id>', None если курсор некорректен"""
+    if not cursor:
+        return None
+    date_str, _, id_str = cursor.rpartition('_')
+    try:
+        return datetime.fromisoformat(date_str), int(id_str)
+    except ValueError:
+        return None
+
+
+def get_notes_page(user_id, cursor=None, page_size=None):
+    """Страница заметок пользователя (от новых к старым) и курсор следующей страницы.
+
+    Загружаются только id, заголовок, дата и короткий фрагмент содержимого.
+    Для сжатого содержимого читается начало потока, достаточное для фрагмента.
+    """
+    page_size = page_size or current_app.config['NOTES_PAGE_SIZE']
+    excerpt_length = current_app.config['NOTE_EXCERPT_LENGTH']
+    excerpt = case(
+        (func.substr(Note.content, 1, 1) == MARKER,
+         func.substr(Note.content, 1, COMPRESSED_EXCERPT_PREFIX + excerpt_length * 4)),
+        else_=func.substr(Note.content, 1, excerpt_length + 1),
+    )
+    query = db.session.query(
+        Note.id,
+        Note.title,
+        Note.date,
+        excerpt.label('excerpt'),
+    ).filter(Note.user_id == user_id)
+
+    position = decode_cursor(cursor)
+    if position:
+        query = query.filter(tuple_(Note.date, Note.id) < tuple_(*position))
+
+    rows = query.order_by(Note.date.desc(), Note.id.desc()).limit(page_size + 1).all()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1].date, rows[-1].id)
+
+    notes = []
+    for row in rows:
+        excerpt = text_prefix(row.excerpt, excerpt_length + 1)
+        if len(excerpt) > excerpt_length:
+            excerpt = excerpt[:excerpt_length] + '…'
+        notes.append(NoteListItem(row.id, row.title, row.date, excerpt))
+    return notes, next_cursor
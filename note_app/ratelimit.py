@@ -0,0 +1,177 @@
+"""Ограничение частоты запросов (token bucket), общее для всех воркеров.
+
+Маршрут помечается декоратором limit(), проверка выполняется в before_request,
+зарегистрированном раньше CSRFProtect: лишняя попытка входа отклоняется
+ответом 429 до проверки CSRF и запросов к БД.
+
+Корзины хранятся в файле, отображенном в память всех процессов хоста
+(4-канальная ассоциативная таблица фиксированного размера: решение за
+постоянное время, при переполнении вытесняется давно не использованная
+корзина). Файл по умолчанию - <instance_path>/shared/ratelimit (см.
+shared_file.py). При RATELIMIT_REDIS_URL корзины хранятся в Redis (или
+совместимом сервере) и общие для нескольких хостов.
+"""
+import hashlib
+import math
+import struct
+import time
+
+from flask import current_app, request, session
+
+from metrics import registry
+from shared_file import SharedFile, private_path
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+ENTRY = struct.Struct('<Qdd')  # отпечаток ключа, токены, время обновления
+WAYS = 4
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+KEY_FUNCS = {
+    'ip': lambda: request.remote_addr or '',
+    'username': lambda: (request.form.get('username') or '').strip().lower(),
+    'user': lambda: str(session.get('user_id', '')),
+}
+
+registry.describe('rate_limit_rejected_total', 'counter', 'Запросы, отклоненные ограничением частоты')
+
+
+def parse_rate(spec):
+    """'10/minute' -> (токенов в секунду, размер корзины)"""
+    count, _, period = spec.partition('/')
+    count = int(count)
+    return count / PERIODS[period.strip()], count
+
+
+def fingerprint(key):
+    value = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8, person=b'ratelimit').digest(), 'little')
+    return value or 1
+
+
+class SharedBuckets:
+    def __init__(self, path, sets=16384):
+        self.sets = sets
+        self.file = SharedFile(path, sets * WAYS * ENTRY.size)
+
+    def acquire(self, key, rate, burst, now):
+        """Взять токен: 0, если запрос разрешен, иначе секунды до появления токена"""
+        key_print = fingerprint(key)
+        base = (key_print % self.sets) * WAYS * ENTRY.size
+        with self.file.locked() as shared:
+            offset, tokens, updated = None, burst, now
+            oldest_offset, oldest = base, math.inf
+            for way in range(WAYS):
+                way_offset = base + way * ENTRY.size
+                entry_print, entry_tokens, entry_updated = ENTRY.unpack_from(shared, way_offset)
+                if entry_print == key_print:
+                    offset, tokens, updated = way_offset, entry_tokens, entry_updated
+                    break
+                if entry_updated < oldest:
+                    oldest_offset, oldest = way_offset, entry_updated
+            if offset is None:
+                offset = oldest_offset
+            tokens = min(burst, tokens + max(now - updated, 0) * rate)
+            if tokens >= 1:
+                ENTRY.pack_into(shared, offset, key_print, tokens - 1, now)
+                return 0
+            ENTRY.pack_into(shared, offset, key_print, tokens, now)
+            return (1 - tokens) / rate
+
+    def clear(self):
+        self.file.clear()
+
+
+class RedisBuckets:
+    # Та же корзина, атомарно на сервере
+    SCRIPT = """
+    local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens, updated = tonumber(state[1]) or burst, tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(now - updated, 0) * rate)
+    local wait = 0
+    if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return tostring(wait)
+    """
+
+    def __init__(self, url, prefix='ratelimit:'):
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(self.SCRIPT)
+        self.prefix = prefix
+
+    def acquire(self, key, rate, burst, now):
+        return float(self.script(keys=[self.prefix + key], args=[rate, burst, now]))
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+class RateLimiter:
+    def __init__(self):
+        self.enabled = False
+        self.buckets = None
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config.get('RATELIMIT_ENABLED', True)
+        redis_url = config.get('RATELIMIT_REDIS_URL')
+        if redis_url and redis is None:
+            app.logger.warning('Пакет redis не установлен, используется локальное ограничение частоты')
+            redis_url = None
+        if redis_url:
+            self.buckets = RedisBuckets(redis_url)
+        else:
+            self.buckets = SharedBuckets(config.get('RATELIMIT_FILE') or private_path(app, 'ratelimit'))
+        app.before_request(self.check_request)
+
+    def check_request(self):
+        if not self.enabled:
+            return None
+        view = current_app.view_functions.get(request.endpoint)
+        rules = getattr(view, 'rate_limits', None)
+        if not rules or request.method not in view.rate_limit_methods:
+            return None
+        now = time.time()
+        wait = 0
+        for name, kind, rate, burst in rules:
+            value = KEY_FUNCS[kind]()
+            if value:
+                wait = max(wait, self.buckets.acquire(f"{name}:{kind}:{value}", rate, burst, now))
+        if wait <= 0:
+            return None
+        registry.inc('rate_limit_rejected_total', rule=rules[0][0])
+        response = current_app.response_class('Слишком много запросов, повторите позже', status=429,
+                                              mimetype='text/plain')
+        response.headers['Retry-After'] = str(math.ceil(wait))
+        return response
+
+    def clear(self):
+        if self.buckets is not None:
+            self.buckets.clear()
+
+
+limiter = RateLimiter()
+
+
+def limit(name, methods=('POST',), **rates):
+    """Ограничение частоты для маршрута.
+
+    Ключи задаются именованными аргументами: ip, username (поле формы),
+    user (id пользователя в сессии), значение - '5/minute'. Запрос
+    отклоняется, если исчерпана хотя бы одна корзина.
+    """
+    rules = [(name, kind, *parse_rate(spec)) for kind, spec in rates.items()]
+    unknown = set(rates) - set(KEY_FUNCS)
+    if unknown:
+        raise ValueError(f"Неизвестные ключи ограничения: {', '.join(sorted(unknown))}")
+
+    def decorator(view):
+        view.rate_limits = rules
+        view.rate_limit_methods = frozenset(methods)
+        return view
+    return decorator
@@ -0,0 +1,163 @@
+"""История версий заметок.
+
+При каждом изменении заголовка или содержимого предыдущая версия
+сохраняется в note_revisions как обратная построчная дельта: она
+превращает следующую версию в эту. Текущая версия всегда лежит в notes
+целиком, поэтому ее чтение - одна выборка, как и без истории. Каждая
+NOTE_REVISION_SNAPSHOT_EVERY-я версия хранится полностью, так что для
+восстановления любой версии применяется не больше этого числа дельт.
+
+Дельта - JSON список операций над строками: ["=", n] - оставить n строк,
+["-", n] - пропустить n строк, ["+", "текст"] - вставить текст.
+"""
+import difflib
+import json
+import os
+from datetime import datetime
+
+from sqlalchemy import delete, event, func, insert, inspect, select
+
+from models import db, Note, NoteRevision
+
+SNAPSHOT_EVERY = int(os.getenv('NOTE_REVISION_SNAPSHOT_EVERY', '10'))
+
+
+def make_delta(source, target):
+    """Операции, превращающие source в target"""
+    source_lines = source.splitlines(keepends=True)
+    target_lines = target.splitlines(keepends=True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, source_lines, target_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append(['=', i2 - i1])
+            continue
+        if i2 > i1:
+            ops.append(['-', i2 - i1])
+        if j2 > j1:
+            ops.append(['+', ''.join(target_lines[j1:j2])])
+    return ops
+
+
+def apply_delta(source, ops):
+    if not ops:
+        return source
+    lines = source.splitlines(keepends=True)
+    position = 0
+    parts = []
+    for op, value in ops:
+        if op == '=':
+            parts.extend(lines[position:position + value])
+            position += value
+        elif op == '-':
+            position += value
+        else:
+            parts.append(value)
+    return ''.join(parts)
+
+
+def record_revisions(connection, changes):
+    """Сохранение предыдущих версий заметок.
+
+    changes - список (note_id, старый заголовок, старое содержимое, новое
+    содержимое или None, если содержимое не менялось). Номера версий
+    определяются одним запросом, строки вставляются одним INSERT.
+    """
+    if not changes:
+        return
+    note_ids = [change[0] for change in changes]
+    last_numbers = dict(connection.execute(
+        select(NoteRevision.note_id, func.max(NoteRevision.number))
+        .where(NoteRevision.note_id.in_(note_ids))
+        .group_by(NoteRevision.note_id)
+    ).all())
+    now = datetime.utcnow()
+    rows = []
+    for note_id, old_title, old_content, new_content in changes:
+        number = last_numbers.get(note_id, 0) + 1
+        last_numbers[note_id] = number
+        if number % SNAPSHOT_EVERY == 0:
+            snapshot, data = True, old_content
+        elif new_content is None:
+            snapshot, data = False, '[]'
+        else:
+            snapshot, data = False, json.dumps(make_delta(new_content, old_content), ensure_ascii=False)
+            # Дельта полностью переписанного текста не короче самого текста
+            if len(data) >= len(old_content):
+                snapshot, data = True, old_content
+        rows.append({'note_id': note_id, 'number': number, 'title': old_title,
+                     'snapshot': snapshot, 'data': data, 'created': now})
+    connection.execute(insert(NoteRevision), rows)
+
+
+def delete_revisions(connection, note_ids):
+    # SQLite не проверяет внешние ключи и повторно выдает id удаленных
+    # заметок, поэтому история удаляется явно, а не через ON DELETE CASCADE
+    connection.execute(delete(NoteRevision).where(NoteRevision.note_id.in_(note_ids)))
+
+
+@event.listens_for(Note, 'before_update')
+def _record_revision(mapper, connection, target):
+    state = inspect(target)
+    title = state.attrs.title.history
+    content = state.attrs.content.history
+    if content.added:
+        new_content = content.added[0]
+        old_content = content.deleted[0] if content.deleted else None
+    else:
+        new_content = None
+        old_content = state.dict.get('content')
+    if new_content is None and not title.deleted:
+        return
+    if old_content is None:
+        # Прежнее содержимое не загружалось (присвоено без чтения или не менялось)
+        old_content = connection.execute(select(Note.content).where(Note.id == target.id)).scalar_one()
+    if old_content == new_content:
+        new_content = None
+        if not title.deleted:
+            return
+    old_title = title.deleted[0] if title.deleted else target.title
+    record_revisions(connection, [(target.id, old_title, old_content, new_content)])
+
+
+@event.listens_for(Note, 'before_delete')
+def _delete_revisions(mapper, connection, target):
+    delete_revisions(connection, [target.id])
+
+
+def list_revisions(note_id):
+    """Версии заметки от новых к старым, без содержимого"""
+    return db.session.execute(
+        select(NoteRevision.number, NoteRevision.title, NoteRevision.created, NoteRevision.snapshot)
+        .where(NoteRevision.note_id == note_id)
+        .order_by(NoteRevision.number.desc())
+    ).all()
+
+
+def load_revision(note, number):
+    """(заголовок, содержимое) версии number заметки note, None если версии нет.
+
+    Читаются строки от нужной версии до ближайшего полного снимка; если
+    снимка после нее еще нет, дельты применяются к текущему содержимому.
+    """
+    snapshot_number = -(-number // SNAPSHOT_EVERY) * SNAPSHOT_EVERY
+    rows = db.session.execute(
+        select(NoteRevision.number, NoteRevision.title, NoteRevision.snapshot, NoteRevision.data)
+        .where(NoteRevision.note_id == note.id,
+               NoteRevision.number >= number,
+               NoteRevision.number <= snapshot_number)
+        .order_by(NoteRevision.number.desc())
+    ).all()
+    if not rows or rows[-1].number != number:
+        return None
+    # Дельты применяются, начиная с ближайшего к number полного снимка
+    start = next((index for index in range(len(rows) - 1, -1, -1) if rows[index].snapshot), None)
+    if start is None:
+        content = note.content
+        start = 0
+    else:
+        content = rows[start].data
+        start += 1
+    for row in rows[start:]:
+        content = apply_delta(content, json.loads(row.data))
+    return rows[-1].title, content
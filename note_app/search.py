@@ -0,0 +1,220 @@
+"""Полнотекстовый поиск по заметкам.
+
+На PostgreSQL используется генерируемый столбец tsvector (русская и английская
+конфигурации) с GIN индексом. На остальных СУБД (SQLite в тестах) поиск
+выполняется по инвертированному индексу в памяти процесса.
+"""
+import os
+import re
+import threading
+from collections import defaultdict, namedtuple, Counter, OrderedDict
+
+from markupsafe import Markup, escape
+from sqlalchemy import text
+
+from cache import note_cache
+from models import db, Note
+
+SearchResult = namedtuple('SearchResult', ['id', 'title', 'date', 'snippet', 'rank'])
+
+# Маркеры подсветки: не встречаются в обычном тексте и заменяются на <mark>
+# уже после экранирования HTML
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+
+SNIPPET_LENGTH = 160
+
+POSTGRES_DDL = [
+    """
+    ALTER TABLE notes ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('russian', coalesce(content, '')), 'B') ||
+            setweight(to_tsvector('english', coalesce(content, '')), 'B')
+        ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_notes_search_vector ON notes USING GIN (search_vector)",
+]
+
+# Ранжирование выполняется только по id/title/date, ts_headline (дорогой)
+# считается лишь для строк текущей страницы
+POSTGRES_SEARCH_QUERY = text("""
+    WITH q AS (
+        SELECT websearch_to_tsquery('russian', :query) ||
+               websearch_to_tsquery('english', :query) AS tsq
+    ),
+    hits AS (
+        SELECT n.id, n.title, n.date, ts_rank_cd(n.search_vector, q.tsq) AS rank
+        FROM notes n, q
+        WHERE n.user_id = :user_id AND n.search_vector @@ q.tsq
+        ORDER BY rank DESC, n.id DESC
+        LIMIT :limit OFFSET :offset
+    )
+    SELECT hits.id, hits.title, hits.date, hits.rank,
+           ts_headline('russian', n.content, q.tsq, :headline_options) AS snippet
+    FROM hits JOIN notes n ON n.id = hits.id, q
+    ORDER BY hits.rank DESC, hits.id DESC
+""")
+
+POSTGRES_HEADLINE_OPTIONS = (
+    f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, '
+    'MaxWords=35, MinWords=15, MaxFragments=2, FragmentDelimiter=" … "'
+)
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(value):
+    return [token.lower().replace('ё', 'е') for token in TOKEN_RE.findall(value or '')]
+
+
+def render_snippet(snippet):
+    """Экранирование фрагмента и замена маркеров подсветки на <mark>"""
+    html = str(escape(snippet))
+    return Markup(html.replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_STOP, '</mark>'))
+
+
+def is_postgresql():
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+
+def init_search():
+    """Создание tsvector столбца и GIN индекса (идемпотентно, только PostgreSQL)"""
+    if not is_postgresql():
+        return
+    for statement in POSTGRES_DDL:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+
+class InvertedIndex:
+    """Инвертированный индекс заметок в памяти процесса.
+
+    Индекс пользователя строится при первом поиске и помечается версией его
+    списка заметок из note_cache (cache.py). Версия общая для всех воркеров и
+    меняется после фиксации любого изменения заметок, поэтому индекс,
+    построенный до изменения в другом процессе, не используется. Хранятся
+    индексы не более max_users пользователей, давно не искавших вытесняются.
+    """
+
+    TITLE_WEIGHT = 2
+
+    def __init__(self, max_users=256):
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def _build(self, user_id):
+        postings = defaultdict(dict)
+        documents = {}
+        rows = db.session.query(Note.id, Note.title, Note.date, Note.content).filter(
+            Note.user_id == user_id
+        )
+        for note_id, title, date, content in rows:
+            weights = Counter(tokenize(content))
+            for token in tokenize(title):
+                weights[token] += self.TITLE_WEIGHT
+            for token, weight in weights.items():
+                postings[token][note_id] = weight
+            documents[note_id] = (title, date, content)
+        return postings, documents
+
+    def _get(self, user_id):
+        if note_cache.versions is None:
+            # Без счетчика версий изменения в других процессах не видны
+            return self._build(user_id)
+        # Версия читается до построения: изменение, зафиксированное во время
+        # построения, увеличит ее, и индекс будет построен заново
+        version = note_cache.version(user_id)
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and entry[0] == version:
+                self._users.move_to_end(user_id)
+                return entry[1]
+        index = self._build(user_id)
+        with self._lock:
+            self._users[user_id] = (version, index)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return index
+
+    def search(self, user_id, query, limit, offset):
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        postings, documents = self._get(user_id)
+
+        # Все слова запроса должны встречаться в заметке
+        term_postings = [postings.get(term, {}) for term in terms]
+        matches = set(min(term_postings, key=len))
+        for note_postings in term_postings:
+            matches.intersection_update(note_postings)
+
+        total = len(documents)
+        scores = {}
+        for note_postings in term_postings:
+            idf = 1.0 + (total / (1 + len(note_postings)))
+            for note_id in matches:
+                scores[note_id] = scores.get(note_id, 0.0) + note_postings[note_id] * idf
+
+        ranked = sorted(matches, key=lambda note_id: (scores[note_id], note_id), reverse=True)
+        results = []
+        for note_id in ranked[offset:offset + limit]:
+            title, date, content = documents[note_id]
+            results.append(SearchResult(
+                note_id, title, date, render_snippet(self.highlight(content, terms)), scores[note_id]
+            ))
+        return results
+
+    @staticmethod
+    def highlight(content, terms):
+        """Фрагмент содержимого вокруг первого совпадения с маркерами подсветки"""
+        first = None
+        for match in TOKEN_RE.finditer(content):
+            if tokenize(match.group())[0] in terms:
+                first = match.start()
+                break
+        start = max(0, (first or 0) - SNIPPET_LENGTH // 4)
+        window = content[start:start + SNIPPET_LENGTH]
+
+        def mark(match):
+            token = match.group()
+            if tokenize(token)[0] in terms:
+                return f'{HIGHLIGHT_START}{token}{HIGHLIGHT_STOP}'
+            return token
+
+        snippet = TOKEN_RE.sub(mark, window)
+        if start > 0:
+            snippet = '…' + snippet
+        if start + SNIPPET_LENGTH < len(content):
+            snippet += '…'
+        return snippet
+
+
+fallback_index = InvertedIndex(int(os.getenv('SEARCH_INDEX_MAX_USERS', '256')))
+
+
+def search_notes(user_id, query, limit, offset=0):
+    """Поиск заметок пользователя, результаты отсортированы по релевантности"""
+    if not query or not query.strip():
+        return []
+    if not is_postgresql():
+        return fallback_index.search(user_id, query, limit, offset)
+
+    rows = db.session.execute(POSTGRES_SEARCH_QUERY, {
+        'query': query,
+        'user_id': user_id,
+        'limit': limit,
+        'offset': offset,
+        'headline_options': POSTGRES_HEADLINE_OPTIONS,
+    })
+    return [
+        SearchResult(row.id, row.title, row.date, render_snippet(row.snippet), row.rank)
+        for row in rows
+    ]
@@ -0,0 +1,83 @@
+"""Файл, отображенный в память всех процессов хоста.
+
+Используется счетчиками версий кэша списка заметок (cache.py) и корзинами
+ограничения частоты (ratelimit.py). Запись под блокировкой flock: ее
+дескриптор открывается заново в каждом процессе, потому что воркеры,
+созданные fork (GUNICORN_PRELOAD), иначе наследуют одно открытое описание
+файла, и flock их друг от друга не защищает.
+
+Файл по умолчанию лежит в закрытом каталоге экземпляра приложения, а не в
+общем /tmp (там же снимки метрик, см. metrics.py); файл, который оказался символической ссылкой или принадлежит
+другому пользователю, не открывается.
+"""
+import mmap
+import os
+import stat
+import fcntl
+import threading
+from contextlib import contextmanager
+
+
+def private_directory(path):
+    """Каталог path с правами 0700, принадлежащий текущему пользователю"""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.stat(path, follow_symlinks=False)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.geteuid() or info.st_mode & 0o077:
+        raise RuntimeError(f"Каталог {path} должен принадлежать текущему пользователю и иметь права 0700")
+    return path
+
+
+def shared_directory(instance_path):
+    """Закрытый каталог <instance_path>/shared для файлов, общих для воркеров"""
+    return private_directory(os.path.join(instance_path, 'shared'))
+
+
+def private_path(app, name):
+    """Путь к файлу name в каталоге <instance_path>/shared с правами 0700"""
+    return os.path.join(shared_directory(app.instance_path), name)
+
+
+def open_private(path):
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    info = os.fstat(fd)
+    if not stat.S_ISREG(info.st_mode) or info.st_uid != os.geteuid():
+        os.close(fd)
+        raise RuntimeError(f"Файл {path} должен быть обычным файлом текущего пользователя")
+    return fd
+
+
+class SharedFile:
+    def __init__(self, path, size):
+        self.path = path
+        fd = open_private(path)
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+        self.map = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self._fd = fd
+        self._pid = os.getpid()
+        # flock разделяет процессы, потоки одного процесса разделяет обычная блокировка
+        self._lock = threading.Lock()
+
+    def _process_lock(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    inherited = self._fd
+                    self._fd = open_private(self.path)
+                    self._pid = os.getpid()
+                    os.close(inherited)
+        return self._fd
+
+    @contextmanager
+    def locked(self):
+        fd = self._process_lock()
+        with self._lock:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield self.map
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def clear(self):
+        with self.locked() as shared:
+            shared[:] = bytes(len(shared))
@@ -0,0 +1,245 @@
+"""Неблокирующая доставка алертов SIEM.
+
+AlertDispatcher подавляет повторы (тот же тип и IP в пределах окна) и раздает
+алерты приемникам. У каждого приемника своя ограниченная очередь и фоновый
+поток, который отправляет алерты пакетами. Если приемник не успевает, новые
+алерты для него отбрасываются и учитываются в счетчике dropped, а цикл
+обнаружения не блокируется.
+"""
+import atexit
+import json
+import queue
+import smtplib
+import sys
+import threading
+import urllib.request
+from collections import OrderedDict, namedtuple
+from datetime import timedelta
+from email.message import EmailMessage
+
+Alert = namedtuple('Alert', ['time', 'alert_type', 'ip', 'description', 'event_time', 'message'])
+
+COLORS = {
+    'BRUTE_FORCE': '\033[91m',  # Красный
+    'ACCOUNT_BRUTE_FORCE': '\033[91m',  # Красный
+    'SQL_INJECTION': '\033[93m',  # Желтый
+    'UNAUTHORIZED_ACCESS': '\033[95m',  # Фиолетовый
+    'ENDPOINT_SCANNING': '\033[96m'  # Голубой
+}
+RESET = '\033[0m'
+
+_STOP = object()
+
+
+class AlertSink:
+    """Базовый приемник: очередь, поток отправки пакетами и счетчики"""
+
+    name = 'sink'
+
+    def __init__(self, max_queue=10000, batch_size=500):
+        self.queue = queue.Queue(max_queue)
+        self.batch_size = batch_size
+        self.sent = 0
+        self.dropped = 0
+        self.errors = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, alert):
+        if self._thread is None:
+            self._start()
+        try:
+            self.queue.put_nowait(alert)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"alert-sink-{self.name}", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            batch = []
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self.write_batch(batch)
+                    self.sent += len(batch)
+                except Exception:
+                    self.errors += 1
+                    self.dropped += len(batch)
+        self.close()
+
+    def write_batch(self, alerts):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def stop(self, timeout=5.0):
+        if self._thread is None:
+            return
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        return {'sent': self.sent, 'dropped': self.dropped, 'errors': self.errors, 'queued': self.queue.qsize()}
+
+
+class FileSink(AlertSink):
+    """Дозапись алертов в файл, один write на пакет"""
+
+    name = 'file'
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._file = None
+
+    def write_batch(self, alerts):
+        if self._file is None:
+            self._file = open(self.path, 'a')
+        self._file.write(''.join(f"{alert.message}\n" for alert in alerts))
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class StdoutSink(AlertSink):
+    """Цветной вывод алертов в консоль"""
+
+    name = 'stdout'
+
+    def write_batch(self, alerts):
+        sys.stdout.write(''.join(
+            f"{COLORS.get(alert.alert_type, RESET)}[!] {alert.message}{RESET}\n" for alert in alerts
+        ))
+        sys.stdout.flush()
+
+
+class SMTPSink(AlertSink):
+    """Отправка алертов по почте: одно письмо на пакет"""
+
+    name = 'smtp'
+
+    def __init__(self, host='localhost', port=1025, sender='siem@localhost',
+                 recipients=('security@localhost',), timeout=10, **kwargs):
+        super().__init__(**kwargs)
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.recipients = list(recipients)
+        self.timeout = timeout
+
+    def write_batch(self, alerts):
+        email = EmailMessage()
+        types = sorted({alert.alert_type for alert in alerts})
+        email['Subject'] = f"[SIEM] {len(alerts)} алертов: {', '.join(types)}"
+        email['From'] = self.sender
+        email['To'] = ', '.join(self.recipients)
+        email.set_content('\n'.join(alert.message for alert in alerts))
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            smtp.send_message(email)
+
+
+class WebhookSink(AlertSink):
+    """POST пакета алертов в формате JSON на указанный URL"""
+
+    name = 'webhook'
+
+    def __init__(self, url, timeout=5, **kwargs):
+        super().__init__(**kwargs)
+        if not url.startswith(('http://', 'https://')):
+            raise ValueError('Webhook URL должен начинаться с http:// или https://')
+        self.url = url
+        self.timeout = timeout
+
+    def write_batch(self, alerts):
+        payload = json.dumps([
+            {
+                'time': alert.time.isoformat(),
+                'type': alert.alert_type,
+                'ip': alert.ip,
+                'description': alert.description,
+                'event_time': alert.event_time.isoformat(),
+            }
+            for alert in alerts
+        ], ensure_ascii=False).encode('utf-8')
+        request = urllib.request.Request(
+            self.url, data=payload, headers={'Content-Type': 'application/json'}, method='POST'
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:  # nosec B310 - схема проверена
+            response.read()
+
+
+class AlertDispatcher:
+    """Подавление повторов и раздача алертов приемникам.
+
+    Повтором считается алерт того же типа с того же IP, если с предыдущего
+    прошло меньше dedup_window по времени событий.
+    """
+
+    def __init__(self, sinks, dedup_window=timedelta(seconds=60), max_keys=100000):
+        self.sinks = list(sinks)
+        self.dedup_window = dedup_window
+        self.max_keys = max_keys
+        self.dispatched = 0
+        self.suppressed = 0
+        self._last_seen = OrderedDict()
+        atexit.register(self.stop)
+
+    def dispatch(self, alert):
+        """Передача алерта приемникам. False, если алерт подавлен как повтор"""
+        key = (alert.alert_type, alert.ip)
+        last_seen = self._last_seen.get(key)
+        if last_seen is not None and alert.event_time - last_seen < self.dedup_window:
+            self.suppressed += 1
+            return False
+        self._last_seen[key] = alert.event_time
+        self._last_seen.move_to_end(key)
+        self._evict(alert.event_time)
+
+        self.dispatched += 1
+        for sink in self.sinks:
+            sink.submit(alert)
+        return True
+
+    def _evict(self, now):
+        while self._last_seen:
+            key, seen = next(iter(self._last_seen.items()))
+            if len(self._last_seen) <= self.max_keys and now - seen < self.dedup_window:
+                break
+            del self._last_seen[key]
+
+    def stop(self):
+        """Отправка накопленных алертов и остановка потоков приемников"""
+        for sink in self.sinks:
+            sink.stop()
+
+    def stats(self):
+        return {
+            'dispatched': self.dispatched,
+            'suppressed': self.suppressed,
+            'sinks': {sink.name: sink.stats() for sink in self.sinks},
+        }
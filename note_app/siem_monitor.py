@@ -1,28 +1,93 @@
+import argparse
+import os
 import time
 import re
 from collections import defaultdict
 from datetime import datetime, timedelta
-import smtplib
 import threading
 
+from event_store import EventStore
+from siem_alerts import Alert, AlertDispatcher, FileSink, SMTPSink, StdoutSink, WebhookSink
+from siem_parser import LogParser
+from siem_replay import read_log_lines
+from siem_stats import SpaceSaving, StatsStore
+from siem_tail import LogTailer
+from siem_windows import SlidingWindowCounter
+
+# Правила скользящего окна по типам событий: в сообщении ищется marker, события
+# группируются по ключу key ('ip' или 'username'), алерт при threshold за window
+DEFAULT_WINDOW_RULES = {
+    'BRUTE_FORCE': {
+        'marker': 'Failed login attempt',
+        'key': 'ip',
+        'threshold': 5,
+        'window': timedelta(minutes=1),
+        'description': "Обнаружена brute force атака с IP {key}. "
+                       "{count} неудачных попыток за {minutes:g} мин.",
+    },
+    # Распределенный подбор пароля к одной учетной записи с разных IP
+    'ACCOUNT_BRUTE_FORCE': {
+        'marker': 'Failed login attempt',
+        'key': 'username',
+        'threshold': 10,
+        'window': timedelta(minutes=5),
+        'description': "Обнаружен подбор пароля к учетной записи {key}. "
+                       "{count} неудачных попыток за {minutes:g} мин.",
+    },
+}
+
+USERNAME_RE = re.compile(r'username: (.+)$')
+
+# Этапы обработки строки, время которых учитывается в метриках. Время
+# измеряется на каждой DETECTOR_TIMING_SAMPLE-й строке и масштабируется:
+# замер на каждой строке заметно снижал пропускную способность
+DETECTOR_STAGES = ('parse', 'brute_force', 'sql_injection', 'suspicious_access')
+DETECTOR_TIMING_SAMPLE = 16
+
 
 class SIEMMonitor:
-    def __init__(self):
+    def __init__(self, window_rules=None, window_max_keys=100000,
+                 checkpoint_file='siem_checkpoint.json', alert_sinks=None,
+                 alert_dedup_window=timedelta(seconds=60), stats_db='siem_stats.db', top_ips=100,
+                 event_dsn=None):
         self.log_file = 'application.log'
+        # Позиция чтения лога сохраняется между перезапусками (None - читать с конца)
+        self.checkpoint_file = checkpoint_file
         self.alerts_file = 'security_alerts.log'
         self.report_file = f"daily_security_report_{datetime.now().strftime('%Y%m%d')}.txt"
 
-        # Статистика для отчета
+        # Статистика текущего запуска (IP - приближенный top-K, память ограничена)
         self.stats = {
             'total_requests': 0,
             'incidents': 0,
             'incident_types': defaultdict(int),
-            'suspicious_ips': defaultdict(int),
+            'suspicious_ips': SpaceSaving(top_ips),
             'start_time': datetime.now()
         }
-
-        # Хранилище для обнаружения brute force атак
-        self.failed_logins = defaultdict(list)
+        # Оценка суммарного времени этапов обработки строк, секунд (для /metrics)
+        self.detector_seconds = dict.fromkeys(DETECTOR_STAGES, 0.0)
+        self._metrics_rate = (time.monotonic(), 0)
+        # Поминутные агрегаты в SQLite для отчетов за любой интервал (None - не сохранять)
+        self.stats_store = StatsStore(stats_db, top_k=top_ips) if stats_db else None
+        # Все разобранные строки и алерты в PostgreSQL (COPY пакетами), см. event_store.py
+        self.event_dsn = event_dsn
+        self.event_store = EventStore(event_dsn) if event_dsn else None
+
+        self.parser = LogParser()
+
+        # Алерты пишутся фоновыми потоками приемников, повторы подавляются
+        if alert_sinks is None:
+            alert_sinks = [FileSink(self.alerts_file), StdoutSink()]
+        self.alert_dispatcher = AlertDispatcher(alert_sinks, dedup_window=alert_dedup_window)
+
+        # Скользящие окна для обнаружения brute force атак (память ограничена
+        # window_max_keys ключами на правило)
+        self.window_rules = window_rules or DEFAULT_WINDOW_RULES
+        self.window_max_keys = window_max_keys
+        self.window_counters = {
+            alert_type: SlidingWindowCounter(rule['window'], rule['threshold'], window_max_keys)
+            for alert_type, rule in self.window_rules.items()
+        }
 
         # Паттерны для обнаружения SQL инъекций
         self.sql_injection_patterns = [
@@ -35,6 +100,8 @@ class SIEMMonitor:
             r"INSERT.*INTO.*--",
             r"UPDATE.*SET.*--",
         ]
+        self.sql_injection_regex, self.sql_injection_literals = \
+            self.compile_sql_injection_patterns(self.sql_injection_patterns)
 
         # Защищенные эндпоинты для мониторинга
         self.protected_endpoints = [
@@ -45,92 +112,100 @@ class SIEMMonitor:
             '/backup'
         ]
 
-    def tail_log(self):
+    @staticmethod
+    def compile_sql_injection_patterns(patterns):
+        """Объединение правил в одно регулярное выражение с именованными группами.
+
+        Дополнительно для каждого правила, состоящего только из литералов и '.*',
+        выбирается самый длинный обязательный литерал. Строка без единого такого
+        литерала не может совпасть ни с одним правилом и не проверяется регуляркой.
+        Если хотя бы одно правило сложнее, фильтр литералов не используется (None).
+        """
+        combined = '|'.join(f'(?P<rule{index}>{pattern})' for index, pattern in enumerate(patterns))
+        regex = re.compile(combined, re.IGNORECASE)
+
+        literals = set()
+        for pattern in patterns:
+            pieces = pattern.split('.*')
+            if any(re.search(r'[.^$*+?{}\[\]\\|()]', piece) for piece in pieces):
+                return regex, None
+            literals.add(max(pieces, key=len).lower())
+        return regex, tuple(literals)
+
+    def match_sql_injection(self, message):
+        """Правило SQL инъекции, совпавшее с сообщением, или None"""
+        if self.sql_injection_literals is not None:
+            lowered = message.lower()
+            if not any(literal in lowered for literal in self.sql_injection_literals):
+                return None
+        match = self.sql_injection_regex.search(message)
+        if match is None:
+            return None
+        return self.sql_injection_patterns[int(match.lastgroup[len('rule'):])]
+
+    def tail_log(self, yield_idle=False):
         """Чтение лог файла в реальном времени"""
-        try:
-            with open(self.log_file, 'r') as f:
-                # Перемещаемся в конец файла
-                f.seek(0, 2)
-
-                while True:
-                    line = f.readline()
-                    if not line:
-                        time.sleep(0.1)
-                        continue
-
-                    yield line
-        except FileNotFoundError:
+        if not os.path.exists(self.log_file):
             print(f"Лог файл {self.log_file} не найден!")
             return
+        tailer = LogTailer(self.log_file, checkpoint_path=self.checkpoint_file)
+        yield from tailer.lines(yield_idle=yield_idle)
 
     def parse_log_line(self, line):
-        """Парсинг строки лога"""
-        try:
-            # Формат: timestamp - level - [IP: xxx.xxx.xxx.xxx] - message
-            parts = line.strip().split(' - ', 3)
-            if len(parts) >= 4:
-                timestamp_str, level, ip_info, message = parts
-
-                # Извлекаем IP адрес
-                ip_match = re.search(r'\[IP: ([\d\.]+)\]', ip_info)
-                ip = ip_match.group(1) if ip_match else 'unknown'
-
-                timestamp = datetime.fromisoformat(timestamp_str)
-
-                return {
-                    'timestamp': timestamp,
-                    'level': level,
-                    'ip': ip,
-                    'message': message,
-                    'raw_line': line.strip()
-                }
-            return None
-        except Exception as e:
-            print(f"Ошибка парсинга лога: {e}")
-            return None
-
-    def detect_brute_force(self, log_entry):
-        """Обнаружение множественных неудачных попыток входа"""
-        if 'Failed login attempt' in log_entry['message']:
-            ip = log_entry['ip']
-            current_time = log_entry['timestamp']
-
-            # Добавляем попытку в историю
-            self.failed_logins[ip].append(current_time)
-
-            # Удаляем старые попытки (старше 1 минуты)
-            time_threshold = current_time - timedelta(minutes=1)
-            self.failed_logins[ip] = [
-                t for t in self.failed_logins[ip] if t > time_threshold
-            ]
-
-            # Проверяем количество попыток
-            if len(self.failed_logins[ip]) >= 5:
+        """Парсинг строки лога (LogRecord или None, ошибки считаются в self.parser.failures)"""
+        return self.parser.parse(line)
+
+    @staticmethod
+    def window_key(key_name, log_entry):
+        """Значение ключа группировки для правила скользящего окна"""
+        if key_name == 'ip':
+            return log_entry.ip
+        if key_name == 'username':
+            match = USERNAME_RE.search(log_entry.message)
+            return match.group(1) if match else None
+        return None
+
+    def detect_brute_force(self, log_entry, key_names=None):
+        """Обнаружение множественных неудачных попыток входа (по IP и по учетной записи).
+
+        key_names ограничивает проверку правилами с указанными ключами группировки.
+        """
+        message = log_entry.message
+        for alert_type, rule in self.window_rules.items():
+            if rule['marker'] not in message:
+                continue
+            if key_names is not None and rule['key'] not in key_names:
+                continue
+            key = self.window_key(rule['key'], log_entry)
+            if key is None:
+                continue
+
+            counter = self.window_counters[alert_type]
+            count = counter.hit(key, log_entry.timestamp)
+            if count >= rule['threshold']:
                 self.trigger_alert(
-                    'BRUTE_FORCE',
-                    f"Обнаружена brute force атака с IP {ip}. "
-                    f"{len(self.failed_logins[ip])} неудачных попыток за 1 минуту.",
+                    alert_type,
+                    rule['description'].format(
+                        key=key, count=count, minutes=rule['window'].total_seconds() / 60
+                    ),
                     log_entry
                 )
                 # Очищаем историю после алерта
-                self.failed_logins[ip] = []
+                counter.reset(key)
 
     def detect_sql_injection(self, log_entry):
         """Обнаружение SQL инъекций"""
-        message = log_entry['message']
-
-        for pattern in self.sql_injection_patterns:
-            if re.search(pattern, message, re.IGNORECASE):
-                self.trigger_alert(
-                    'SQL_INJECTION',
-                    f"Обнаружена потенциальная SQL инъекция: {pattern}",
-                    log_entry
-                )
-                break
+        pattern = self.match_sql_injection(log_entry.message)
+        if pattern is not None:
+            self.trigger_alert(
+                'SQL_INJECTION',
+                f"Обнаружена потенциальная SQL инъекция: {pattern}",
+                log_entry
+            )
 
     def detect_suspicious_access(self, log_entry):
         """Обнаружение подозрительного доступа к защищенным эндпоинтам"""
-        message = log_entry['message']
+        message = log_entry.message
 
         for endpoint in self.protected_endpoints:
             if endpoint in message:
@@ -148,69 +223,103 @@ class SIEMMonitor:
                     )
 
     def trigger_alert(self, alert_type, description, log_entry):
-        """Триггер алерта"""
+        """Триггер алерта (запись и отправка выполняются приемниками в фоне)"""
         alert_time = datetime.now()
         alert_message = (
             f"{alert_time.isoformat()} - ALERT - {alert_type} - "
-            f"[IP: {log_entry['ip']}] - {description} - "
-            f"Original log: {log_entry['raw_line']}"
+            f"[IP: {log_entry.ip}] - {description} - "
+            f"Original log: {log_entry.raw_line}"
         )
-
-        # Запись в файл алертов
-        with open(self.alerts_file, 'a') as f:
-            f.write(alert_message + '\n')
-
-        # Вывод в консоль с цветом
-        self.print_colored_alert(alert_type, alert_message)
+        alert = Alert(alert_time, alert_type, log_entry.ip, description, log_entry.timestamp, alert_message)
+        self.alert_dispatcher.dispatch(alert)
+        if self.event_store is not None:
+            self.event_store.add_alert(alert)
 
         # Обновление статистики
         self.stats['incidents'] += 1
         self.stats['incident_types'][alert_type] += 1
-        self.stats['suspicious_ips'][log_entry['ip']] += 1
-
-    def print_colored_alert(self, alert_type, message):
-        """Цветной вывод алертов в консоль"""
-        colors = {
-            'BRUTE_FORCE': '\033[91m',  # Красный
-            'SQL_INJECTION': '\033[93m',  # Желтый
-            'UNAUTHORIZED_ACCESS': '\033[95m',  # Фиолетовый
-            'ENDPOINT_SCANNING': '\033[96m'  # Голубой
-        }
-
-        color = colors.get(alert_type, '\033[0m')
-        reset = '\033[0m'
-
-        print(f"{color}[!] {message}{reset}")
-
-    def generate_daily_report(self):
-        """Генерация ежедневного отчета"""
+        self.stats['suspicious_ips'].add(log_entry.ip)
+        if self.stats_store is not None:
+            self.stats_store.record_incident(alert_type, log_entry.ip, log_entry.timestamp)
+
+    def close(self):
+        """Дописать накопленные алерты и статистику, остановить приемники"""
+        self.alert_dispatcher.stop()
+        if self.stats_store is not None:
+            self.stats_store.flush()
+        if self.event_store is not None:
+            self.event_store.flush()
+
+    def collect_report_data(self, period=None):
+        """Данные отчета: из хранилища событий или агрегатов за интервал, иначе из памяти текущего запуска"""
+        if self.stats_store is None and self.event_store is None:
+            return {
+                'requests': self.stats['total_requests'],
+                'incidents': self.stats['incidents'],
+                'incident_types': dict(self.stats['incident_types']),
+                'top_ips': self.stats['suspicious_ips'].top(20),
+                'hourly': [],
+            }
+        if period is None:
+            now = datetime.now()
+            period = (now.replace(hour=0, minute=0, second=0, microsecond=0), now)
+        # Интервал включает последнюю минуту
+        store = self.event_store or self.stats_store
+        return store.report(period[0], period[1] + timedelta(minutes=1))
+
+    def generate_daily_report(self, period=None):
+        """Генерация ежедневного отчета (period - интервал времени событий при повторном анализе)"""
         end_time = datetime.now()
-        duration = end_time - self.stats['start_time']
+        if period:
+            duration = period[1] - period[0]
+        else:
+            duration = end_time - self.stats['start_time']
 
         report = f"""
 ЕЖЕДНЕВНЫЙ ОТЧЕТ ПО БЕЗОПАСНОСТИ
 Дата генерации: {end_time.strftime('%Y-%m-%d %H:%M:%S')}
 Период мониторинга: {duration}
-
+"""
+        if period:
+            report += (f"Интервал событий: {period[0].strftime('%Y-%m-%d %H:%M:%S')} - "
+                       f"{period[1].strftime('%Y-%m-%d %H:%M:%S')}\n")
+        data = self.collect_report_data(period)
+        report += f"""
 ОБЩАЯ СТАТИСТИКА:
-- Всего обработано запросов: {self.stats['total_requests']}
-- Всего инцидентов безопасности: {self.stats['incidents']}
+- Всего обработано запросов: {data['requests']}
+- Всего инцидентов безопасности: {data['incidents']}
+- Строк лога с ошибкой разбора: {self.parser.failures}
 - Время мониторинга: {duration}
 
 ДЕТАЛИ ИНЦИДЕНТОВ:
 """
 
-        for incident_type, count in self.stats['incident_types'].items():
+        for incident_type, count in data['incident_types'].items():
             report += f"- {incident_type}: {count} случаев\n"
 
         report += f"\nПОДОЗРИТЕЛЬНЫЕ IP АДРЕСА:\n"
-        for ip, count in self.stats['suspicious_ips'].items():
-            report += f"- {ip}: {count} инцидентов\n"
+        for ip, count, error in data['top_ips']:
+            # error > 0 - счетчик приближенный и может быть завышен не более чем на error
+            approx = f" (±{error})" if error else ""
+            report += f"- {ip}: {count}{approx} инцидентов\n"
+
+        if data['hourly']:
+            report += f"\nПО ЧАСАМ:\n"
+            for hour, requests, incidents in data['hourly']:
+                report += f"- {hour}:00: запросов {requests}, инцидентов {incidents}\n"
+
+        alert_stats = self.alert_dispatcher.stats()
+        report += f"\nДОСТАВКА АЛЕРТОВ:\n"
+        report += (f"- Отправлено: {alert_stats['dispatched']}, "
+                   f"подавлено повторов: {alert_stats['suppressed']}\n")
+        for sink_name, sink_stats in alert_stats['sinks'].items():
+            report += (f"- {sink_name}: доставлено {sink_stats['sent']}, "
+                       f"отброшено {sink_stats['dropped']}, ошибок {sink_stats['errors']}\n")
 
         report += f"\nРЕКОМЕНДАЦИИ:\n"
-        if self.stats['incidents'] > 10:
+        if data['incidents'] > 10:
             report += "- Высокий уровень угроз. Рекомендуется усилить меры безопасности.\n"
-        elif self.stats['incidents'] > 5:
+        elif data['incidents'] > 5:
             report += "- Средний уровень угроз. Рекомендуется проверить конфигурацию.\n"
         else:
             report += "- Низкий уровень угроз. Система работает стабильно.\n"
@@ -222,25 +331,160 @@ class SIEMMonitor:
         print(f"\nОтчет сохранен в файл: {self.report_file}")
         return report
 
-    def monitor(self):
-        """Основной цикл мониторинга"""
+    def process_line(self, line):
+        """Разбор строки лога и проверка всех типов угроз"""
+        self.stats['total_requests'] += 1
+        timed = not self.stats['total_requests'] % DETECTOR_TIMING_SAMPLE
+
+        start = time.perf_counter() if timed else 0.0
+        log_entry = self.parse_log_line(line)
+        if timed:
+            self.detector_seconds['parse'] += (time.perf_counter() - start) * DETECTOR_TIMING_SAMPLE
+        if log_entry:
+            if self.stats_store is not None:
+                self.stats_store.record_request(log_entry.timestamp)
+            if self.event_store is not None:
+                self.event_store.add(log_entry)
+            self.run_detectors(log_entry, timed=timed)
+
+    def run_detectors(self, log_entry, key_names=None, timed=False):
+        """Все детекторы для записи; timed - учесть время этапов (по выборке строк)"""
+        if not timed:
+            self.detect_brute_force(log_entry, key_names)
+            self.detect_sql_injection(log_entry)
+            self.detect_suspicious_access(log_entry)
+            return
+
+        perf_counter = time.perf_counter
+        timings = self.detector_seconds
+        start = perf_counter()
+        self.detect_brute_force(log_entry, key_names)
+        brute_force_done = perf_counter()
+        self.detect_sql_injection(log_entry)
+        sql_injection_done = perf_counter()
+        self.detect_suspicious_access(log_entry)
+        timings['brute_force'] += (brute_force_done - start) * DETECTOR_TIMING_SAMPLE
+        timings['sql_injection'] += (sql_injection_done - brute_force_done) * DETECTOR_TIMING_SAMPLE
+        timings['suspicious_access'] += (perf_counter() - sql_injection_done) * DETECTOR_TIMING_SAMPLE
+
+    def render_metrics(self):
+        """Счетчики монитора в текстовом формате Prometheus"""
+        from metrics import render
+
+        now = time.monotonic()
+        lines = self.stats['total_requests']
+        since, lines_before = self._metrics_rate
+        self._metrics_rate = (now, lines)
+        alert_stats = self.alert_dispatcher.stats()
+
+        counters = {
+            ('siem_lines_total', ()): lines,
+            ('siem_parse_failures_total', ()): self.parser.failures,
+            ('siem_alerts_suppressed_total', ()): alert_stats['suppressed'],
+        }
+        for alert_type, count in self.stats['incident_types'].items():
+            counters[('siem_alerts_total', (('type', alert_type),))] = count
+        for stage, seconds in self.detector_seconds.items():
+            counters[('siem_detector_seconds_total', (('detector', stage),))] = seconds
+        for sink_name, sink_stats in alert_stats['sinks'].items():
+            counters[('siem_alert_sink_sent_total', (('sink', sink_name),))] = sink_stats['sent']
+            counters[('siem_alert_sink_dropped_total', (('sink', sink_name),))] = sink_stats['dropped']
+
+        if self.event_store is not None:
+            event_stats = self.event_store.stats()
+            counters[('siem_event_store_written_total', ())] = event_stats['written']
+            counters[('siem_event_store_dropped_total', ())] = event_stats['dropped']
+            counters[('siem_event_store_rejected_total', ())] = event_stats['rejected']
+
+        gauges = [('siem_lines_per_second', (), (lines - lines_before) / max(now - since, 1e-9))]
+        if self.event_store is not None:
+            gauges.append(('siem_event_store_queued', (), event_stats['queued']))
+        gauges += [
+            ('siem_alert_sink_queued', (('sink', sink_name),), sink_stats['queued'])
+            for sink_name, sink_stats in alert_stats['sinks'].items()
+        ]
+        return render({
+            'help': {
+                'siem_lines_total': ('counter', 'Обработано строк лога'),
+                'siem_parse_failures_total': ('counter', 'Строки с ошибкой разбора'),
+                'siem_alerts_total': ('counter', 'Инциденты по типам'),
+                'siem_alerts_suppressed_total': ('counter', 'Подавленные повторные алерты'),
+                'siem_detector_seconds_total': ('counter', 'Время этапов обработки строк'),
+                'siem_alert_sink_sent_total': ('counter', 'Доставленные алерты по приемникам'),
+                'siem_alert_sink_dropped_total': ('counter', 'Отброшенные алерты по приемникам'),
+                'siem_lines_per_second': ('gauge', 'Скорость обработки с прошлого опроса'),
+                'siem_alert_sink_queued': ('gauge', 'Алерты в очереди приемника'),
+                'siem_event_store_written_total': ('counter', 'События, записанные в PostgreSQL'),
+                'siem_event_store_dropped_total': ('counter', 'События, не записанные в PostgreSQL'),
+                'siem_event_store_rejected_total': ('counter', 'Строки, отклоненные PostgreSQL при COPY'),
+                'siem_event_store_queued': ('gauge', 'События в очереди записи в PostgreSQL'),
+            },
+            'buckets': {},
+            'counters': counters,
+            'histograms': {},
+            'gauges': gauges,
+        })
+
+    def serve_metrics(self, port, host='127.0.0.1'):
+        """Эндпоинт /metrics монитора в фоновом потоке"""
+        from metrics import start_metrics_server
+        return start_metrics_server(self.render_metrics, host, port)
+
+    def monitor(self, workers=1):
+        """Основной цикл мониторинга (workers > 1 - параллельная обработка в процессах)"""
         print("Запуск SIEM мониторинга...")
         print("Отслеживаемые угрозы:")
-        print("- Brute force атаки (5+ неудачных логинов за 1 минуту)")
+        for alert_type, rule in self.window_rules.items():
+            print(f"- {alert_type}: {rule['threshold']}+ событий '{rule['marker']}' "
+                  f"по ключу {rule['key']} за {rule['window']}")
         print("- SQL инъекции")
         print("- Несанкционированный доступ к защищенным эндпоинтам")
         print("- Сканирование уязвимостей")
         print("-" * 50)
 
-        for line in self.tail_log():
-            self.stats['total_requests'] += 1
+        if workers > 1:
+            from siem_pipeline import SIEMPipeline
+            SIEMPipeline(self, workers).run(self.tail_log(yield_idle=True))
+            return
 
-            log_entry = self.parse_log_line(line)
-            if log_entry:
-                # Проверяем все типы угроз
-                self.detect_brute_force(log_entry)
-                self.detect_sql_injection(log_entry)
-                self.detect_suspicious_access(log_entry)
+        for line in self.tail_log():
+            self.process_line(line)
+
+    def replay(self, paths, workers=1):
+        """Повторный анализ сохраненных логов с начала.
+
+        Читаются указанные файлы и их ротированные копии (.1, .2, .gz) от старых
+        к новым. Окна детекторов считаются по времени событий, а не по часам.
+        """
+        bounds = []
+
+        def tracked(lines):
+            line = None
+            for line in lines:
+                if not bounds:
+                    bounds.append(line)
+                yield line
+            if line is not None:
+                bounds.append(line)
+
+        lines = tracked(read_log_lines(paths))
+        if workers > 1:
+            from siem_pipeline import SIEMPipeline
+            SIEMPipeline(self, workers).run(lines)
+        else:
+            for line in lines:
+                self.process_line(line)
+
+        period = None
+        if len(bounds) == 2:
+            first, last = self.parse_log_line(bounds[0]), self.parse_log_line(bounds[1])
+            if first and last:
+                period = (first.timestamp, last.timestamp)
+                self.report_file = (f"security_report_replay_{period[0].strftime('%Y%m%d')}"
+                                    f"_{period[1].strftime('%Y%m%d')}.txt")
+        # Дожидаемся доставки алертов, чтобы отчет учитывал все приемники
+        self.close()
+        return self.generate_daily_report(period)
 
     def start_scheduled_reporting(self):
         """Запуск генерации отчетов по расписанию"""
@@ -265,15 +509,63 @@ class SIEMMonitor:
 
 
 def main():
-    monitor = SIEMMonitor()
+    parser = argparse.ArgumentParser(description='SIEM мониторинг application.log')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='число процессов для обработки лога (по умолчанию 1)')
+    parser.add_argument('--replay', nargs='+', metavar='LOG',
+                        help='проанализировать сохраненные логи с начала и выйти')
+    parser.add_argument('--smtp', metavar='HOST:PORT',
+                        help='отправлять алерты на SMTP сервер (например, localhost:1025)')
+    parser.add_argument('--alert-to', default='security@localhost',
+                        help='адрес получателя почтовых алертов')
+    parser.add_argument('--webhook', metavar='URL', help='отправлять алерты POST запросом на URL')
+    parser.add_argument('--dedup-window', type=float, default=60,
+                        help='окно подавления повторных алертов (тип + IP), секунд')
+    parser.add_argument('--stats-db', default='siem_stats.db',
+                        help='файл SQLite с поминутной статистикой')
+    parser.add_argument('--report', nargs=2, metavar=('FROM', 'TO'),
+                        help='отчет по сохраненной статистике за интервал (YYYY-MM-DD[THH:MM]) и выход')
+    parser.add_argument('--event-db', metavar='DSN', default=os.getenv('SIEM_EVENT_DSN'),
+                        help='записывать события и алерты в PostgreSQL (например, '
+                             '"dbname=siem user=siem host=localhost")')
+    parser.add_argument('--metrics-port', type=int,
+                        help='порт HTTP эндпоинта /metrics (127.0.0.1) в формате Prometheus')
+    args = parser.parse_args()
+
+    sinks = [FileSink('security_alerts.log'), StdoutSink()]
+    if args.smtp:
+        host, _, port = args.smtp.partition(':')
+        sinks.append(SMTPSink(host, int(port or 25), recipients=[args.alert_to]))
+    if args.webhook:
+        sinks.append(WebhookSink(args.webhook))
+
+    monitor = SIEMMonitor(alert_sinks=sinks, alert_dedup_window=timedelta(seconds=args.dedup_window),
+                          stats_db=args.stats_db, event_dsn=args.event_db)
+
+    if args.report:
+        start, end = (datetime.fromisoformat(value) for value in args.report)
+        if end == end.replace(hour=0, minute=0):
+            # Дата без времени - отчет включает весь день
+            end += timedelta(days=1) - timedelta(minutes=1)
+        monitor.report_file = f"security_report_{start.strftime('%Y%m%d')}_{end.strftime('%Y%m%d')}.txt"
+        print(monitor.generate_daily_report((start, end)))
+        return
+
+    if args.metrics_port:
+        monitor.serve_metrics(args.metrics_port)
+
+    if args.replay:
+        print(monitor.replay(args.replay, workers=args.workers))
+        return
 
     # Запуск генерации отчетов по расписанию
     monitor.start_scheduled_reporting()
 
     try:
-        monitor.monitor()
+        monitor.monitor(workers=args.workers)
     except KeyboardInterrupt:
         print("\nОстановка мониторинга...")
+        monitor.close()
         monitor.generate_daily_report()
 
 
@@ -0,0 +1,212 @@
+"""Параллельная обработка лога в нескольких процессах.
+
+Один читатель собирает строки в пакеты и раскладывает их по воркерам по хешу
+IP, поэтому окно brute force каждого IP живет ровно в одном процессе. Воркеры
+разбирают строки и запускают все детекторы с ключом 'ip' и детекторы без
+состояния. События для правил с другими ключами (например, подбор пароля
+к учетной записи с разных IP) возвращаются в главный процесс: их немного.
+Результаты собираются в исходном порядке строк и передаются в trigger_alert
+главного монитора.
+"""
+import multiprocessing
+import queue
+import re
+import time
+import zlib
+from collections import Counter
+
+from siem_monitor import DETECTOR_TIMING_SAMPLE, SIEMMonitor
+from siem_stats import minute_of
+
+# Как часто главный процесс, ожидая результаты, проверяет, живы ли воркеры, секунд
+WORKER_CHECK_INTERVAL = 1.0
+
+# Ключ, по которому строки распределяются между воркерами
+SHARD_KEY = 'ip'
+
+# IP без полного разбора строки: текстовый формат и JSON (APP_LOG_FORMAT=json,
+# где поле ip пишется раньше message)
+TEXT_IP_RE = re.compile(r'\s*[^ ]+ - [^ ]+ - \[IP: ([\d.]+)\]')
+JSON_IP_RE = re.compile(r'"ip"\s*:\s*"([^"]*)"')
+
+
+class CollectingMonitor(SIEMMonitor):
+    """Монитор воркера: вместо записи алертов собирает их в список"""
+
+    def __init__(self, **kwargs):
+        super().__init__(checkpoint_file=None, alert_sinks=[], stats_db=None, **kwargs)
+        self.collected = []
+        self.line_index = None
+
+    def trigger_alert(self, alert_type, description, log_entry):
+        self.collected.append((self.line_index, 'alert', (alert_type, description, log_entry)))
+
+
+def shard_key(line):
+    """IP строки так же, как его определит LogParser ('unknown', если IP нет).
+
+    Строки без IP попадают в одну группу окна 'unknown', поэтому и в один шард.
+    """
+    if line.lstrip().startswith('{'):
+        match = JSON_IP_RE.search(line)
+    else:
+        match = TEXT_IP_RE.match(line)
+    return (match.group(1) if match else '') or 'unknown'
+
+
+def shard_of(line, workers):
+    return zlib.crc32(shard_key(line).encode()) % workers
+
+
+def worker_main(task_queue, result_queue, monitor_kwargs):
+    monitor = CollectingMonitor(**monitor_kwargs)
+    event_store = monitor.event_store
+    forwarded_markers = {
+        rule['marker'] for rule in monitor.window_rules.values() if rule['key'] != SHARD_KEY
+    }
+    while True:
+        task = task_queue.get()
+        if task is None:
+            if event_store is not None:
+                event_store.close()
+            break
+        seq, lines = task
+        monitor.collected = []
+        failures = monitor.parser.failures
+        detector_seconds = dict(monitor.detector_seconds)
+        minutes = Counter()
+        for line_index, line in lines:
+            monitor.line_index = line_index
+            timed = not line_index % DETECTOR_TIMING_SAMPLE
+            start = time.perf_counter() if timed else 0.0
+            log_entry = monitor.parse_log_line(line)
+            if timed:
+                monitor.detector_seconds['parse'] += (time.perf_counter() - start) * DETECTOR_TIMING_SAMPLE
+            if not log_entry:
+                continue
+            minutes[minute_of(log_entry.timestamp)] += 1
+            if event_store is not None:
+                event_store.add(log_entry)
+            monitor.run_detectors(log_entry, key_names=(SHARD_KEY,), timed=timed)
+            if any(marker in log_entry.message for marker in forwarded_markers):
+                monitor.collected.append((line_index, 'forward', log_entry))
+        result_queue.put((seq, monitor.collected, {
+            'parse_failures': monitor.parser.failures - failures,
+            'minutes': minutes,
+            'detector_seconds': {
+                stage: seconds - detector_seconds[stage] for stage, seconds in monitor.detector_seconds.items()
+            },
+        }))
+
+
+class WorkerDied(RuntimeError):
+    """Воркер завершился, не вернув результаты: состояние его окон потеряно"""
+
+
+class SIEMPipeline:
+    """Читатель, N процессов-воркеров и упорядоченная запись результатов"""
+
+    def __init__(self, monitor, workers, batch_size=2000, max_in_flight=None, monitor_kwargs=None):
+        self.monitor = monitor
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight or workers * 4
+        self.monitor_kwargs = monitor_kwargs or {
+            'window_rules': monitor.window_rules,
+            'window_max_keys': monitor.window_max_keys,
+            # Воркеры пишут разобранные строки в хранилище событий сами
+            'event_dsn': monitor.event_dsn,
+        }
+        self.local_keys = tuple({
+            rule['key'] for rule in monitor.window_rules.values() if rule['key'] != SHARD_KEY
+        })
+        self._next_seq = 0
+        self._emit_seq = 0
+        self._pending = {}
+        self._processes = []
+
+    def run(self, lines):
+        """Обработка строк (None в потоке - сигнал сбросить неполный пакет)"""
+        result_queue = multiprocessing.Queue()
+        task_queues = [multiprocessing.Queue() for _ in range(self.workers)]
+        processes = [
+            multiprocessing.Process(
+                target=worker_main, args=(task_queue, result_queue, self.monitor_kwargs), daemon=True
+            )
+            for task_queue in task_queues
+        ]
+        for process in processes:
+            process.start()
+        self._processes = processes
+
+        try:
+            batch = []
+            for line in lines:
+                if line is not None:
+                    batch.append(line)
+                if len(batch) >= self.batch_size or (line is None and batch):
+                    self._dispatch(batch, task_queues, result_queue)
+                    batch = []
+                if line is None:
+                    # Новых строк нет: дожидаемся результатов, чтобы алерты не ждали следующего пакета
+                    while self._emit_seq < self._next_seq:
+                        self._collect(result_queue)
+            if batch:
+                self._dispatch(batch, task_queues, result_queue)
+            while self._emit_seq < self._next_seq:
+                self._collect(result_queue)
+        finally:
+            for task_queue in task_queues:
+                task_queue.put(None)
+            for process in processes:
+                # Воркер перед выходом дописывает очередь хранилища событий
+                process.join(timeout=60 if self.monitor.event_dsn else 5)
+                if process.is_alive():
+                    process.terminate()
+
+    def _dispatch(self, batch, task_queues, result_queue):
+        while self._next_seq - self._emit_seq >= self.max_in_flight:
+            self._collect(result_queue)
+
+        shards = [[] for _ in range(self.workers)]
+        for line_index, line in enumerate(batch):
+            shards[shard_of(line, self.workers)].append((line_index, line))
+
+        seq = self._next_seq
+        self._next_seq += 1
+        self._pending[seq] = {'parts': 0, 'items': [], 'lines': len(batch)}
+        for task_queue, shard_lines in zip(task_queues, shards):
+            task_queue.put((seq, shard_lines))
+
+    def _collect(self, result_queue):
+        while True:
+            try:
+                seq, items, worker_stats = result_queue.get(timeout=WORKER_CHECK_INTERVAL)
+                break
+            except queue.Empty:
+                # Без проверки главный процесс ждал бы результат погибшего воркера вечно
+                for process in self._processes:
+                    if process.exitcode is not None:
+                        raise WorkerDied(f"Воркер SIEM {process.name} завершился с кодом {process.exitcode}")
+        self.monitor.parser.failures += worker_stats['parse_failures']
+        for stage, seconds in worker_stats['detector_seconds'].items():
+            self.monitor.detector_seconds[stage] += seconds
+        if self.monitor.stats_store is not None:
+            self.monitor.stats_store.add_requests(worker_stats['minutes'])
+        pending = self._pending[seq]
+        pending['parts'] += 1
+        pending['items'].extend(items)
+
+        # Пакеты передаются дальше строго по порядку
+        while self._emit_seq in self._pending and self._pending[self._emit_seq]['parts'] == self.workers:
+            self._emit(self._pending.pop(self._emit_seq))
+            self._emit_seq += 1
+
+    def _emit(self, pending):
+        monitor = self.monitor
+        monitor.stats['total_requests'] += pending['lines']
+        for _, kind, payload in sorted(pending['items'], key=lambda item: item[0]):
+            if kind == 'alert':
+                monitor.trigger_alert(*payload)
+            else:
+                monitor.detect_brute_force(payload, key_names=self.local_keys)
@@ -0,0 +1,64 @@
+"""Чтение сохраненных логов для повторного анализа.
+
+Для каждого указанного файла сначала читаются его ротированные копии от
+старых к новым (application.log.3, .2, .1, в том числе сжатые .gz), затем сам
+файл. Файлы читаются крупными блоками, строки выделяются из блока целиком.
+"""
+import glob
+import gzip
+import os
+import re
+
+ROTATED_SUFFIX_RE = re.compile(r'\.(\d+)(\.gz)?$')
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def expand_log_paths(paths):
+    """Список файлов в хронологическом порядке (ротированные копии раньше текущего)"""
+    result = []
+    for path in paths:
+        rotated = []
+        for candidate in glob.glob(f"{glob.escape(path)}.*"):
+            match = ROTATED_SUFFIX_RE.search(candidate[len(path):])
+            if match and match.start() == 0:
+                rotated.append((int(match.group(1)), candidate))
+        for _, candidate in sorted(rotated, reverse=True):
+            if candidate not in result:
+                result.append(candidate)
+        if os.path.exists(path) and path not in result:
+            result.append(path)
+    return result
+
+
+def open_log(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb', buffering=0)
+
+
+def iter_line_blocks(path, chunk_size=CHUNK_SIZE):
+    """Списки строк файла, по одному на прочитанный блок"""
+    with open_log(path) as f:
+        tail = b''
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            if tail:
+                chunk = tail + chunk
+            end = chunk.rfind(b'\n')
+            if end < 0:
+                tail = chunk
+                continue
+            tail = chunk[end + 1:]
+            yield chunk[:end].decode('utf-8', 'replace').split('\n')
+        if tail:
+            yield [tail.decode('utf-8', 'replace')]
+
+
+def read_log_lines(paths, chunk_size=CHUNK_SIZE):
+    """Все строки указанных логов и их ротированных копий по порядку"""
+    for path in expand_log_paths(paths):
+        for lines in iter_line_blocks(path, chunk_size):
+            yield from lines
@@ -0,0 +1,210 @@
+"""Постоянное хранилище статистики SIEM.
+
+Запросы и инциденты суммируются по минутам времени событий и периодически
+сбрасываются в SQLite (таблица rollups). Подозрительные IP учитываются
+приближенно: по каждому часу хранится не более top_k IP (алгоритм
+Space-Saving), поэтому память и размер базы ограничены при любом числе
+адресов. Отчет за произвольный интервал считается агрегатными запросами по
+rollups без повторного чтения логов и переживает перезапуск монитора.
+"""
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollups (
+    minute TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    key TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (minute, metric, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ip_hourly (
+    hour TEXT NOT NULL,
+    ip TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    error INTEGER NOT NULL,
+    PRIMARY KEY (hour, ip)
+) WITHOUT ROWID;
+"""
+
+MINUTE_FORMAT = '%Y-%m-%d %H:%M'
+HOUR_FORMAT = '%Y-%m-%d %H'
+
+
+def minute_of(timestamp):
+    return timestamp.replace(second=0, microsecond=0)
+
+
+class SpaceSaving:
+    """Приближенный top-K (Space-Saving): не более k счетчиков.
+
+    Значение счетчика завышено не более чем на его error. Вытеснение за O(k)
+    допустимо: add вызывается на инцидентах, а не на каждой строке лога.
+    """
+
+    def __init__(self, k):
+        self.k = k
+        self.counts = {}
+        self.errors = {}
+
+    def add(self, key, count=1):
+        counts = self.counts
+        if key in counts:
+            counts[key] += count
+            return
+        if len(counts) < self.k:
+            counts[key] = count
+            self.errors[key] = 0
+            return
+        victim = min(counts, key=counts.get)
+        floor = counts.pop(victim)
+        del self.errors[victim]
+        counts[key] = floor + count
+        self.errors[key] = floor
+
+    def top(self, n=None):
+        """Список (key, count, error) по убыванию count"""
+        ranked = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:n]
+        return [(key, count, self.errors[key]) for key, count in ranked]
+
+    def __len__(self):
+        return len(self.counts)
+
+
+class StatsStore:
+    """Поминутные агрегаты запросов и инцидентов с почасовым top-K IP"""
+
+    def __init__(self, path='siem_stats.db', top_k=100, flush_interval=5.0):
+        self.path = path
+        self.top_k = top_k
+        self.flush_interval = flush_interval
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._requests = Counter()
+        self._incidents = Counter()
+        self._ips = {}
+        self._last_flush = time.monotonic()
+        # Счетчик текущей минуты: строки лога идут почти по порядку, и для
+        # большинства из них достаточно сравнения и инкремента без блокировки
+        # (записывает только поток обработки, flush забирает значение под блокировкой)
+        self._minute = None
+        self._minute_end = None
+        self._minute_count = 0
+
+    def record_request(self, timestamp):
+        minute = self._minute
+        if minute is not None and minute <= timestamp < self._minute_end:
+            self._minute_count += 1
+            return
+        with self._lock:
+            self._close_minute()
+            self._minute = minute_of(timestamp)
+            self._minute_end = self._minute + timedelta(minutes=1)
+            self._minute_count = 1
+        self._maybe_flush()
+
+    def _close_minute(self):
+        if self._minute_count:
+            self._requests[self._minute] += self._minute_count
+            self._minute_count = 0
+
+    def add_requests(self, minute_counts):
+        """Добавление уже посчитанных по минутам запросов (от воркеров конвейера)"""
+        with self._lock:
+            self._requests.update(minute_counts)
+        self._maybe_flush()
+
+    def record_incident(self, alert_type, ip, timestamp):
+        with self._lock:
+            self._incidents[(minute_of(timestamp), alert_type)] += 1
+            hour = timestamp.replace(minute=0, second=0, microsecond=0)
+            summary = self._ips.get(hour)
+            if summary is None:
+                summary = self._ips[hour] = SpaceSaving(self.top_k)
+            summary.add(ip)
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Запись накопленных агрегатов в базу одной транзакцией"""
+        with self._lock:
+            self._close_minute()
+            requests, self._requests = self._requests, Counter()
+            incidents, self._incidents = self._incidents, Counter()
+            ips, self._ips = self._ips, {}
+            self._last_flush = time.monotonic()
+            if not (requests or incidents or ips):
+                return
+
+            rows = [(minute.strftime(MINUTE_FORMAT), 'requests', '', count) for minute, count in requests.items()]
+            rows += [
+                (minute.strftime(MINUTE_FORMAT), 'incident', alert_type, count)
+                for (minute, alert_type), count in incidents.items()
+            ]
+            with self.conn:
+                self.conn.execute('BEGIN')
+                self.conn.executemany(
+                    'INSERT INTO rollups (minute, metric, key, count) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (minute, metric, key) DO UPDATE SET count = count + excluded.count',
+                    rows
+                )
+                for hour, summary in ips.items():
+                    hour_key = hour.strftime(HOUR_FORMAT)
+                    self.conn.executemany(
+                        'INSERT INTO ip_hourly (hour, ip, count, error) VALUES (?, ?, ?, ?) '
+                        'ON CONFLICT (hour, ip) DO UPDATE SET '
+                        'count = count + excluded.count, error = error + excluded.error',
+                        [(hour_key, ip, count, error) for ip, count, error in summary.top()]
+                    )
+                    # В базе за час остаются только top_k самых частых IP
+                    self.conn.execute(
+                        'DELETE FROM ip_hourly WHERE hour = ? AND ip NOT IN '
+                        '(SELECT ip FROM ip_hourly WHERE hour = ? ORDER BY count DESC LIMIT ?)',
+                        (hour_key, hour_key, self.top_k)
+                    )
+
+    def report(self, start, end, top_n=20):
+        """Агрегаты за интервал времени событий [start, end)"""
+        self.flush()
+        bounds = (start.strftime(MINUTE_FORMAT), end.strftime(MINUTE_FORMAT))
+        result = {'requests': 0, 'incidents': 0, 'incident_types': {}, 'top_ips': [], 'hourly': []}
+
+        for metric, key, count in self.conn.execute(
+            'SELECT metric, key, SUM(count) FROM rollups WHERE minute >= ? AND minute < ? '
+            'GROUP BY metric, key ORDER BY metric, SUM(count) DESC',
+            bounds
+        ):
+            if metric == 'requests':
+                result['requests'] += count
+            else:
+                result['incidents'] += count
+                result['incident_types'][key] = count
+
+        result['hourly'] = self.conn.execute(
+            "SELECT substr(minute, 1, 13) AS hour, "
+            "SUM(CASE WHEN metric = 'requests' THEN count ELSE 0 END), "
+            "SUM(CASE WHEN metric = 'incident' THEN count ELSE 0 END) "
+            "FROM rollups WHERE minute >= ? AND minute < ? GROUP BY hour ORDER BY hour",
+            bounds
+        ).fetchall()
+
+        last_hour = (end - timedelta(microseconds=1)).strftime(HOUR_FORMAT)
+        result['top_ips'] = self.conn.execute(
+            'SELECT ip, SUM(count), SUM(error) FROM ip_hourly WHERE hour >= ? AND hour <= ? '
+            'GROUP BY ip ORDER BY SUM(count) DESC LIMIT ?',
+            (start.strftime(HOUR_FORMAT), last_hour, top_n)
+        ).fetchall()
+        return result
+
+    def close(self):
+        self.flush()
+        self.conn.close()
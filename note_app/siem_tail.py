@@ -0,0 +1,268 @@
+"""Чтение растущего лог файла с учетом ротации.
+
+Ожидание новых данных - через inotify (Linux), иначе опрос с коротким
+интервалом. Файл читается крупными блоками, строки выделяются из общего
+буфера. Ротация (переименование, удаление, пересоздание) определяется по смене
+inode, усечение - по уменьшению размера. Смещение последней обработанной строки
+сохраняется в файл контрольной точки, чтобы после перезапуска продолжить с
+того же места.
+"""
+import ctypes
+import ctypes.util
+import glob
+import json
+import os
+import select
+import struct
+import time
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """Ожидание изменений файла через inotify на его каталоге"""
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.name = os.path.basename(path).encode()
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        directory = os.path.dirname(os.path.abspath(path)).encode()
+        if libc.inotify_add_watch(self.fd, directory, WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, 'inotify_add_watch failed')
+
+    def wait(self, timeout):
+        """True, если отслеживаемый файл изменился за timeout секунд"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if not ready:
+                return False
+            if self._drain():
+                return True
+
+    def _drain(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+        matched = False
+        offset = 0
+        while offset < len(data):
+            _, _, _, name_length = EVENT_HEADER.unpack_from(data, offset)
+            start = offset + EVENT_HEADER.size
+            name = data[start:start + name_length].rstrip(b'\0')
+            matched = matched or name == self.name
+            offset = start + name_length
+        return matched
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Запасной вариант без inotify: периодическая проверка файла"""
+
+    def __init__(self, path, interval=0.05):
+        self.interval = interval
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        return True
+
+    def close(self):
+        pass
+
+
+def create_watcher(path, use_inotify=True):
+    if use_inotify:
+        try:
+            return InotifyWatcher(path)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(path)
+
+
+class LogTailer:
+    """Построчное чтение растущего файла с учетом ротации и контрольной точкой"""
+
+    def __init__(self, path, checkpoint_path=None, chunk_size=256 * 1024,
+                 checkpoint_interval=1.0, use_inotify=True, idle_timeout=1.0):
+        self.path = path
+        self.checkpoint_path = checkpoint_path
+        self.chunk_size = chunk_size
+        self.checkpoint_interval = checkpoint_interval
+        self.use_inotify = use_inotify
+        self.idle_timeout = idle_timeout
+        self.rotations = 0
+        self.truncations = 0
+        self._fd = None
+        self._file_id = None
+        self._offset = 0
+        self._last_checkpoint = 0.0
+
+    @staticmethod
+    def _stat_id(stat):
+        return stat.st_dev, stat.st_ino
+
+    def _load_checkpoint(self):
+        if not self.checkpoint_path:
+            return None
+        try:
+            with open(self.checkpoint_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_checkpoint(self):
+        if not self.checkpoint_path or self._file_id is None:
+            return
+        data = {'path': self.path, 'dev': self._file_id[0], 'ino': self._file_id[1], 'offset': self._offset}
+        temp_path = f"{self.checkpoint_path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.checkpoint_path)
+        self._last_checkpoint = time.monotonic()
+
+    def _open(self, path, offset):
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = os.open(path, os.O_RDONLY)
+        self._file_id = self._stat_id(os.fstat(self._fd))
+        self._offset = offset
+        os.lseek(self._fd, offset, os.SEEK_SET)
+
+    def _find_rotated(self, file_id):
+        """Поиск ротированной копии файла (application.log.1 и т.п.) по inode"""
+        for candidate in glob.glob(f"{glob.escape(self.path)}.*"):
+            try:
+                if self._stat_id(os.stat(candidate)) == file_id:
+                    return candidate
+            except OSError:
+                continue
+        return None
+
+    def _open_initial(self):
+        """Открытие файла с позиции контрольной точки или с конца файла.
+
+        Возвращает путь ротированного файла, который нужно дочитать первым, или None.
+        """
+        current = os.stat(self.path)
+        checkpoint = self._load_checkpoint()
+        if checkpoint is None:
+            self._open(self.path, current.st_size)
+            return None
+
+        saved_id = (checkpoint['dev'], checkpoint['ino'])
+        if saved_id == self._stat_id(current) and checkpoint['offset'] <= current.st_size:
+            self._open(self.path, checkpoint['offset'])
+            return None
+
+        # Файл был ротирован, пока монитор не работал
+        rotated = self._find_rotated(saved_id)
+        if rotated is not None:
+            self._open(rotated, checkpoint['offset'])
+            return rotated
+        self._open(self.path, 0)
+        return None
+
+    def _check_rotation(self):
+        """True, если файл по пути ротирован или усечен и его нужно открыть заново"""
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        if self._stat_id(current) != self._file_id:
+            self.rotations += 1
+            return True
+        if current.st_size < self._offset:
+            self.truncations += 1
+            return True
+        return False
+
+    def _complete_lines(self, buffer):
+        """Завершенные строки из начала буфера"""
+        end = buffer.rfind(b'\n')
+        if end < 0:
+            return
+        block = bytes(buffer[:end + 1])
+        del buffer[:end + 1]
+        # Смещение растет до передачи строки: если потребитель остановится
+        # посреди блока, контрольная точка укажет на следующую строку, и
+        # отданные строки не повторятся
+        for raw_line in block.split(b'\n')[:-1]:
+            self._offset += len(raw_line) + 1
+            yield raw_line.decode('utf-8', 'replace')
+
+    def _drain(self, buffer):
+        """Остаток файла перед переходом к другому.
+
+        Писатель мог дописать строки после последнего чтения и до ротации,
+        поэтому файл дочитывается до конца; незавершенная последняя строка
+        отдается целиком - продолжения у нее уже не будет.
+        """
+        while True:
+            data = os.read(self._fd, self.chunk_size)
+            if not data:
+                break
+            buffer += data
+            yield from self._complete_lines(buffer)
+        if buffer:
+            tail = bytes(buffer)
+            buffer.clear()
+            self._offset += len(tail)
+            yield tail.decode('utf-8', 'replace')
+
+    def lines(self, yield_idle=False):
+        """Генератор строк (без символа перевода строки).
+
+        При yield_idle=True, дочитав файл до конца, генератор отдает None: это
+        позволяет потребителю сбросить накопленный пакет, не дожидаясь новых строк.
+        """
+        rotated = self._open_initial()
+        watcher = create_watcher(self.path, self.use_inotify)
+        buffer = bytearray()
+        try:
+            while True:
+                if time.monotonic() - self._last_checkpoint >= self.checkpoint_interval:
+                    self.save_checkpoint()
+
+                data = os.read(self._fd, self.chunk_size)
+                if data:
+                    buffer += data
+                    yield from self._complete_lines(buffer)
+                    continue
+
+                if rotated is not None or self._check_rotation():
+                    # Ротированный (или усеченный) файл дочитан, переходим к текущему
+                    rotated = None
+                    yield from self._drain(buffer)
+                    self._open(self.path, 0)
+                    continue
+                if yield_idle:
+                    yield None
+                watcher.wait(self.idle_timeout)
+        finally:
+            self.save_checkpoint()
+            watcher.close()
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
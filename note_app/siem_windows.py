@@ -0,0 +1,50 @@
+"""Счетчики событий в скользящем временном окне с ограниченной памятью"""
+from collections import OrderedDict, deque
+
+
+class SlidingWindowCounter:
+    """Число событий за последние window по каждому ключу (IP, имя пользователя).
+
+    Для ключа хранится deque не длиннее threshold: больше меток для решения
+    не нужно, поэтому память на ключ ограничена. Ключи упорядочены по последнему
+    событию (LRU): ключи без событий дольше окна вытесняются из начала, а при
+    превышении max_keys вытесняется самый давний ключ. Все операции O(1)
+    амортизированно.
+    """
+
+    def __init__(self, window, threshold, max_keys=100000):
+        self.window = window
+        self.threshold = threshold
+        self.max_keys = max_keys
+        self.evicted = 0
+        self._keys = OrderedDict()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def hit(self, key, timestamp):
+        """Учет события ключа, возвращает число его событий в окне"""
+        events = self._keys.get(key)
+        if events is None:
+            events = deque(maxlen=self.threshold)
+            self._keys[key] = events
+        else:
+            self._keys.move_to_end(key)
+        events.append(timestamp)
+
+        horizon = timestamp - self.window
+        while events[0] <= horizon:
+            events.popleft()
+        self._evict(horizon)
+        return len(events)
+
+    def reset(self, key):
+        self._keys.pop(key, None)
+
+    def _evict(self, horizon):
+        while self._keys:
+            key, events = next(iter(self._keys.items()))
+            if len(self._keys) <= self.max_keys and events[-1] > horizon:
+                break
+            del self._keys[key]
+            self.evicted += 1
@@ -0,0 +1,613 @@
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ['METRICS_DIR'] = tempfile.mkdtemp(prefix='note_app_metrics_')
+os.environ['NOTES_CACHE_VERSION_FILE'] = os.path.join(os.environ['METRICS_DIR'], 'cache_versions')
+os.environ['PASSWORD_SCRYPT_N'] = '1024'
+os.environ['RATELIMIT_FILE'] = os.path.join(os.environ['METRICS_DIR'], 'ratelimit')
+
+import pytest
+from flask import render_template_string
+from sqlalchemy import MetaData, create_engine, event, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+import api as api_module
+import cache
+import compression
+import credentials
+import csp
+import db_pool
+import models
+import log_pipeline
+import metrics
+import ratelimit
+import search
+from app import app
+from models import db, User, Note, init_storage
+
+
+@pytest.fixture
+def client():
+    app.config['WTF_CSRF_ENABLED'] = False
+    ratelimit.limiter.clear()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add_all([
+            User(username='alice', password=credentials.hash_password('alice-pass')),
+            User(username='bob', password=credentials.hash_password('bob-pass')),
+        ])
+        db.session.commit()
+        db.session.add_all([
+            Note(title='Заметка 1', content='Содержание 1', user_id=1),
+            Note(title='Заметка 2', content='Содержание 2', user_id=1),
+            Note(title='Чужая заметка', content='Содержание', user_id=2),
+        ])
+        db.session.commit()
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+        sess['username'] = 'alice'
+    return client
+
+
+@contextmanager
+def count_queries():
+    """Счетчик SQL запросов, выполненных внутри блока"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def test_index_uses_single_query(client):
+    """Список заметок загружается одним запросом"""
+    with count_queries() as statements:
+        response = client.get('/')
+    assert response.status_code == 200
+    assert len(statements) == 1
+
+
+def test_index_is_cached_until_notes_change(client):
+    """Повторный список берется из кэша, изменение заметок сбрасывает его"""
+    client.get('/')
+    with count_queries() as statements:
+        response = client.get('/')
+    assert 'Заметка 2' in response.get_data(as_text=True)
+    assert len(statements) == 0
+
+    client.post('/edit/2', data={'title': 'Новый заголовок', 'content': 'Текст'})
+    response = client.post('/api/v1/notes/batch', json={'delete': [1]})
+    assert response.status_code == 200
+    with count_queries() as statements:
+        body = client.get('/').get_data(as_text=True)
+    assert len(statements) == 1
+    assert 'Новый заголовок' in body
+    assert 'Заметка 1' not in body
+
+
+def test_index_answers_not_modified_without_queries(client):
+    """Совпавший ETag дает 304 без запросов, изменение заметок - новую страницу"""
+    etag = client.get('/').headers['ETag']
+    assert etag.startswith('W/')
+    with count_queries() as statements:
+        response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert len(statements) == 0
+    assert response.headers['X-Frame-Options'] == 'SAMEORIGIN'
+    assert response.headers['X-Content-Type-Options'] == 'nosniff'
+
+    client.post('/add', data={'title': 'Новая', 'content': 'Текст'})
+    client.get('/')  # показ flash-сообщения
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_static_files_are_versioned_and_compressed(client):
+    """Ссылки на статику содержат хеш, ответы сжимаются и кэшируются надолго"""
+    body = client.get('/').get_data(as_text=True)
+    url = body.split('href="', 1)[1].split('"', 1)[0]
+    assert url.startswith('/static/style.css?v=')
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    with open(os.path.join(app.static_folder, 'style.css'), 'rb') as f:
+        assert gzip.decompress(response.get_data()) == f.read()
+
+
+def test_edit_page_loads_note_once(client):
+    """Проверка владельца и загрузка заметки выполняются одним запросом"""
+    with count_queries() as statements:
+        response = client.get('/edit/1')
+    assert response.status_code == 200
+    assert 'Содержание 1' in response.get_data(as_text=True)
+    assert len(statements) == 1
+
+
+def test_edit_note_queries(client):
+    """Сохранение заметки: выборка, номер версии, запись в историю и UPDATE"""
+    with count_queries() as statements:
+        response = client.post('/edit/1', data={'title': 'Новый заголовок', 'content': 'Новое'})
+    assert response.status_code == 302
+    assert len(statements) == 4
+    with app.app_context():
+        assert db.session.get(Note, 1).title == 'Новый заголовок'
+
+
+def test_delete_note_queries(client):
+    """Удаление заметки: выборка, удаление истории и DELETE"""
+    with count_queries() as statements:
+        response = client.get('/delete/1')
+    assert response.status_code == 302
+    assert len(statements) == 3
+    with app.app_context():
+        assert db.session.get(Note, 1) is None
+
+
+def test_large_content_is_stored_compressed(client):
+    content = '\n'.join(f"Строка {i} длинной заметки" for i in range(500))
+    response = client.post('/api/v1/notes', json={'title': 'Большая', 'content': content})
+    note_id = response.get_json()['id']
+    with app.app_context():
+        stored = db.session.execute(text('SELECT content FROM notes WHERE id = :id'), {'id': note_id}).scalar()
+        assert compression.is_compressed(stored)
+        assert len(stored) < len(content) / 2
+        assert db.session.get(Note, note_id).content == content
+    # Фрагмент для списка распаковывается из начала сжатого значения
+    excerpt = next(note for note in client.get('/api/v1/notes').get_json()['notes'] if note['id'] == note_id)['excerpt']
+    assert excerpt.startswith('Строка 0 длинной заметки\nСтрока 1')
+    assert excerpt.endswith('…')
+
+
+def test_batch_reports_invalid_items_and_applies_the_rest(client):
+    response = client.post('/api/v1/notes/batch', json={
+        'create': [{'title': 'Новая', 'content': 'Текст'}, {'title': '', 'content': 'Текст'}, 'заметка'],
+        'update': [{'id': True, 'title': 'Подмена'}, {'id': 2, 'title': 'Обновлена'},
+                   {'id': 3, 'title': 'Чужая'}, {'id': 2}, {'id': '1', 'title': 'Строка'}],
+        'delete': [True, 1.0, 3],
+    })
+    assert response.status_code == 200
+    data = response.get_json()
+    assert len(data['created']) == 1
+    assert (data['updated'], data['deleted']) == ([2], [])
+    assert sorted((item['op'], item['index'], item['error']) for item in data['errors']) == [
+        ('create', 1, 'Заголовок обязателен'),
+        ('create', 2, 'Ожидается JSON объект'),
+        ('delete', 0, 'Не указан id заметки'),
+        ('delete', 1, 'Не указан id заметки'),
+        ('delete', 2, 'Заметка не найдена'),
+        ('update', 0, 'Не указан id заметки'),
+        ('update', 2, 'Заметка не найдена'),
+        ('update', 3, 'Нет полей для обновления'),
+        ('update', 4, 'Не указан id заметки'),
+    ]
+    with app.app_context():
+        assert [note.title for note in Note.query.order_by(Note.id)] == \
+            ['Заметка 1', 'Обновлена', 'Чужая заметка', 'Новая']
+
+
+def test_revisions_list_and_restore(client):
+    versions = ['Первая строка\nВторая строка\n']
+    client.put('/api/v1/notes/1', json={'title': 'Версия 0', 'content': versions[0]})
+    for number in range(1, 25):
+        versions.append(versions[-1] + f"Строка {number}\n")
+        client.put('/api/v1/notes/1', json={'title': f'Версия {number}', 'content': versions[-1]})
+
+    revisions = client.get('/api/v1/notes/1/revisions').get_json()['revisions']
+    assert [revision['number'] for revision in revisions] == list(range(25, 0, -1))
+    assert any(revision['snapshot'] for revision in revisions)
+    # Версия 1 - исходное содержимое, версия n + 2 - versions[n]
+    for number in (2, 9, 10, 11, 20, 25):
+        revision = client.get(f'/api/v1/notes/1/revisions/{number}').get_json()
+        assert revision['content'] == versions[number - 2]
+        assert revision['title'] == f'Версия {number - 2}'
+    assert client.get('/api/v1/notes/1/revisions/99').status_code == 404
+    assert client.get('/api/v1/notes/3/revisions').status_code == 404
+
+    # Без тела и JSON типа (как у кросс-доменной формы) запрос отклоняется
+    response = client.post('/api/v1/notes/1/revisions/5/restore', content_type='application/x-www-form-urlencoded')
+    assert response.status_code == 415
+    assert client.get('/api/v1/notes/1').get_json()['content'] == versions[-1]
+    response = client.post('/api/v1/notes/1/revisions/5/restore', headers={'X-Requested-With': 'fetch'})
+    assert response.get_json()['content'] == versions[3]
+    revision = client.get('/api/v1/notes/1/revisions/26').get_json()
+    assert revision['content'] == versions[-1]
+
+
+def test_export_streams_ndjson_and_csv(client):
+    response = client.get('/api/v1/notes/export')
+    assert response.is_streamed
+    notes = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [note['title'] for note in notes] == ['Заметка 1', 'Заметка 2']
+    assert notes[0]['content'] == 'Содержание 1'
+
+    response = client.get('/api/v1/notes/export?format=csv&compress=gzip')
+    assert response.headers['Content-Disposition'] == 'attachment; filename="notes.csv.gz"'
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(response.get_data()).decode('utf-8'))))
+    assert [row['content'] for row in rows] == ['Содержание 1', 'Содержание 2']
+
+
+def test_import_streams_progress_and_invalidates_caches(client, monkeypatch):
+    monkeypatch.setattr(api_module, 'IMPORT_BATCH_SIZE', 2)
+    assert 'Импортированная' not in client.get('/').get_data(as_text=True)
+    assert client.get('/search?q=импортированное').status_code == 200
+
+    lines = [json.dumps({'title': f'Импортированная {i}', 'content': f'Импортированное содержание\u2028{i}',
+                         'date': '2024-01-0%dT10:00:00' % (i + 1)}, ensure_ascii=False) for i in range(3)]
+    lines.insert(1, '{"title": ')
+    lines.append(json.dumps({'title': '', 'content': 'без заголовка'}))
+    response = client.post('/api/v1/notes/import', data=gzip.compress('\n'.join(lines).encode('utf-8')),
+                           headers={'Content-Type': 'application/x-ndjson', 'Content-Encoding': 'gzip'})
+    progress = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert progress[0] == {'imported': 2, 'failed': 1}
+    assert progress[-1]['done'] and progress[-1]['imported'] == 3 and progress[-1]['failed'] == 2
+    assert [error['line'] for error in progress[-1]['errors']] == [2, 5]
+
+    assert 'Импортированная 2' in client.get('/').get_data(as_text=True)
+    assert 'Импортированная 0' in client.get('/search?q=импортированное').get_data(as_text=True)
+
+    response = client.post('/api/v1/notes/import', data='title,content\nИз CSV,"две\nстроки"\n',
+                           content_type='text/csv')
+    assert response.get_data(as_text=True).endswith('"imported": 1, "failed": 0, "errors": []}\n')
+    response = client.post('/api/v1/notes/import', data='x', content_type='text/plain')
+    assert response.status_code == 415
+
+
+def test_cursor_walks_all_pages_including_notes_without_date(client, monkeypatch):
+    with app.app_context():
+        # Таблица из версии, где date допускал NULL
+        Note.__table__.drop(db.engine)
+        metadata = MetaData()
+        User.__table__.to_metadata(metadata)
+        legacy = Note.__table__.to_metadata(metadata)
+        legacy.c.date.nullable = True
+        legacy.create(db.engine)
+        same_time = datetime(2024, 5, 1, 12, 0)
+        db.session.execute(legacy.insert(), [
+            {'title': f'Заметка {index}', 'content': 'x', 'user_id': 1,
+             'date': None if index % 3 == 0 else same_time + timedelta(minutes=index // 4)}
+            for index in range(11)
+        ])
+        db.session.commit()
+        init_storage()
+        assert db.session.execute(text('SELECT COUNT(*) FROM notes WHERE date IS NULL')).scalar() == 0
+    cache.note_cache.bump(1)
+    monkeypatch.setitem(app.config, 'NOTES_PAGE_SIZE', 2)
+
+    seen, cursor = [], None
+    while True:
+        data = client.get('/api/v1/notes', query_string={'cursor': cursor} if cursor else None).get_json()
+        seen.extend((note['date'], note['id']) for note in data['notes'])
+        cursor = data['next_cursor']
+        if cursor is None:
+            break
+    assert len(seen) == 11 and len(set(seen)) == 11
+    assert seen == sorted(seen, reverse=True)
+    assert seen[-1][0] == models.UNKNOWN_NOTE_DATE.isoformat()
+
+
+def test_search_index_sees_changes_committed_by_other_workers(client):
+    assert 'Заметка 1' in client.get('/search?q=содержание').get_data(as_text=True)
+    with app.app_context():
+        # Другой воркер: изменение без событий маппера этого процесса, только новая версия
+        db.session.execute(text("UPDATE notes SET content = 'другой текст' WHERE id = 1"))
+        db.session.commit()
+    cache.note_cache.bump(1)
+    assert 'Заметка 1' not in client.get('/search?q=содержание').get_data(as_text=True)
+
+
+def test_search_index_keeps_recent_users_only(client):
+    index = search.InvertedIndex(max_users=2)
+    with app.app_context():
+        for user_id in (1, 2, 1, 3):
+            index.search(user_id, 'содержание', 10, 0)
+    assert list(index._users) == [1, 3]
+
+
+def test_foreign_note_is_not_accessible(client):
+    """Чужая заметка не редактируется и не удаляется"""
+    with count_queries() as statements:
+        response = client.get('/delete/3')
+    assert response.status_code == 302
+    assert len(statements) == 1
+    with app.app_context():
+        assert db.session.get(Note, 3) is not None
+
+
+def test_api_get_note_uses_single_query(client):
+    with count_queries() as statements:
+        response = client.get('/api/v1/notes/2')
+    assert response.status_code == 200
+    assert response.get_json()['content'] == 'Содержание 2'
+    assert len(statements) == 1
+
+
+def test_login_uses_single_query(client):
+    client.get('/logout')
+    with count_queries() as statements:
+        response = client.post('/login', data={'username': 'alice', 'password': 'alice-pass'})
+    assert response.status_code == 302
+    assert len(statements) == 1
+
+
+def test_login_upgrades_legacy_password(client):
+    client.get('/logout')
+    with app.app_context():
+        db.session.get(User, 2).password = 'bob-pass'
+        db.session.commit()
+    response = client.post('/login', data={'username': 'bob', 'password': 'wrong'})
+    assert response.status_code == 200
+    response = client.post('/login', data={'username': 'bob', 'password': 'bob-pass'})
+    assert response.status_code == 302
+    with app.app_context():
+        stored = db.session.get(User, 2).password
+    assert stored.startswith('scrypt$1024$8$1$')
+    assert credentials.verify_password(stored, 'bob-pass') == (True, None)
+
+    # Смена параметров: хеш пересчитывается при следующем входе
+    params = credentials.Params(2048, 8, 1)
+    assert credentials.verify_password(stored, 'bob-pass', params)[1].startswith('scrypt$2048$')
+
+
+def test_login_returns_503_when_hash_pool_is_full(client, monkeypatch):
+    client.get('/logout')
+    verifier = credentials.Verifier(workers=1, queue_limit=0)
+    _, slots = verifier._pool()
+    slots.acquire()
+    monkeypatch.setattr(credentials, 'verifier', verifier)
+    response = client.post('/login', data={'username': 'alice', 'password': 'alice-pass'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '2'
+    assert verifier.stats()['rejected'] == 1
+
+
+def test_login_is_rate_limited_before_database(client):
+    client.get('/logout')
+    for _ in range(5):
+        response = client.post('/login', data={'username': 'Alice', 'password': 'wrong'})
+        assert response.status_code == 200
+    with count_queries() as statements:
+        response = client.post('/login', data={'username': 'alice', 'password': 'wrong'})
+    assert response.status_code == 429
+    assert 0 < int(response.headers['Retry-After']) <= 12
+    assert len(statements) == 0
+
+    # Другое имя с того же адреса ограничено только лимитом адреса
+    response = client.post('/login', data={'username': 'bob', 'password': 'bob-pass'})
+    assert response.status_code == 302
+
+
+def test_ip_limit_uses_forwarded_client_address(client, monkeypatch):
+    monkeypatch.setattr(app, 'wsgi_app', ProxyFix(app.wsgi_app, x_for=1))
+    client.get('/logout')
+
+    def register(address):
+        return client.post('/register', data={'username': '', 'password': ''},
+                           headers={'X-Forwarded-For': address}).status_code
+
+    # Все запросы приходят с адреса прокси, лимит считается по адресу клиента
+    assert [register('203.0.113.1') for _ in range(5)] == [200] * 5
+    assert register('203.0.113.1') == 429
+    assert register('203.0.113.2') == 200
+
+
+def test_shared_buckets_refill_and_evict(tmp_path):
+    buckets = ratelimit.SharedBuckets(str(tmp_path / 'buckets'), sets=1)
+    assert buckets.acquire('a', 1.0, 2, now=100.0) == 0
+    assert buckets.acquire('a', 1.0, 2, now=100.0) == 0
+    assert buckets.acquire('a', 1.0, 2, now=100.0) == pytest.approx(1.0)
+    assert buckets.acquire('a', 1.0, 2, now=101.5) == 0
+    # Другой процесс видит то же состояние
+    other = ratelimit.SharedBuckets(str(tmp_path / 'buckets'), sets=1)
+    assert other.acquire('a', 1.0, 2, now=101.5) == pytest.approx(0.5)
+    # При переполнении набора вытесняется самая старая корзина
+    for index, key in enumerate('bcde'):
+        assert other.acquire(key, 1.0, 2, now=200.0 + index) == 0
+    assert other.acquire('a', 1.0, 2, now=205.0) == 0
+
+
+def run_forked(func, processes=4):
+    """Запуск func() в процессах, созданных fork (как воркеры при GUNICORN_PRELOAD)"""
+    children = []
+    for _ in range(processes):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            try:
+                os.write(write_fd, str(func()).encode())
+            finally:
+                os._exit(0)
+        os.close(write_fd)
+        children.append((pid, read_fd))
+    results = []
+    for pid, read_fd in children:
+        with os.fdopen(read_fd) as pipe:
+            results.append(int(pipe.read()))
+        os.waitpid(pid, 0)
+    return results
+
+
+def test_shared_buckets_lock_between_forked_workers(tmp_path):
+    buckets = ratelimit.SharedBuckets(str(tmp_path / 'buckets'), sets=1)
+    buckets.acquire('warmup', 1.0, 1, now=0.0)
+
+    def worker():
+        return sum(buckets.acquire('a', 1e-9, 10000, now=100.0) == 0 for _ in range(6000))
+
+    # 24000 попыток на корзину из 10000 токенов: потерянная запись дала бы лишние токены
+    assert sum(run_forked(worker)) == 10000
+
+
+def test_cache_versions_bump_between_forked_workers(tmp_path):
+    versions = cache.SharedVersions(str(tmp_path / 'versions'), slots=4)
+
+    def worker():
+        for _ in range(5000):
+            versions.bump(1)
+        return 0
+
+    run_forked(worker)
+    # Потерянное увеличение оставило бы воркеру устаревшую страницу и ETag
+    assert versions.get(1) == 20000
+
+
+def test_shared_file_refuses_symlink(tmp_path):
+    (tmp_path / 'target').write_bytes(b'')
+    os.symlink(tmp_path / 'target', tmp_path / 'buckets')
+    with pytest.raises(OSError):
+        ratelimit.SharedBuckets(str(tmp_path / 'buckets'), sets=1)
+
+
+def test_engine_options_from_environment(monkeypatch):
+    assert db_pool.engine_options('sqlite:///notes.db') == {}
+    monkeypatch.setenv('DB_POOL_SIZE', '3')
+    monkeypatch.setenv('DB_POOL_PRE_PING', 'off')
+    options = db_pool.engine_options('postgresql://notes@localhost/notes')
+    assert options['poolclass'] is db_pool.TimedQueuePool
+    assert (options['pool_size'], options['max_overflow'], options['pool_pre_ping']) == (3, 2, False)
+
+
+def test_pool_stats_count_waits_for_connection():
+    engine = create_engine('sqlite://', poolclass=db_pool.TimedQueuePool,
+                           pool_size=1, max_overflow=0, pool_timeout=0.05)
+    connection = engine.connect()
+    with pytest.raises(PoolTimeoutError):
+        engine.connect()
+    stats = db_pool.pool_stats(engine)
+    assert (stats['pool_class'], stats['size'], stats['checked_out'], stats['wait_count']) == \
+        ('TimedQueuePool', 1, 1, 2)
+    assert stats['wait_seconds_max'] >= 0.05
+    connection.close()
+    assert db_pool.pool_stats(engine)['checked_in'] == 1
+    engine.dispose()
+
+
+def test_buffered_file_handler_reopens_rotated_file(tmp_path):
+    path = tmp_path / 'application.log'
+    handler = log_pipeline.BufferedFileHandler(str(path), buffer_size=0)
+    record = logging.LogRecord('application', logging.INFO, __file__, 0, 'строка %d', (1,), None)
+    handler.handle(record)
+    os.rename(path, f"{path}.1")
+    record.args = (2,)
+    handler.handle(record)
+    handler.close()
+    assert (path.read_text(), (tmp_path / 'application.log.1').read_text()) == ('строка 2\n', 'строка 1\n')
+
+
+def test_log_pipeline_counts_and_reports_dropped_records(tmp_path, caplog):
+    class BlockedHandler(log_pipeline.BufferedFileHandler):
+        def emit(self, record):
+            released.wait(5)
+            super().emit(record)
+
+    released = threading.Event()
+    target = BlockedHandler(str(tmp_path / 'application.log'))
+    pipeline = log_pipeline.LogPipeline([target], flush_interval=0.05, max_queue_size=2)
+    test_logger = logging.getLogger('test_log_pipeline')
+    test_logger.propagate = False
+    test_logger.addHandler(pipeline.handler)
+    # Поток записи ждет на первой записи, очередь вмещает еще две
+    for index in range(5):
+        test_logger.warning('событие %d', index)
+    released.set()
+    pipeline.stop()
+    test_logger.removeHandler(pipeline.handler)
+    written = (tmp_path / 'application.log').read_text().splitlines()
+    assert len(written) + pipeline.stats()['dropped'] == 5
+    assert pipeline.stats()['dropped'] >= 2
+    assert 'Очередь логов переполнена' in caplog.text
+
+
+def test_snapshot_store_refuses_shared_directory_and_symlinks(tmp_path):
+    open_directory = tmp_path / 'open'
+    open_directory.mkdir(mode=0o755)
+    open_directory.chmod(0o755)
+    with pytest.raises(RuntimeError):
+        metrics.SnapshotStore(str(open_directory))
+
+    store = metrics.SnapshotStore(str(tmp_path / 'metrics'))
+    victim = tmp_path / 'victim'
+    victim.write_text('не трогать')
+    os.symlink(victim, store.path_for(os.getpid()) + '.tmp')
+    registry = metrics.Registry()
+    registry.inc('test_total')
+    store.write(registry, force=True)
+    assert victim.read_text() == 'не трогать'
+    assert not os.path.exists(store.path_for(os.getpid()))
+
+    os.remove(store.path_for(os.getpid()) + '.tmp')
+    for name, content in (('123.json', '[]'), ('124.json', '{"pid": "x"}'), ('125.json', '{oops')):
+        (tmp_path / 'metrics' / name).write_text(content)
+    store.write(registry, force=True)
+    assert metrics.render(store.collect()).count('test_total 1') == 1
+
+
+def test_metrics_endpoint_reports_route_latency_and_queries(client):
+    client.get('/')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'http_requests_total{method="GET",route="/",status="200"}' in body
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/",le="+Inf"}' in body
+    assert 'http_request_db_queries_sum{route="/"}' in body
+    assert 'template_render_seconds_count{template="index.html"}' in body
+
+
+@pytest.mark.parametrize('path', ['/metrics', '/health/pool'])
+def test_internal_endpoints_require_token_or_local_request(client, monkeypatch, path):
+    assert client.get(path).status_code == 200
+    assert client.get(path, environ_base={'REMOTE_ADDR': '203.0.113.5'}).status_code == 403
+    # Через обратный прокси на этом же хосте
+    assert client.get(path, headers={'X-Forwarded-For': '203.0.113.5'}).status_code == 403
+    monkeypatch.setattr(app, 'wsgi_app', ProxyFix(app.wsgi_app, x_for=1))
+    assert client.get(path, headers={'X-Forwarded-For': '127.0.0.1'},
+                      environ_base={'REMOTE_ADDR': '10.0.0.2'}).status_code == 403
+
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 'secret-token')
+    assert client.get(path).status_code == 403
+    assert client.get(path, headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    assert client.get(path, headers={'Authorization': 'Bearer secret-token'},
+                      environ_base={'REMOTE_ADDR': '203.0.113.5'}).status_code == 200
+
+
+def test_csp_nonce_is_generated_once_and_matches_header(client, monkeypatch):
+    tokens = []
+    monkeypatch.setattr(csp.secrets, 'token_urlsafe', lambda size: tokens.append(size) or f"n{len(tokens)}")
+    with app.test_request_context('/'):
+        html = render_template_string('<script nonce="{{ csp_nonce }}"></script>{{ csp_nonce }}')
+        policy = csp.header()
+    assert html == '<script nonce="n1"></script>n1'
+    assert "script-src 'self' 'nonce-n1'; style-src" in policy
+    assert len(tokens) == 1
+
+    response = client.get('/api/v1/notes')
+    assert 'nonce-' not in response.headers['Content-Security-Policy']
+    assert len(tokens) == 1
+
+
+def test_route_csp_policy(client):
+    response = client.post('/submit_feedback', data={'username': 'alice', 'feedback': 'ok'})
+    assert response.headers['Content-Security-Policy'] == (
+        "default-src 'none'; frame-ancestors 'none'; base-uri 'none'"
+    )
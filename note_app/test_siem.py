@@ -0,0 +1,472 @@
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+
+import psycopg2
+import pytest
+
+from event_store import EventStore, encode_events
+from siem_alerts import Alert, AlertDispatcher, AlertSink
+from siem_monitor import SIEMMonitor
+from siem_parser import LogParser, LogRecord
+from siem_replay import expand_log_paths, read_log_lines
+from siem_stats import SpaceSaving, StatsStore
+from siem_tail import LogTailer
+from siem_pipeline import SIEMPipeline, WorkerDied, shard_key
+from siem_windows import SlidingWindowCounter
+
+START = datetime(2024, 1, 1, 12, 0, 0)
+
+
+class RecordingMonitor(SIEMMonitor):
+    """Монитор без файлов и приемников, запоминающий алерты"""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('checkpoint_file', None)
+        kwargs.setdefault('stats_db', None)
+        super().__init__(alert_sinks=[], **kwargs)
+        self.alerts = []
+
+    def trigger_alert(self, alert_type, description, log_entry):
+        self.alerts.append((alert_type, log_entry.ip, log_entry.timestamp))
+        super().trigger_alert(alert_type, description, log_entry)
+
+
+def log_line(seconds, ip, message, fmt='text', level='INFO'):
+    timestamp = (START + timedelta(seconds=seconds)).isoformat()
+    if fmt == 'json':
+        return json.dumps({'ts': timestamp, 'level': level, 'ip': ip, 'message': message}, ensure_ascii=False)
+    return f"{timestamp} - {level} - [IP: {ip}] - {message}"
+
+
+def attack_lines(fmt='text'):
+    """Обычный трафик вперемешку с двумя brute force, инъекцией и сканированием"""
+    lines = []
+    for second in range(200):
+        lines.append(log_line(second, f"10.0.0.{second % 50}", 'Request: GET / - 200', fmt))
+        if second % 10 == 0 and second < 100:
+            lines.append(log_line(second, '192.168.1.66', 'Failed login attempt - username: admin', fmt))
+        if second % 5 == 0 and second < 30:
+            lines.append(log_line(second, '192.168.1.77', f'Failed login attempt - username: user{second}', fmt))
+    lines.append(log_line(150, '10.0.0.5', "Request: GET /search?q=' OR 1=1-- - 200", fmt))
+    lines.append(log_line(160, '10.0.0.6', 'Request: GET /admin - 404', fmt))
+    return lines
+
+
+def run_serial(lines):
+    monitor = RecordingMonitor()
+    for line in lines:
+        monitor.process_line(line)
+    monitor.close()
+    return monitor
+
+
+def run_pipeline(lines, workers=4):
+    monitor = RecordingMonitor()
+    SIEMPipeline(monitor, workers, batch_size=64).run(iter(lines))
+    monitor.close()
+    return monitor
+
+
+@pytest.mark.parametrize('fmt', ['text', 'json'])
+def test_pipeline_matches_serial_run(fmt):
+    lines = attack_lines(fmt)
+    serial = run_serial(lines)
+    # .66: по 5 попыток за 40 с дважды и 10 попыток к admin за 5 мин; .77: 5 попыток за 20 с
+    assert sorted((alert_type, ip) for alert_type, ip, _ in serial.alerts) == [
+        ('ACCOUNT_BRUTE_FORCE', '192.168.1.66'),
+        ('BRUTE_FORCE', '192.168.1.66'), ('BRUTE_FORCE', '192.168.1.66'), ('BRUTE_FORCE', '192.168.1.77'),
+        ('ENDPOINT_SCANNING', '10.0.0.6'), ('SQL_INJECTION', '10.0.0.5'),
+    ]
+    pipeline = run_pipeline(lines)
+    assert sorted(pipeline.alerts) == sorted(serial.alerts)
+    assert pipeline.stats['total_requests'] == len(lines)
+
+
+
+@pytest.mark.parametrize('message, rule', [
+    ("Request: GET /search?q=' OR 1=1-- - 200", "'.*OR.*1=1"),
+    ('Request: GET /items?id=1 union select password from users - 200', 'UNION.*SELECT.*FROM'),
+    ("Request: GET /notes?sort=title'-- - 200", "'.*--"),
+    ('Request: GET / - 200', None),
+    ("Request: GET /search?q=O'Reilly - 200", None),
+    ('Request: GET /select/from/union - 200', None),
+])
+def test_sql_injection_rules(message, rule):
+    assert RecordingMonitor().match_sql_injection(message) == rule
+
+
+def test_sql_injection_literal_filter():
+    regex, literals = SIEMMonitor.compile_sql_injection_patterns([r"'.*OR.*1=1", r"UNION.*SELECT.*FROM"])
+    assert sorted(literals) == ['1=1', 'select']
+    assert regex.search("x' or 1=1").lastgroup == 'rule0'
+    # Правило сложнее литералов и '.*' отключает фильтр
+    regex, literals = SIEMMonitor.compile_sql_injection_patterns([r"'.*OR.*1=1", r"SLEEP\(\d+\)"])
+    assert literals is None
+    assert regex.search('sleep(5)').lastgroup == 'rule1'
+
+
+def test_sliding_window_counter():
+    counter = SlidingWindowCounter(timedelta(minutes=1), threshold=3, max_keys=2)
+    assert [counter.hit('a', START + timedelta(seconds=s)) for s in (0, 10, 20, 30)] == [1, 2, 3, 3]
+    # Метки старше окна не учитываются
+    assert counter.hit('a', START + timedelta(seconds=85)) == 2
+    counter.reset('a')
+    assert counter.hit('a', START + timedelta(seconds=86)) == 1
+
+    # Сверх max_keys вытесняется ключ с самым давним событием
+    counter.hit('b', START + timedelta(seconds=87))
+    counter.hit('a', START + timedelta(seconds=88))
+    counter.hit('c', START + timedelta(seconds=89))
+    assert len(counter) == 2 and counter.evicted == 1
+    assert counter.hit('b', START + timedelta(seconds=90)) == 1
+    # Ключи без событий дольше окна вытесняются при следующем событии
+    counter.hit('d', START + timedelta(minutes=5))
+    assert len(counter) == 1
+
+
+def test_window_rule_alerts_once_per_threshold():
+    monitor = RecordingMonitor()
+    for second in range(0, 60, 5):
+        monitor.process_line(log_line(second, '10.9.9.9', 'Failed login attempt - username: root'))
+    monitor.close()
+    # 12 попыток за минуту: счетчик IP сбрасывается после алерта, второй алерт на 10-й
+    # попытке, она же - порог правила по имени пользователя
+    assert [(alert_type, timestamp) for alert_type, _, timestamp in monitor.alerts] == [
+        ('BRUTE_FORCE', START + timedelta(seconds=20)),
+        ('BRUTE_FORCE', START + timedelta(seconds=45)),
+        ('ACCOUNT_BRUTE_FORCE', START + timedelta(seconds=45)),
+    ]
+
+
+def test_parser_formats_and_failures():
+    parser = LogParser()
+    text = parser.parse(log_line(1, '10.0.0.1', 'Request: GET / - 200'))
+    assert text[:4] == (START + timedelta(seconds=1), 'INFO', '10.0.0.1', 'Request: GET / - 200')
+    record = parser.parse(log_line(2, '10.0.0.2', 'сообщение - с - разделителями', 'json', 'WARNING'))
+    assert record[:4] == (START + timedelta(seconds=2), 'WARNING', '10.0.0.2', 'сообщение - с - разделителями')
+    assert parser.parse('2024-01-01T12:00:00 - INFO - без адреса - x').ip == 'unknown'
+    for broken in ('', 'мусор', 'not-a-date - INFO - [IP: 1.2.3.4] - x', '{"ts": "2024-01-01"}', '{oops'):
+        assert parser.parse(broken) is None
+    assert (parser.lines, parser.failures) == (8, 5)
+
+
+def write_log(path, lines, compressed=False):
+    data = ''.join(f"{line}\n" for line in lines).encode('utf-8')
+    with (gzip.open(path, 'wb') if compressed else open(path, 'wb')) as f:
+        f.write(data)
+
+
+def test_replay_reads_rotated_copies_in_order(tmp_path):
+    log = str(tmp_path / 'application.log')
+    write_log(f"{log}.10.gz", ['1'], compressed=True)
+    write_log(f"{log}.2.gz", ['2', '3'], compressed=True)
+    write_log(f"{log}.1", ['4'])
+    write_log(log, ['5', '6'])
+    write_log(f"{log}.bak", ['x'])
+    assert expand_log_paths([log]) == [f"{log}.10.gz", f"{log}.2.gz", f"{log}.1", log]
+    # Маленький блок: строки собираются на границах блоков
+    assert list(read_log_lines([log], chunk_size=3)) == ['1', '2', '3', '4', '5', '6']
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_replay_matches_serial_run(tmp_path, monkeypatch, workers):
+    monkeypatch.chdir(tmp_path)
+    # Интервал отчета берется по первой и последней строке, поэтому строки по времени
+    lines = sorted(attack_lines())
+    log = str(tmp_path / 'application.log')
+    write_log(f"{log}.1.gz", lines[:100], compressed=True)
+    write_log(log, lines[100:])
+    monitor = RecordingMonitor(stats_db=str(tmp_path / 'stats.db'))
+    report = monitor.replay([log], workers=workers)
+    assert sorted(monitor.alerts) == sorted(run_serial(lines).alerts)
+    assert f"Всего обработано запросов: {len(lines)}" in report
+    assert 'SQL_INJECTION: 1 случаев' in report
+    assert os.path.exists(monitor.report_file)
+
+
+class ListSink(AlertSink):
+    name = 'list'
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.alerts = []
+
+    def write_batch(self, alerts):
+        self.alerts.extend(alerts)
+
+
+def make_alert(seconds, alert_type='BRUTE_FORCE', ip='10.0.0.1'):
+    event_time = START + timedelta(seconds=seconds)
+    return Alert(event_time, alert_type, ip, '', event_time, f"{alert_type} {ip} {seconds}")
+
+
+def test_alert_dispatcher_suppresses_repeats():
+    sink = ListSink(batch_size=2)
+    dispatcher = AlertDispatcher([sink], dedup_window=timedelta(seconds=60), max_keys=10)
+    results = [dispatcher.dispatch(alert) for alert in (
+        make_alert(0), make_alert(30), make_alert(31, ip='10.0.0.2'),
+        make_alert(32, alert_type='SQL_INJECTION'), make_alert(60), make_alert(61),
+    )]
+    dispatcher.stop()
+    assert results == [True, False, True, True, True, False]
+    assert [alert.message for alert in sink.alerts] == [
+        'BRUTE_FORCE 10.0.0.1 0', 'BRUTE_FORCE 10.0.0.2 31', 'SQL_INJECTION 10.0.0.1 32', 'BRUTE_FORCE 10.0.0.1 60',
+    ]
+    stats = dispatcher.stats()
+    assert (stats['dispatched'], stats['suppressed']) == (4, 2)
+    assert stats['sinks']['list'] == {'sent': 4, 'dropped': 0, 'errors': 0, 'queued': 0}
+
+
+def test_alert_sink_counts_failed_batches():
+    class FailingSink(ListSink):
+        def write_batch(self, alerts):
+            raise OSError('unavailable')
+
+    sink = FailingSink()
+    dispatcher = AlertDispatcher([sink])
+    dispatcher.dispatch(make_alert(0))
+    dispatcher.dispatch(make_alert(0, ip='10.0.0.2'))
+    dispatcher.stop()
+    assert sink.sent == 0 and sink.dropped == 2 and sink.errors >= 1
+
+
+def test_space_saving_bounds_error():
+    summary = SpaceSaving(3)
+    for key in ['a'] * 10 + ['b'] * 5 + ['c', 'd', 'e']:
+        summary.add(key)
+    assert len(summary) == 3
+    top = summary.top()
+    assert top[:2] == [('a', 10, 0), ('b', 5, 0)]
+    # Вытесненный ключ наследует минимальный счетчик как погрешность
+    key, count, error = top[2]
+    assert key == 'e' and count - error == 1
+
+
+def test_stats_store_report_survives_restart(tmp_path):
+    path = str(tmp_path / 'stats.db')
+    store = StatsStore(path, top_k=2, flush_interval=60)
+    for second in range(0, 7200, 30):
+        store.record_request(START + timedelta(seconds=second))
+    store.add_requests({START + timedelta(hours=3): 5})
+    for ip, times in (('10.0.0.1', 3), ('10.0.0.2', 2), ('10.0.0.3', 1)):
+        for _ in range(times):
+            store.record_incident('BRUTE_FORCE', ip, START + timedelta(minutes=10))
+    store.record_incident('SQL_INJECTION', '10.0.0.1', START + timedelta(hours=1, minutes=5))
+    store.close()
+
+    store = StatsStore(path, top_k=2)
+    report = store.report(START, START + timedelta(hours=2))
+    assert report['requests'] == 240
+    assert report['incidents'] == 7
+    assert report['incident_types'] == {'BRUTE_FORCE': 6, 'SQL_INJECTION': 1}
+    assert report['hourly'] == [('2024-01-01 12', 120, 6), ('2024-01-01 13', 120, 1)]
+    assert report['top_ips'][0] == ('10.0.0.1', 4, 0)
+    # Интервал берется по минутам: первый час отдельно
+    first_hour = store.report(START, START + timedelta(hours=1))
+    assert (first_hour['requests'], first_hour['incidents']) == (120, 6)
+    store.close()
+
+
+def test_shard_key_matches_parser():
+    monitor = RecordingMonitor()
+    for line in (log_line(0, '10.1.2.3', 'x'), log_line(0, '10.1.2.3', 'x', 'json'),
+                 log_line(0, None, 'x', 'json'), '2024-01-01T12:00:00 - INFO - no ip - x'):
+        assert shard_key(line) == monitor.parse_log_line(line).ip
+
+
+class FakeConnection:
+    """Соединение PostgreSQL для EventStore: COPY отклоняет строки с 'bad'"""
+
+    def __init__(self):
+        self.closed = 0
+        self.committed = []
+        self.pending = []
+        self.fail_next = None
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.committed.extend(self.pending)
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        pass
+
+    def copy_expert(self, query, data):
+        if self.conn.fail_next is not None:
+            error, self.conn.fail_next = self.conn.fail_next, None
+            if isinstance(error, psycopg2.OperationalError):
+                self.conn.closed = 2
+            raise error
+        lines = data.read().splitlines()
+        if any('bad' in line for line in lines):
+            raise psycopg2.DataError('invalid input')
+        self.conn.pending.extend(lines)
+
+
+class FakeEventStore(EventStore):
+    def _connect(self):
+        self.conn = FakeConnection()
+
+
+def event_record(index, message='Request: GET / - 200'):
+    return LogRecord(START + timedelta(seconds=index), 'INFO', f"10.0.0.{index % 5}", message, '')
+
+
+def test_event_store_rejects_only_bad_rows():
+    store = FakeEventStore('fake', batch_size=1000, flush_interval=60)
+    for index in range(100):
+        store.add(event_record(index, 'bad\x00row' if index in (13, 77) else 'Request: GET / - 200'))
+    store.flush(timeout=10)
+    stats = store.stats()
+    assert (stats['written'], stats['rejected'], stats['dropped']) == (98, 2, 0)
+    assert len(store.conn.committed) == 98
+    store.close()
+
+
+def test_event_store_retries_batch_after_connection_loss(monkeypatch):
+    monkeypatch.setattr('event_store.time.sleep', lambda seconds: None)
+    store = FakeEventStore('fake', batch_size=1000, flush_interval=60)
+    store.conn.fail_next = psycopg2.OperationalError('server closed the connection')
+    for index in range(50):
+        store.add(event_record(index))
+    store.flush(timeout=10)
+    stats = store.stats()
+    assert (stats['written'], stats['dropped'], stats['errors']) == (50, 0, 1)
+    assert len(store.conn.committed) == 50
+    store.close()
+
+
+def test_copy_escape_handles_control_characters():
+    rows = [(START, '10.0.0.1', 'INFO', 'a\tb\nc\\d\x00e')]
+    assert encode_events(rows) == f"{START.isoformat()}\t10.0.0.1\tINFO\ta\\tb\\nc\\\\d�e\n"
+
+
+def read_until_idle(lines):
+    """Строки генератора LogTailer.lines(yield_idle=True) до конца файла"""
+    result = []
+    for line in lines:
+        if line is None:
+            return result
+        result.append(line)
+
+
+def append(path, *lines):
+    with open(path, 'a') as f:
+        f.write(''.join(f"{line}\n" for line in lines))
+
+
+def test_tailer_resumes_from_checkpoint_mid_block(tmp_path):
+    log, checkpoint = tmp_path / 'app.log', tmp_path / 'checkpoint.json'
+    log.write_text('старая строка\n')
+    lines = LogTailer(str(log), str(checkpoint), use_inotify=False, idle_timeout=0.01).lines(yield_idle=True)
+    # Без контрольной точки чтение начинается с конца файла
+    assert read_until_idle(lines) == []
+    append(log, *(f"строка {i}" for i in range(5)))
+    assert [next(lines) for _ in range(3)] == ['строка 0', 'строка 1', 'строка 2']
+    lines.close()
+
+    # Все пять строк пришли одним блоком, но отданные не повторяются
+    lines = LogTailer(str(log), str(checkpoint), use_inotify=False, idle_timeout=0.01).lines(yield_idle=True)
+    assert read_until_idle(lines) == ['строка 3', 'строка 4']
+    lines.close()
+
+
+def test_tailer_follows_rotation_and_truncation(tmp_path):
+    log, checkpoint = tmp_path / 'app.log', tmp_path / 'checkpoint.json'
+    log.write_text('')
+    tailer = LogTailer(str(log), str(checkpoint), use_inotify=False, idle_timeout=0.01)
+    lines = tailer.lines(yield_idle=True)
+    read_until_idle(lines)
+    append(log, 'a1', 'a2')
+
+    # Строки, дописанные в файл после переименования, дочитываются до перехода к новому
+    os.rename(log, f"{log}.1")
+    append(f"{log}.1", 'a3')
+    append(log, 'b1')
+    assert read_until_idle(lines) == ['a1', 'a2', 'a3', 'b1']
+    assert tailer.rotations == 1
+
+    # Усечение определяется по размеру меньше прочитанного
+    log.write_text('')
+    assert read_until_idle(lines) == []
+    append(log, 'c1')
+    assert read_until_idle(lines) == ['c1']
+    assert tailer.truncations == 1
+    lines.close()
+
+
+def test_tailer_drains_old_file_before_switching(tmp_path):
+    log, checkpoint = tmp_path / 'app.log', tmp_path / 'checkpoint.json'
+    log.write_text('')
+    tailer = LogTailer(str(log), str(checkpoint), use_inotify=False, idle_timeout=0.01)
+    lines = tailer.lines(yield_idle=True)
+    read_until_idle(lines)
+    append(log, 'a1')
+    with open(log, 'a') as f:
+        f.write('a2')
+    assert read_until_idle(lines) == ['a1']
+
+    check_rotation = tailer._check_rotation
+
+    def rotate_after_last_read():
+        # Писатель дописывает строки и ротирует файл между последним чтением и проверкой
+        if not os.path.exists(f"{log}.1"):
+            with open(log, 'a') as f:
+                f.write('\na3\na4')
+            os.rename(log, f"{log}.1")
+            append(log, 'b1')
+        return check_rotation()
+
+    tailer._check_rotation = rotate_after_last_read
+    # Незавершенная строка старого файла отдается целиком
+    assert read_until_idle(lines) == ['a2', 'a3', 'a4', 'b1']
+    assert tailer.rotations == 1
+    lines.close()
+
+
+def test_tailer_finishes_file_rotated_while_stopped(tmp_path):
+    log, checkpoint = tmp_path / 'app.log', tmp_path / 'checkpoint.json'
+    log.write_text('')
+    lines = LogTailer(str(log), str(checkpoint), use_inotify=False, idle_timeout=0.01).lines(yield_idle=True)
+    read_until_idle(lines)
+    append(log, 'a1')
+    assert read_until_idle(lines) == ['a1']
+    lines.close()
+
+    append(log, 'a2')
+    os.rename(log, f"{log}.1")
+    append(log, 'b1')
+    lines = LogTailer(str(log), str(checkpoint), use_inotify=False, idle_timeout=0.01).lines(yield_idle=True)
+    assert read_until_idle(lines) + read_until_idle(lines) == ['a2', 'b1']
+    lines.close()
+
+
+def test_pipeline_fails_instead_of_hanging_when_worker_dies():
+    monitor = RecordingMonitor()
+    # Некорректное правило: монитор воркера падает при создании
+    pipeline = SIEMPipeline(monitor, 2, batch_size=10, monitor_kwargs={'window_rules': {'BROKEN': {}}})
+    with pytest.raises(WorkerDied):
+        pipeline.run(iter(attack_lines()[:50]))
+    assert all(not process.is_alive() for process in pipeline._processes)
+    monitor.close()
@@ -0,0 +1,156 @@
+"""Потоковый экспорт и импорт заметок (NDJSON и CSV, опционально gzip).
+
+Экспорт кодирует строки результата по мере чтения и отдает их блоками
+около CHUNK_SIZE байт; импорт читает тело запроса блоками и разбирает его
+построчно. Ни одна из сторон не держит в памяти все заметки пользователя.
+"""
+import codecs
+import csv
+import json
+import zlib
+
+CHUNK_SIZE = 64 * 1024
+# Предел длины строки NDJSON и поля CSV при импорте, символов
+MAX_FIELD_SIZE = 16 * 1024 * 1024
+
+COLUMNS = ['id', 'title', 'date', 'content']
+
+EXPORT_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+# Для этих типов браузер, как и для JSON, требует CORS preflight, поэтому
+# кросс-доменная форма не может отправить импорт
+IMPORT_FORMATS = {'application/x-ndjson': 'ndjson', 'text/csv': 'csv'}
+
+
+def encode_ndjson(rows):
+    for note_id, title, date, content in rows:
+        yield json.dumps(
+            {'id': note_id, 'title': title, 'date': date.isoformat() if date else None, 'content': content},
+            ensure_ascii=False,
+        ) + '\n'
+
+
+def encode_csv(rows):
+    buffer = _LineBuffer()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    yield buffer.take()
+    for note_id, title, date, content in rows:
+        writer.writerow([note_id, title, date.isoformat() if date else '', content])
+        yield buffer.take()
+
+
+class _LineBuffer:
+    """Приемник csv.writer, из которого записанное забирается по частям"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, value):
+        self.parts.append(value)
+
+    def take(self):
+        value = ''.join(self.parts)
+        self.parts = []
+        return value
+
+
+ENCODERS = {'ndjson': encode_ndjson, 'csv': encode_csv}
+
+
+def export_chunks(rows, fmt, compressed=False, chunk_size=CHUNK_SIZE):
+    """Блоки байт экспорта строк (id, title, date, content)"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compressed else None
+    parts = []
+    size = 0
+    for text in ENCODERS[fmt](rows):
+        parts.append(text)
+        size += len(text)
+        if size < chunk_size:
+            continue
+        data = ''.join(parts).encode('utf-8')
+        parts = []
+        size = 0
+        if compressor is not None:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    data = ''.join(parts).encode('utf-8')
+    if compressor is not None:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+def _read_chunks(stream, chunk_size):
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            return
+        yield data
+
+
+def _decompress_chunks(stream, chunk_size):
+    # Выход ограничен chunk_size на вызов, так что сильно сжатое тело не
+    # распаковывается в память целиком
+    decompressor = zlib.decompressobj(wbits=47)
+    for data in _read_chunks(stream, chunk_size):
+        while data:
+            yield decompressor.decompress(data, chunk_size)
+            data = decompressor.unconsumed_tail
+    yield decompressor.flush()
+
+
+def read_lines(stream, compressed=False, chunk_size=CHUNK_SIZE):
+    """Строки текста (с '\\n' на конце) из потока байт UTF-8.
+
+    Делятся только по '\\n': остальные разделители строк Unicode могут
+    встречаться внутри значений NDJSON без экранирования.
+    """
+    chunks = _decompress_chunks(stream, chunk_size) if compressed else _read_chunks(stream, chunk_size)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    tail = ''
+    for data in chunks:
+        lines = (tail + decoder.decode(data)).split('\n')
+        tail = lines.pop()
+        if len(tail) > MAX_FIELD_SIZE:
+            raise ValueError('Слишком длинная строка')
+        for line in lines:
+            yield line + '\n'
+    tail += decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def parse_ndjson(lines):
+    """(номер строки, объект или None, ошибка или None) для каждой непустой строки"""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            yield number, None, 'Некорректный JSON'
+            continue
+        yield number, item, None
+
+
+def parse_csv(lines):
+    """То же для CSV с заголовком; поля id и date необязательны"""
+    csv.field_size_limit(max(csv.field_size_limit(), MAX_FIELD_SIZE))
+    reader = csv.DictReader(lines)
+    if reader.fieldnames is None:
+        return
+    missing = {'title', 'content'} - set(reader.fieldnames)
+    if missing:
+        raise ValueError(f"В заголовке CSV нет столбцов: {', '.join(sorted(missing))}")
+    for row in reader:
+        if not row.get('date'):
+            row.pop('date', None)
+        yield reader.line_num, row, None
+
+
+PARSERS = {'ndjson': parse_ndjson, 'csv': parse_csv}
+
+
+def parse(fmt, stream, compressed=False):
+    return PARSERS[fmt](read_lines(stream, compressed))